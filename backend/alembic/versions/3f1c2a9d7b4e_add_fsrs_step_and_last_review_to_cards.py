@@ -0,0 +1,30 @@
+"""Add fsrs_step and fsrs_last_review to cards
+
+Revision ID: 3f1c2a9d7b4e
+Revises: 8ab0c9709ebe
+Create Date: 2026-10-17 09:12:40.118532
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '3f1c2a9d7b4e'
+down_revision: Union[str, None] = '8ab0c9709ebe'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('card', sa.Column('fsrs_step', sa.Integer(), nullable=True))
+    op.add_column('card', sa.Column('fsrs_last_review', sa.DateTime(), nullable=True))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column('card', 'fsrs_last_review')
+    op.drop_column('card', 'fsrs_step')
@@ -0,0 +1,45 @@
+"""Add client-assignable uuid to decks and cards
+
+Revision ID: a7e1c5d9b3f2
+Revises: f2d6b9e4a1c3
+Create Date: 2026-10-17 15:06:27.384120
+
+"""
+from typing import Sequence, Union
+import uuid
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'a7e1c5d9b3f2'
+down_revision: Union[str, None] = 'f2d6b9e4a1c3'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    connection = op.get_bind()
+    for table in ('deck', 'card'):
+        op.add_column(table, sa.Column('uuid', sa.String(), nullable=True))
+        ids = connection.execute(sa.text(f"SELECT id FROM {table}")).scalars().all()
+        if ids:
+            connection.execute(
+                sa.text(f"UPDATE {table} SET uuid = :uuid WHERE id = :id"),
+                [{"uuid": str(uuid.uuid4()), "id": row_id} for row_id in ids]
+            )
+            # Los clientes reciben el uuid asignado en su próximo pull por seq
+            connection.execute(sa.text(
+                "INSERT INTO changelog (entity_type, entity_id, operation, changed_at) "
+                f"SELECT '{table}', id, 'update', CURRENT_TIMESTAMP FROM {table} ORDER BY id"
+            ))
+        op.create_index(f'ix_{table}_uuid', table, ['uuid'], unique=True)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    for table in ('card', 'deck'):
+        op.drop_index(f'ix_{table}_uuid', table_name=table)
+        op.drop_column(table, 'uuid')
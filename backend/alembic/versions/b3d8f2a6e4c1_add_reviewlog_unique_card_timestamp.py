@@ -0,0 +1,33 @@
+"""Add unique (card_id, review_timestamp) key to reviewlog
+
+Revision ID: b3d8f2a6e4c1
+Revises: a7e1c5d9b3f2
+Create Date: 2026-10-17 16:21:53.207645
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b3d8f2a6e4c1'
+down_revision: Union[str, None] = 'a7e1c5d9b3f2'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # Repasos duplicados previos: se conserva el primero de cada (card_id, review_timestamp)
+    op.execute(
+        "DELETE FROM reviewlog WHERE id NOT IN "
+        "(SELECT MIN(id) FROM reviewlog GROUP BY card_id, review_timestamp)"
+    )
+    op.create_index('uq_reviewlog_card_timestamp', 'reviewlog', ['card_id', 'review_timestamp'], unique=True)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('uq_reviewlog_card_timestamp', table_name='reviewlog')
@@ -0,0 +1,28 @@
+"""Add composite due-queue index to cards
+
+Revision ID: b7e4d2c81f3a
+Revises: 3f1c2a9d7b4e
+Create Date: 2026-10-17 10:03:27.552190
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b7e4d2c81f3a'
+down_revision: Union[str, None] = '3f1c2a9d7b4e'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_index('ix_card_due_queue', 'card', ['is_deleted', 'deck_id', 'next_review_at'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_card_due_queue', table_name='card')
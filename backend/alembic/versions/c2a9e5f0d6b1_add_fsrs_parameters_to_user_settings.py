@@ -0,0 +1,28 @@
+"""Add fsrs_parameters to user settings
+
+Revision ID: c2a9e5f0d6b1
+Revises: b7e4d2c81f3a
+Create Date: 2026-10-17 11:21:54.730914
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c2a9e5f0d6b1'
+down_revision: Union[str, None] = 'b7e4d2c81f3a'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('usersettings', sa.Column('fsrs_parameters', sa.JSON(), nullable=True))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column('usersettings', 'fsrs_parameters')
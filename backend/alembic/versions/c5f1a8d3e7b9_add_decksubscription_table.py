@@ -0,0 +1,41 @@
+"""Add decksubscription table for per-device partial sync
+
+Revision ID: c5f1a8d3e7b9
+Revises: b3d8f2a6e4c1
+Create Date: 2026-10-17 17:02:18.640913
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c5f1a8d3e7b9'
+down_revision: Union[str, None] = 'b3d8f2a6e4c1'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table(
+        'decksubscription',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('device_id', sa.String(), nullable=False),
+        sa.Column('deck_id', sa.Integer(), nullable=False),
+        sa.Column('is_active', sa.Boolean(), nullable=False),
+        sa.Column('updated_at', sa.DateTime(), nullable=False),
+        sa.ForeignKeyConstraint(['deck_id'], ['deck.id']),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('uq_decksubscription_device_deck', 'decksubscription', ['device_id', 'deck_id'], unique=True)
+    op.create_index('ix_decksubscription_deck_id', 'decksubscription', ['deck_id'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_decksubscription_deck_id', table_name='decksubscription')
+    op.drop_index('uq_decksubscription_device_deck', table_name='decksubscription')
+    op.drop_table('decksubscription')
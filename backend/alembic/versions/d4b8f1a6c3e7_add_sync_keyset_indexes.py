@@ -0,0 +1,30 @@
+"""Add (updated_at, id) keyset indexes for sync pull
+
+Revision ID: d4b8f1a6c3e7
+Revises: c2a9e5f0d6b1
+Create Date: 2026-10-17 11:42:08.314527
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'd4b8f1a6c3e7'
+down_revision: Union[str, None] = 'c2a9e5f0d6b1'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_index('ix_deck_sync_keyset', 'deck', ['updated_at', 'id'], unique=False)
+    op.create_index('ix_card_sync_keyset', 'card', ['updated_at', 'id'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_card_sync_keyset', table_name='card')
+    op.drop_index('ix_deck_sync_keyset', table_name='deck')
@@ -0,0 +1,49 @@
+"""Add changelog table for sequence-based sync
+
+Revision ID: e9c3a7b2f5d8
+Revises: d4b8f1a6c3e7
+Create Date: 2026-10-17 12:25:41.907316
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e9c3a7b2f5d8'
+down_revision: Union[str, None] = 'd4b8f1a6c3e7'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table(
+        'changelog',
+        sa.Column('seq', sa.Integer(), nullable=False),
+        sa.Column('entity_type', sa.String(), nullable=False),
+        sa.Column('entity_id', sa.Integer(), nullable=False),
+        sa.Column('operation', sa.String(), nullable=False),
+        sa.Column('changed_at', sa.DateTime(), nullable=False),
+        sa.PrimaryKeyConstraint('seq'),
+        sqlite_autoincrement=True
+    )
+    op.create_index('ix_changelog_entity', 'changelog', ['entity_type', 'entity_id'], unique=False)
+
+    # Las filas existentes entran como un único "insert" para que un pull por seq desde 0 las incluya
+    op.execute(
+        "INSERT INTO changelog (entity_type, entity_id, operation, changed_at) "
+        "SELECT 'deck', id, 'insert', updated_at FROM deck ORDER BY updated_at, id"
+    )
+    op.execute(
+        "INSERT INTO changelog (entity_type, entity_id, operation, changed_at) "
+        "SELECT 'card', id, 'insert', updated_at FROM card ORDER BY updated_at, id"
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_changelog_entity', table_name='changelog')
+    op.drop_table('changelog')
@@ -0,0 +1,29 @@
+"""Add changed_columns mask to changelog
+
+Revision ID: f2d6b9e4a1c3
+Revises: e9c3a7b2f5d8
+Create Date: 2026-10-17 13:48:12.530917
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'f2d6b9e4a1c3'
+down_revision: Union[str, None] = 'e9c3a7b2f5d8'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # Las entradas existentes quedan en NULL: se envían como registro completo
+    op.add_column('changelog', sa.Column('changed_columns', sa.Integer(), nullable=True))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column('changelog', 'changed_columns')
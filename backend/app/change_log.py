@@ -0,0 +1,252 @@
+"""
+Registro de cambios (change feed) para la sincronización de JuanPA.
+Cada alta, modificación o borrado de un mazo o una tarjeta añade una entrada
+con un número de secuencia global creciente, en la misma transacción que el
+cambio. El pull puede así pedir "cambios después de seq N" sin depender de
+relojes ni de updated_at.
+
+Las entradas de tarjetas guardan además una máscara de bits con las columnas
+modificadas, de modo que el pull puede enviar solo esas columnas (delta).
+
+El último seq (high-water mark) se cachea en memoria para responder a los
+sondeos de sincronización (ETag / 304) sin leer mazos ni tarjetas, y cada
+commit con cambios se notifica a los clientes suscritos.
+"""
+
+import asyncio
+import threading
+import time
+from typing import Iterable, List, Optional, Tuple
+
+from sqlalchemy import event, func, insert, inspect, update
+from sqlalchemy.engine import Connection, Engine
+from sqlalchemy.orm import Session as OrmSession
+from sqlmodel import Session, delete, select
+
+from . import db_models as db
+from .config import settings
+from .logging_config import get_logger
+from .sync_notifications import change_broadcaster
+
+logger = get_logger("juanpa.change_log")
+
+CHANGE_OPERATIONS = ("insert", "update", "delete")
+
+_ENTITY_TYPES = {db.Deck: "deck", db.Card: "card"}
+
+# Columnas de tarjeta con bit propio en la máscara de cambios; el orden fija el bit
+# y no debe alterarse (solo añadir al final)
+CARD_TRACKED_COLUMNS = (
+    "deck_id", "front_content", "back_content", "cloze_data", "tags",
+    "next_review_at", "fsrs_stability", "fsrs_difficulty", "fsrs_lapses",
+    "fsrs_state", "fsrs_step", "fsrs_last_review", "is_deleted", "deleted_at",
+)
+_CARD_COLUMN_BITS = {name: 1 << bit for bit, name in enumerate(CARD_TRACKED_COLUMNS)}
+
+
+def column_mask(columns: Iterable[str]) -> int:
+    """Máscara de bits de las columnas de tarjeta indicadas (las no rastreadas se ignoran)."""
+    mask = 0
+    for name in columns:
+        mask |= _CARD_COLUMN_BITS.get(name, 0)
+    return mask
+
+
+def mask_columns(mask: int) -> List[str]:
+    """Columnas de tarjeta contenidas en una máscara, en el orden de CARD_TRACKED_COLUMNS."""
+    return [name for name in CARD_TRACKED_COLUMNS if mask & _CARD_COLUMN_BITS[name]]
+
+
+def record_changes(
+    connection: Connection,
+    entity_type: str,
+    entity_ids: Iterable[int],
+    operation: str,
+    changed_columns: Optional[int] = None,
+) -> None:
+    """
+    Añade entradas al registro de cambios. Las escrituras ORM se registran
+    solas; las operaciones masivas a nivel Core deben llamarla explícitamente.
+
+    `changed_columns` es la máscara de columnas modificadas de un "update" de
+    tarjetas; None significa "todas" y obliga a enviar el registro completo.
+    """
+    rows = [
+        {"entity_type": entity_type, "entity_id": entity_id, "operation": operation, "changed_columns": changed_columns}
+        for entity_id in entity_ids
+    ]
+    if rows:
+        connection.execute(insert(db.ChangeLog), rows)
+        # El high-water mark cacheado se invalida cuando la transacción se confirma
+        connection.info[_PENDING_CHANGES_KEY] = True
+
+
+def _after_insert(mapper, connection: Connection, target) -> None:
+    record_changes(connection, _ENTITY_TYPES[mapper.class_], [target.id], "insert")
+
+
+def _after_update(mapper, connection: Connection, target) -> None:
+    state = inspect(target)
+    changed = [attr.key for attr in mapper.column_attrs if state.attrs[attr.key].history.has_changes()]
+    # after_update también se dispara para objetos "dirty" sin cambios netos en columnas
+    if not changed:
+        return
+    deleted_history = state.attrs.is_deleted.history
+    operation = "delete" if target.is_deleted and deleted_history.has_changes() else "update"
+    entity_type = _ENTITY_TYPES[mapper.class_]
+    changed_columns = column_mask(changed) if entity_type == "card" and operation == "update" else None
+    record_changes(connection, entity_type, [target.id], operation, changed_columns)
+
+
+def _after_delete(mapper, connection: Connection, target) -> None:
+    record_changes(connection, _ENTITY_TYPES[mapper.class_], [target.id], "delete")
+
+
+for _model in _ENTITY_TYPES:
+    event.listen(_model, "after_insert", _after_insert)
+    event.listen(_model, "after_update", _after_update)
+    event.listen(_model, "after_delete", _after_delete)
+
+
+def current_seq(session: Session) -> int:
+    """Último número de secuencia registrado (0 si el registro está vacío)."""
+    return session.exec(select(func.max(db.ChangeLog.seq))).one() or 0
+
+
+_PENDING_CHANGES_KEY = "juanpa_change_log_pending"
+
+
+class SyncWatermark:
+    """
+    Último seq del registro de cambios cacheado en memoria. Las escrituras de
+    este proceso lo invalidan al hacer commit; las de otros workers se ven al
+    caducar la entrada (`ttl` segundos; 0 = consultar siempre). Refrescarlo
+    es una sola lectura de max(seq) sobre la clave primaria del registro.
+    """
+
+    def __init__(self, ttl: float = 5.0):
+        self.ttl = ttl
+        self._value: Optional[Tuple[int, float]] = None
+        # Cambia en cada invalidación: un refresco que empezó antes no se guarda
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    def get(self, session: Session) -> int:
+        with self._lock:
+            cached, generation = self._value, self._generation
+        if cached is not None and time.monotonic() - cached[1] < self.ttl:
+            return cached[0]
+        seq = current_seq(session)
+        with self._lock:
+            if generation == self._generation:
+                self._value = (seq, time.monotonic())
+        return seq
+
+    def invalidate(self) -> None:
+        with self._lock:
+            self._value = None
+            self._generation += 1
+
+    clear = invalidate
+
+
+sync_watermark = SyncWatermark(ttl=settings.sync_watermark_ttl)
+
+
+_COMMITTED_SEQ_KEY = "juanpa_change_log_committed_seq"
+_SESSION_CONNECTIONS_KEY = "juanpa_change_log_connections"
+
+
+@event.listens_for(Engine, "commit")
+def _capture_committed_seq(connection: Connection) -> None:
+    # Se dispara antes del COMMIT real: solo se anota, se publica en _publish_committed_changes
+    if not connection.info.pop(_PENDING_CHANGES_KEY, False):
+        return
+    seq = 0
+    if change_broadcaster.has_subscribers:
+        # Aún dentro de la transacción: incluye las entradas que se están confirmando
+        seq = connection.execute(select(func.max(db.ChangeLog.seq))).scalar() or 0
+    connection.info[_COMMITTED_SEQ_KEY] = seq
+
+
+@event.listens_for(Engine, "rollback")
+def _discard_pending_on_rollback(connection: Connection) -> None:
+    connection.info.pop(_PENDING_CHANGES_KEY, None)
+    connection.info.pop(_COMMITTED_SEQ_KEY, None)
+
+
+@event.listens_for(OrmSession, "after_begin")
+def _track_session_connection(session: OrmSession, transaction, connection: Connection) -> None:
+    connections = session.info.setdefault(_SESSION_CONNECTIONS_KEY, [])
+    if connection not in connections:
+        connection.info.pop(_COMMITTED_SEQ_KEY, None)
+        connections.append(connection)
+
+
+@event.listens_for(OrmSession, "after_commit")
+def _publish_committed_changes(session: OrmSession) -> None:
+    """
+    Invalida el high-water mark y avisa a los suscriptores cuando el COMMIT
+    ya se completó. Hacerlo antes dejaría que un sondeo concurrente cachease
+    el seq anterior o que un cliente avisado leyese el estado sin confirmar.
+    """
+    for connection in session.info.get(_SESSION_CONNECTIONS_KEY, ()):
+        if _COMMITTED_SEQ_KEY not in connection.info:
+            continue
+        seq = connection.info.pop(_COMMITTED_SEQ_KEY)
+        sync_watermark.invalidate()
+        if seq:
+            change_broadcaster.notify(seq)
+
+
+@event.listens_for(OrmSession, "after_transaction_end")
+def _forget_session_connections(session: OrmSession, transaction) -> None:
+    if transaction.parent is None:
+        session.info.pop(_SESSION_CONNECTIONS_KEY, None)
+
+
+def collapse_change_log(session: Session) -> int:
+    """
+    Colapsa las entradas de cada entidad en la más reciente, sin confirmar
+    (para ejecutarlo dentro de otra transacción, p. ej. en el coordinador de
+    escrituras). Es seguro para cualquier cliente: quien pida cambios después
+    de una entrada borrada sigue recibiendo la entidad por la entrada
+    posterior que se conserva. Devuelve el número de entradas eliminadas.
+
+    La entrada conservada de una entidad que absorbe otras pierde su máscara
+    de columnas (pasa a registro completo), porque ya no describe todos los
+    cambios que representa.
+    """
+    entity = (db.ChangeLog.entity_type, db.ChangeLog.entity_id)
+    merged = select(func.max(db.ChangeLog.seq)).group_by(*entity).having(func.count() > 1)
+    session.exec(
+        update(db.ChangeLog)
+        .where(db.ChangeLog.seq.in_(merged), db.ChangeLog.changed_columns.is_not(None))
+        .values(changed_columns=None)
+    )
+    latest = select(func.max(db.ChangeLog.seq)).group_by(*entity)
+    result = session.exec(delete(db.ChangeLog).where(db.ChangeLog.seq.not_in(latest)))
+    return result.rowcount or 0
+
+
+def compact_change_log(session: Session) -> int:
+    """`collapse_change_log` en su propia transacción."""
+    removed = collapse_change_log(session)
+    session.commit()
+    logger.info(f"Registro de cambios compactado: {removed} entradas eliminadas")
+    return removed
+
+
+def _compact_with_engine(bind: Engine) -> int:
+    with Session(bind) as session:
+        return compact_change_log(session)
+
+
+async def run_periodic_compaction(bind: Engine, interval_seconds: int) -> None:
+    """Tarea de fondo que compacta el registro de cambios cada `interval_seconds`."""
+    while True:
+        await asyncio.sleep(interval_seconds)
+        try:
+            await asyncio.to_thread(_compact_with_engine, bind)
+        except Exception as e:
+            logger.error(f"Error compactando el registro de cambios: {e}")
@@ -23,8 +23,23 @@ class Settings(BaseSettings):
     debug: bool = Field(True, description="Modo debug")
     
     # Base de datos
-    database_url: str = Field("sqlite:///./juanpa.db", description="URL de conexión a la base de datos")
+    database_url: Optional[str] = Field(None, description="URL de conexión a la base de datos (por defecto SQLite juanpa_app.db en backend/)")
     database_echo: bool = Field(False, description="Mostrar queries SQL en logs")
+    database_replica_url: Optional[str] = Field(None, description="URL de una réplica de solo lectura para los endpoints de lectura (sin réplica todo va al primario)")
+    read_your_writes_seconds: float = Field(5.0, ge=0, description="Segundos que un cliente lee del primario tras escribir, para ver sus propios cambios")
+    sqlite_journal_mode: str = Field("WAL", description="PRAGMA journal_mode de SQLite")
+    sqlite_synchronous: str = Field("NORMAL", description="PRAGMA synchronous de SQLite (NORMAL es seguro con WAL)")
+    sqlite_mmap_size: int = Field(256 * 1024 * 1024, ge=0, description="PRAGMA mmap_size de SQLite en bytes")
+    sqlite_cache_size: int = Field(-64000, description="PRAGMA cache_size de SQLite (negativo = KiB)")
+    sqlite_busy_timeout_ms: int = Field(5000, ge=0, description="PRAGMA busy_timeout de SQLite en milisegundos")
+    sqlite_single_writer: bool = Field(True, description="Serializar las escrituras SQLite del proceso y agrupar las pequeñas en un solo commit")
+    write_batch_max_size: int = Field(64, ge=1, description="Escrituras agrupadas como máximo en un commit del coordinador")
+    write_batch_max_wait_ms: float = Field(2.0, ge=0, description="Milisegundos que el coordinador espera a que se sumen más escrituras al lote")
+    db_pool_size: int = Field(10, ge=1, description="Conexiones persistentes del pool (PostgreSQL)")
+    db_max_overflow: int = Field(20, ge=0, description="Conexiones extra sobre db_pool_size en picos (PostgreSQL)")
+    db_pool_timeout: int = Field(30, ge=1, description="Segundos de espera por una conexión libre del pool")
+    db_pool_recycle: int = Field(1800, ge=-1, description="Segundos tras los que se recicla una conexión (-1 = nunca)")
+    db_pool_pre_ping: bool = Field(True, description="Comprobar la conexión antes de usarla")
     
     # Servidor
     host: str = Field("0.0.0.0", description="Host del servidor")
@@ -44,6 +59,7 @@ class Settings(BaseSettings):
     # Archivos estáticos
     static_dir: str = Field("static", description="Directorio de archivos estáticos")
     uploads_dir: str = Field("static/uploads", description="Directorio de uploads")
+    sync_snapshot_dir: str = Field("data/sync_snapshots", description="Directorio de los snapshots de primera sincronización (fuera de static: solo se sirven por su endpoint)")
     max_file_size: int = Field(100 * 1024 * 1024, description="Tamaño máximo de archivo en bytes")
     
     # Logging
@@ -68,6 +84,16 @@ class Settings(BaseSettings):
     # Performance
     max_workers: int = Field(4, description="Máximo número de workers para tareas")
     request_timeout: int = Field(30, description="Timeout de requests en segundos")
+    review_queue_max_decks: int = Field(64, ge=1, description="Mazos con cola de repaso en memoria (LRU)")
+    change_log_compaction_interval: int = Field(3600, ge=0, description="Segundos entre compactaciones del registro de cambios (0 = desactivado)")
+    idempotency_key_ttl: int = Field(86400, ge=0, description="Segundos que se guarda la respuesta de un push por Idempotency-Key (0 = desactivado)")
+    idempotency_cache_max_entries: int = Field(1024, ge=1, description="Respuestas de push guardadas por Idempotency-Key (LRU)")
+    idempotency_wait_timeout: float = Field(30.0, gt=0, description="Segundos que un push espera a otro en curso con la misma Idempotency-Key antes de responder 409")
+    sync_snapshot_interval: int = Field(3600, ge=0, description="Segundos entre regeneraciones del snapshot de primera sincronización (0 = solo bajo demanda)")
+    sync_notify_heartbeat: int = Field(25, ge=1, description="Segundos entre heartbeats de las suscripciones de sync (SSE/WebSocket)")
+    sync_watermark_ttl: float = Field(5.0, ge=0, description="Segundos que se cachea el último seq para los sondeos de sync (0 = sin cache)")
+    db_query_instrumentation: bool = Field(True, description="Contar sentencias SQL y tiempo de base de datos por request (cabeceras X-DB-Queries y X-DB-Time)")
+    n_plus_one_threshold: int = Field(10, ge=2, description="Ejecuciones de una misma sentencia en un request a partir de las que se avisa de un posible N+1")
     
     # Funcionalidades
     enable_ai_features: bool = Field(False, description="Habilitar funcionalidades de IA")
@@ -86,6 +112,20 @@ class Settings(BaseSettings):
             raise ValueError(f'Environment must be one of {allowed_environments}')
         return v
     
+    @validator('sqlite_journal_mode')
+    def validate_sqlite_journal_mode(cls, v):
+        allowed_modes = ['DELETE', 'TRUNCATE', 'PERSIST', 'MEMORY', 'WAL', 'OFF']
+        if v.upper() not in allowed_modes:
+            raise ValueError(f'SQLite journal mode must be one of {allowed_modes}')
+        return v.upper()
+    
+    @validator('sqlite_synchronous')
+    def validate_sqlite_synchronous(cls, v):
+        allowed_levels = ['OFF', 'NORMAL', 'FULL', 'EXTRA']
+        if v.upper() not in allowed_levels:
+            raise ValueError(f'SQLite synchronous must be one of {allowed_levels}')
+        return v.upper()
+    
     @validator('log_level')
     def validate_log_level(cls, v):
         allowed_levels = ['DEBUG', 'INFO', 'WARNING', 'ERROR', 'CRITICAL']
@@ -121,7 +161,7 @@ class Settings(BaseSettings):
         """Verifica si está en modo testing."""
         return self.environment == 'testing'
     
-    def get_database_url(self) -> str:
+    def get_database_url(self) -> Optional[str]:
         """Obtiene la URL de la base de datos con configuraciones específicas."""
         if self.is_testing:
             return "sqlite:///./test_juanpa.db"
@@ -236,7 +276,7 @@ def validate_production_config():
     if not settings.cors_origins:
         issues.append("CORS_ORIGINS should be explicitly configured in production")
     
-    if settings.database_url.startswith("sqlite://"):
+    if not settings.database_url or settings.database_url.startswith("sqlite://"):
         issues.append("Consider using a production database (PostgreSQL, MySQL) instead of SQLite")
     
     if issues:
@@ -1,23 +1,158 @@
-from sqlmodel import create_engine, SQLModel
+import threading
+from typing import Any, Dict, Optional
+
+from sqlalchemy import event
+from sqlalchemy.engine import URL, Engine, make_url
+from sqlalchemy.ext.asyncio import AsyncEngine, create_async_engine
+from sqlalchemy.pool import QueuePool
+from sqlmodel import create_engine, SQLModel, Session
+from sqlmodel.ext.asyncio.session import AsyncSession
 import os
 
-# Define la URL de la base de datos.
-# Usará una base de datos SQLite llamada 'juanpa_app.db' en el directorio raíz del backend.
-# DATABASE_URL = "sqlite:///./juanpa_app.db" # Si main.py está en backend/
-# Si main.py está en backend/app/, entonces la ruta relativa es ../juanpa_app.db
-# Para mayor simplicidad, usaremos una ruta basada en el directorio del script database.py
-# y subiremos un nivel para colocarla en la raíz de 'backend'.
+from .config import Settings, settings
+from .write_coordinator import WriteCoordinator, WriteGate
+
+# Define la URL de la base de datos por defecto.
+# Usará una base de datos SQLite llamada 'juanpa_app.db' en el directorio raíz del backend,
+# salvo que se configure otra con JUANPA_DATABASE_URL.
 
 # Obtener la ruta del directorio actual del script (app)
 current_dir = os.path.dirname(os.path.abspath(__file__))
 # Subir un nivel para estar en 'backend'
 backend_dir = os.path.dirname(current_dir)
 DATABASE_FILE = "juanpa_app.db"
-DATABASE_URL = f"sqlite:///{os.path.join(backend_dir, DATABASE_FILE)}"
+DEFAULT_DATABASE_URL = f"sqlite:///{os.path.join(backend_dir, DATABASE_FILE)}"
+
+
+def sqlite_pragmas(config: Settings, read_only: bool = False) -> Dict[str, Any]:
+    """PRAGMAs que se aplican a cada conexión SQLite nueva, en orden."""
+    pragmas = {
+        "journal_mode": config.sqlite_journal_mode,
+        "synchronous": config.sqlite_synchronous,
+        "mmap_size": config.sqlite_mmap_size,
+        "cache_size": config.sqlite_cache_size,
+        "busy_timeout": config.sqlite_busy_timeout_ms,
+    }
+    if read_only:
+        pragmas["query_only"] = "ON"
+    return pragmas
+
+
+def _apply_sqlite_pragmas(engine: Engine, pragmas: Dict[str, Any]) -> None:
+    @event.listens_for(engine, "connect")
+    def set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        try:
+            for name, value in pragmas.items():
+                cursor.execute(f"PRAGMA {name}={value}")
+        finally:
+            cursor.close()
+
+
+def _resolve_url(config: Settings, url: Optional[str]) -> URL:
+    url = url or config.get_database_url() or DEFAULT_DATABASE_URL
+    # Railway y Heroku entregan "postgres://", que SQLAlchemy ya no acepta
+    if url.startswith("postgres://"):
+        url = "postgresql://" + url[len("postgres://"):]
+    return make_url(url)
+
+
+def _sqlite_pragmas_for(config: Settings, url: URL, read_only: bool = False) -> Dict[str, Any]:
+    pragmas = sqlite_pragmas(config, read_only)
+    if url.database in (None, "", ":memory:"):
+        pragmas.pop("journal_mode")
+    return pragmas
+
+
+def _pool_options(config: Settings) -> Dict[str, Any]:
+    return {
+        "pool_size": config.db_pool_size,
+        "max_overflow": config.db_max_overflow,
+        "pool_timeout": config.db_pool_timeout,
+        "pool_recycle": config.db_pool_recycle,
+        "pool_pre_ping": config.db_pool_pre_ping,
+    }
+
+
+def build_engine(config: Settings = settings, url: Optional[str] = None, read_only: bool = False) -> Engine:
+    """
+    Crea el engine según la configuración.
+
+    - SQLite: WAL, synchronous=NORMAL, mmap, caché de páginas y busy_timeout
+      en cada conexión (el modo WAL no aplica a bases en memoria). Con
+      `sqlite_single_writer` las transacciones que escriben esperan turno en
+      una compuerta por proceso en lugar de chocar con el bloqueo de SQLite.
+      Con `read_only` (réplicas) las conexiones se abren con query_only y sin
+      compuerta.
+    - PostgreSQL: QueuePool con tamaño, overflow, pre-ping y reciclado
+      configurables.
+    """
+    url = _resolve_url(config, url)
+    backend = url.get_backend_name()
+    if backend == "sqlite":
+        # connect_args se recomienda para SQLite para evitar problemas con multithreading.
+        engine = create_engine(url, echo=config.database_echo, connect_args={"check_same_thread": False})
+        _apply_sqlite_pragmas(engine, _sqlite_pragmas_for(config, url, read_only))
+        if config.sqlite_single_writer and not read_only:
+            WriteGate(timeout=config.db_pool_timeout).install(engine)
+        return engine
+    if backend == "postgresql":
+        return create_engine(url, echo=config.database_echo, poolclass=QueuePool, **_pool_options(config))
+    return create_engine(url, echo=config.database_echo, pool_pre_ping=config.db_pool_pre_ping)
+
+
+# Drivers asíncronos para cada backend soportado
+ASYNC_DRIVERS = {"sqlite": "sqlite+aiosqlite", "postgresql": "postgresql+asyncpg"}
 
 
-# connect_args se recomienda para SQLite para evitar problemas con multithreading.
-engine = create_engine(DATABASE_URL, echo=True, connect_args={"check_same_thread": False})
+def build_async_engine(config: Settings = settings, url: Optional[str] = None, read_only: bool = False) -> AsyncEngine:
+    """
+    Engine asíncrono sobre la misma base que build_engine (aiosqlite o
+    asyncpg), con los mismos PRAGMAs de SQLite o el mismo tamaño de pool.
+    Con `read_only` las conexiones SQLite se abren con query_only.
+    """
+    url = _resolve_url(config, url)
+    backend = url.get_backend_name()
+    if backend not in ASYNC_DRIVERS:
+        raise ValueError(f"No hay driver asíncrono para la base de datos '{backend}'")
+    async_url = url.set(drivername=ASYNC_DRIVERS[backend])
+    if backend == "sqlite":
+        engine = create_async_engine(async_url, echo=config.database_echo)
+        _apply_sqlite_pragmas(engine.sync_engine, _sqlite_pragmas_for(config, url, read_only))
+        return engine
+    return create_async_engine(async_url, echo=config.database_echo, **_pool_options(config))
+
+
+def pool_status(bind: Engine) -> Dict[str, Any]:
+    """Estadísticas del pool de conexiones del engine."""
+    pool = bind.pool
+    stats: Dict[str, Any] = {
+        "dialect": bind.dialect.name,
+        "pool_class": type(pool).__name__,
+        "status": pool.status(),
+    }
+    if isinstance(pool, QueuePool):
+        stats.update(
+            size=pool.size(),
+            checked_in=pool.checkedin(),
+            checked_out=pool.checkedout(),
+            overflow=pool.overflow(),
+            timeout=pool.timeout(),
+        )
+    return stats
+
+
+engine = build_engine()
+
+# Réplica de solo lectura opcional; las rutas de lectura la eligen con
+# db_routing.get_read_session
+replica_engine: Optional[Engine] = (
+    build_engine(url=settings.database_replica_url, read_only=True) if settings.database_replica_url else None
+)
+
+def get_replica_engine() -> Optional[Engine]:
+    """Dependencia de FastAPI: el engine de la réplica, o None si no hay réplica."""
+    return replica_engine
 
 def create_db_and_tables():
     # Importar modelos aquí para evitar importaciones circulares y asegurar que SQLModel los conozca
@@ -31,13 +166,91 @@ def create_db_and_tables():
     
     SQLModel.metadata.create_all(engine)
 
-# Podrías querer una función para obtener una sesión de base de datos,
-# pero con FastAPI y SQLModel, a menudo se maneja con dependencias.
-# Por ahora, solo nos enfocamos en la creación del motor y las tablas.
+def get_session():
+    """Dependencia de FastAPI que entrega una sesión por request."""
+    with Session(engine) as session:
+        yield session
+
+# En SQLite con escritor único las lecturas síncronas van por un pool propio de
+# conexiones query_only (WAL): no compiten con el coordinador por el turno de
+# escritura. En el resto de casos es el mismo engine.
+read_only_engine: Engine = (
+    build_engine(read_only=True)
+    if settings.sqlite_single_writer and engine.dialect.name == "sqlite"
+    and engine.url.database not in (None, "", ":memory:")
+    else engine
+)
+
+def get_read_only_session():
+    """Dependencia de FastAPI: sesión sobre las conexiones de solo lectura del primario."""
+    with Session(read_only_engine) as session:
+        yield session
+
+# El engine asíncrono se crea al primer uso: el driver (aiosqlite/asyncpg)
+# solo se importa si algún endpoint asíncrono llega a pedir sesión.
+# Solo lo usan endpoints de lectura: en SQLite es un pool de conexiones de
+# solo lectura (WAL), y las escrituras van por la conexión del coordinador.
+_async_engine: Optional[AsyncEngine] = None
+
+def get_async_engine() -> AsyncEngine:
+    global _async_engine
+    if _async_engine is None:
+        _async_engine = build_async_engine(read_only=True)
+    return _async_engine
+
+_async_replica_engine: Optional[AsyncEngine] = None
+
+def get_async_replica_engine() -> Optional[AsyncEngine]:
+    """Engine asíncrono de la réplica, o None si no hay réplica configurada."""
+    global _async_replica_engine
+    if _async_replica_engine is None and settings.database_replica_url:
+        _async_replica_engine = build_async_engine(url=settings.database_replica_url, read_only=True)
+    return _async_replica_engine
+
+async def dispose_async_engine() -> None:
+    global _async_engine, _async_replica_engine
+    for async_engine in (_async_engine, _async_replica_engine):
+        if async_engine is not None:
+            await async_engine.dispose()
+    _async_engine = _async_replica_engine = None
+
+async def get_async_session():
+    """
+    Dependencia de FastAPI que entrega una sesión asíncrona por request.
+    Los endpoints que la usan no ocupan un hilo del pool de anyio mientras
+    esperan a la base de datos. La lógica síncrona existente se reutiliza con
+    `await session.run_sync(funcion, ...)`.
+    """
+    async with AsyncSession(get_async_engine(), expire_on_commit=False) as session:
+        yield session
+
+# Coordinador de escrituras (solo SQLite con sqlite_single_writer); se arranca al primer uso
+_write_coordinator: Optional[WriteCoordinator] = None
+_write_coordinator_lock = threading.Lock()
+
+def get_write_coordinator() -> Optional[WriteCoordinator]:
+    """Dependencia de FastAPI: el coordinador de escrituras, o None si las escrituras van directas."""
+    global _write_coordinator
+    if not settings.sqlite_single_writer or engine.dialect.name != "sqlite":
+        return None
+    with _write_coordinator_lock:
+        if _write_coordinator is None:
+            _write_coordinator = WriteCoordinator(
+                engine,
+                max_batch=settings.write_batch_max_size,
+                max_wait=settings.write_batch_max_wait_ms / 1000
+            )
+    return _write_coordinator
+
+def close_write_coordinator() -> None:
+    global _write_coordinator
+    if _write_coordinator is not None:
+        _write_coordinator.close()
+        _write_coordinator = None
 
 if __name__ == "__main__":
     # Esto permite crear la base de datos y las tablas ejecutando este script directamente.
     # python -m app.database  (desde el directorio backend)
-    print(f"Creando base de datos y tablas en: {DATABASE_URL}")
+    print(f"Creando base de datos y tablas en: {engine.url}")
     create_db_and_tables()
     print("Base de datos y tablas creadas (si no existían).")
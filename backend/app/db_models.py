@@ -1,6 +1,8 @@
 from datetime import datetime, timezone
 from typing import List, Optional, Any
 from sqlmodel import Field, SQLModel, Relationship, JSON, Column
+from sqlalchemy import Index
+from uuid import uuid4
 import json
 
 # Clase base para timestamps
@@ -10,9 +12,21 @@ class TimestampModel(SQLModel):
     is_deleted: bool = Field(default=False, index=True) # Nuevo campo para soft delete
     deleted_at: Optional[datetime] = Field(default=None, index=True) # Timestamp de la soft delete
 
+# Identificador global generable por el cliente: permite crear offline y reintentar pushes sin duplicar
+def new_uuid() -> str:
+    return str(uuid4())
+
 # Modelo para Tarjeta (Card)
 class Card(TimestampModel, table=True):
+    # Índice de la cola de repaso: permite leer las tarjetas pendientes de un mazo como un rango
+    __table_args__ = (
+        Index("ix_card_due_queue", "is_deleted", "deck_id", "next_review_at"),
+        # Recorrido por keyset del pull de sincronización
+        Index("ix_card_sync_keyset", "updated_at", "id"),
+    )
+
     id: Optional[int] = Field(default=None, primary_key=True, index=True)
+    uuid: Optional[str] = Field(default_factory=new_uuid, unique=True, index=True)
     deck_id: int = Field(foreign_key="deck.id", index=True)
     
     front_content: Any = Field(sa_column=Column(JSON)) # Permite estructuras complejas: texto, img_url, audio_url
@@ -27,13 +41,20 @@ class Card(TimestampModel, table=True):
     fsrs_difficulty: Optional[float] = Field(default=None)
     fsrs_lapses: Optional[int] = Field(default=0)
     fsrs_state: Optional[str] = Field(default="new") # new, learning, review, relearning
+    fsrs_step: Optional[int] = Field(default=None) # Paso de aprendizaje/reaprendizaje actual
+    fsrs_last_review: Optional[datetime] = Field(default=None) # Fecha del último repaso
 
     deck: "Deck" = Relationship(back_populates="cards")
     # review_logs: List["ReviewLog"] = Relationship(back_populates="card") # Si Card necesita acceder a sus logs
 
 # Modelo para Mazo (Deck)
 class Deck(TimestampModel, table=True):
+    __table_args__ = (
+        Index("ix_deck_sync_keyset", "updated_at", "id"),
+    )
+
     id: Optional[int] = Field(default=None, primary_key=True, index=True)
+    uuid: Optional[str] = Field(default_factory=new_uuid, unique=True, index=True)
     name: str = Field(index=True, unique=True) # Nombre del mazo debe ser Ăşnico
     description: Optional[str] = Field(default=None)
 
@@ -42,6 +63,11 @@ class Deck(TimestampModel, table=True):
 
 # Modelo para ReviewLog (Historial de Repasos)
 class ReviewLog(SQLModel, table=True):
+    # Un repaso se identifica por tarjeta y momento: permite reenviar repasos offline sin duplicarlos
+    __table_args__ = (
+        Index("uq_reviewlog_card_timestamp", "card_id", "review_timestamp", unique=True),
+    )
+
     id: Optional[int] = Field(default=None, primary_key=True, index=True)
     card_id: int = Field(foreign_key="card.id", index=True)
     # deck_id: int = Field(foreign_key="deck.id", index=True) # Opcional, se puede obtener a travĂŠs de card.deck_id
@@ -69,6 +95,38 @@ class ReviewLog(SQLModel, table=True):
     # card: "Card" = Relationship(back_populates="review_logs")
     # deck: "Deck" = Relationship(back_populates="review_logs")
 
+# Modelo para la sincronización parcial por dispositivo
+class DeckSubscription(SQLModel, table=True):
+    """
+    Mazo que un dispositivo sincroniza. Al desuscribirse la fila se desactiva
+    en lugar de borrarse, para poder avisar al dispositivo de que desaloje el mazo.
+    """
+    __table_args__ = (
+        Index("uq_decksubscription_device_deck", "device_id", "deck_id", unique=True),
+    )
+
+    id: Optional[int] = Field(default=None, primary_key=True)
+    device_id: str = Field(nullable=False)
+    deck_id: int = Field(foreign_key="deck.id", index=True)
+    is_active: bool = Field(default=True, nullable=False)
+    updated_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc), nullable=False)
+
+# Modelo para el registro de cambios (change feed) usado por la sincronización
+class ChangeLog(SQLModel, table=True):
+    """Entrada append-only por cada alta, modificación o borrado de mazos y tarjetas."""
+    __table_args__ = (
+        Index("ix_changelog_entity", "entity_type", "entity_id"),
+        # AUTOINCREMENT: seq nunca se reutiliza aunque se borren entradas al compactar
+        {"sqlite_autoincrement": True},
+    )
+
+    seq: Optional[int] = Field(default=None, primary_key=True)
+    entity_type: str = Field(nullable=False) # deck, card, subscription
+    entity_id: int = Field(nullable=False)
+    operation: str = Field(nullable=False) # insert, update, delete
+    changed_columns: Optional[int] = Field(default=None) # Máscara de columnas de tarjeta modificadas; NULL = todas
+    changed_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc), nullable=False)
+
 class UserSettings(SQLModel, table=True):
     """Modelo para configuraciones de usuario."""
     id: Optional[int] = Field(default=None, primary_key=True)
@@ -99,6 +157,7 @@ class UserSettings(SQLModel, table=True):
     enable_debug_mode: bool = Field(default=False)
     fsrs_request_retention: float = Field(default=0.9)
     fsrs_maximum_interval: int = Field(default=36500)
+    fsrs_parameters: Optional[List[float]] = Field(default=None, sa_column=Column(JSON)) # Pesos FSRS personalizados
     
     # Metadatos
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
@@ -0,0 +1,133 @@
+"""
+Enrutado de lecturas a la réplica para JuanPA.
+
+Cada ruta declara a qué base va: las de lectura piden su sesión con
+`get_read_session` / `get_async_read_session` (la réplica, si hay una
+configurada) y las que escriben se marcan con `pin_to_primary`. Tras
+escribir, el cliente queda fijado al primario durante
+`read_your_writes_seconds`, así sus lecturas inmediatas ven sus propios
+cambios aunque la réplica vaya con retraso. El resto de clientes puede ver
+la réplica con ese retraso.
+
+Los clientes se identifican por la cabecera `X-Device-Id` o el parámetro
+`deviceId` y, si no envían ninguno, por su IP.
+"""
+
+import threading
+import time
+from typing import Dict, Optional
+
+from fastapi import Depends, Request
+from sqlalchemy.engine import Engine
+from sqlalchemy.ext.asyncio import AsyncEngine
+from sqlmodel import Session
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from .config import settings
+from .database import get_async_replica_engine, get_async_session, get_read_only_session, get_replica_engine
+
+DEVICE_ID_HEADER = "x-device-id"
+
+
+def client_key(request: Request) -> str:
+    """Identificador del cliente para la ventana de read-your-writes."""
+    device_id = request.headers.get(DEVICE_ID_HEADER) or request.query_params.get("deviceId")
+    if device_id:
+        return f"device:{device_id}"
+    forwarded_for = request.headers.get("x-forwarded-for")
+    if forwarded_for:
+        return f"ip:{forwarded_for.split(',')[0].strip()}"
+    return f"ip:{request.client.host if request.client else 'unknown'}"
+
+
+class ReadYourWrites:
+    """
+    Clientes que escribieron hace menos de `seconds` segundos y deben leer
+    del primario. Las entradas caducadas se purgan al superar `max_clients`.
+    """
+
+    def __init__(self, seconds: float, max_clients: int = 10000):
+        self.seconds = seconds
+        self.max_clients = max_clients
+        self._pinned_until: Dict[str, float] = {}
+        self._lock = threading.Lock()
+        self.reads = {"primary": 0, "replica": 0}
+
+    def pin(self, client: str) -> None:
+        if self.seconds <= 0:
+            return
+        now = time.monotonic()
+        with self._lock:
+            self._pinned_until[client] = now + self.seconds
+            if len(self._pinned_until) > self.max_clients:
+                self._pinned_until = {key: until for key, until in self._pinned_until.items() if until > now}
+
+    def is_pinned(self, client: str) -> bool:
+        with self._lock:
+            until = self._pinned_until.get(client)
+            if until is None:
+                return False
+            if until <= time.monotonic():
+                del self._pinned_until[client]
+                return False
+            return True
+
+    def use_replica(self, client: str) -> bool:
+        """Decide (y cuenta) si la lectura de `client` puede ir a la réplica."""
+        replica = not self.is_pinned(client)
+        self.reads["replica" if replica else "primary"] += 1
+        return replica
+
+    def clear(self) -> None:
+        with self._lock:
+            self._pinned_until.clear()
+        self.reads = {"primary": 0, "replica": 0}
+
+    def stats(self) -> Dict[str, int]:
+        now = time.monotonic()
+        with self._lock:
+            pinned = sum(1 for until in self._pinned_until.values() if until > now)
+        return {"pinned_clients": pinned, "primary_reads": self.reads["primary"], "replica_reads": self.reads["replica"]}
+
+
+read_your_writes = ReadYourWrites(settings.read_your_writes_seconds)
+
+
+async def pin_to_primary(request: Request):
+    """
+    Dependencia para las rutas que escriben: fija al cliente al primario
+    mientras dura la request y durante la ventana posterior.
+    """
+    client = client_key(request)
+    read_your_writes.pin(client)
+    yield
+    read_your_writes.pin(client)
+
+
+def get_read_session(
+    request: Request,
+    session: Session = Depends(get_read_only_session),
+    replica: Optional[Engine] = Depends(get_replica_engine)
+):
+    """
+    Sesión para rutas de solo lectura: la réplica salvo que el cliente acabe
+    de escribir y, si no, las conexiones de solo lectura del primario.
+    """
+    if replica is None or not read_your_writes.use_replica(client_key(request)):
+        yield session
+        return
+    with Session(replica) as replica_session:
+        yield replica_session
+
+
+async def get_async_read_session(
+    request: Request,
+    session: AsyncSession = Depends(get_async_session),
+    replica: Optional[AsyncEngine] = Depends(get_async_replica_engine)
+):
+    """Versión asíncrona de `get_read_session`."""
+    if replica is None or not read_your_writes.use_replica(client_key(request)):
+        yield session
+        return
+    async with AsyncSession(replica, expire_on_commit=False) as replica_session:
+        yield replica_session
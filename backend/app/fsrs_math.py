@@ -0,0 +1,96 @@
+"""
+Fórmulas FSRS vectorizadas con NumPy.
+Reproducen las de la librería `fsrs` (v5) pero operan sobre arrays completos de
+tarjetas. Los pesos pueden ser un vector de 19 elementos o una matriz (K, 19)
+para evaluar K juegos de pesos a la vez; en ese caso el resultado es (K, N).
+"""
+
+from typing import Union
+
+import numpy as np
+
+DECAY = -0.5
+FACTOR = 0.9 ** (1 / DECAY) - 1
+
+ArrayLike = Union[np.ndarray, float, int]
+
+
+def _w(weights: np.ndarray, index: int) -> np.ndarray:
+    """Peso `index` con forma apta para broadcasting: (1,) o (K, 1)."""
+    return weights[..., index:index + 1]
+
+
+def retrievability(elapsed_days: ArrayLike, stability: ArrayLike) -> np.ndarray:
+    """Probabilidad de recuerdo tras `elapsed_days` días con la estabilidad dada."""
+    return (1 + FACTOR * np.maximum(elapsed_days, 0) / stability) ** DECAY
+
+
+def next_interval(stability: ArrayLike, desired_retention: float, maximum_interval: int) -> np.ndarray:
+    """Intervalo en días enteros hasta que la retrievability cae a la retención deseada."""
+    interval = np.rint(np.asarray(stability) / FACTOR * (desired_retention ** (1 / DECAY) - 1))
+    return np.clip(interval, 1, maximum_interval)
+
+
+def initial_stability(weights: np.ndarray, rating: ArrayLike) -> np.ndarray:
+    rating = np.asarray(rating, dtype=np.int64)
+    return np.maximum(np.take(weights, rating - 1, axis=-1), 0.1)
+
+
+def initial_difficulty(weights: np.ndarray, rating: ArrayLike) -> np.ndarray:
+    return np.clip(_w(weights, 4) - np.exp(_w(weights, 5) * (np.asarray(rating) - 1)) + 1, 1.0, 10.0)
+
+
+def next_difficulty(weights: np.ndarray, difficulty: ArrayLike, rating: ArrayLike) -> np.ndarray:
+    delta_difficulty = -_w(weights, 6) * (np.asarray(rating) - 3)
+    damped = difficulty + (10 - difficulty) * delta_difficulty / 9
+    mean_reversion = _w(weights, 7) * initial_difficulty(weights, 4) + (1 - _w(weights, 7)) * damped
+    return np.clip(mean_reversion, 1.0, 10.0)
+
+
+def recall_stability(
+    weights: np.ndarray, stability: ArrayLike, difficulty: ArrayLike, retrievability_: ArrayLike, rating: ArrayLike
+) -> np.ndarray:
+    rating = np.asarray(rating)
+    hard_penalty = np.where(rating == 2, _w(weights, 15), 1.0)
+    easy_bonus = np.where(rating == 4, _w(weights, 16), 1.0)
+    return stability * (
+        1 + np.exp(_w(weights, 8)) * (11 - difficulty) * np.asarray(stability) ** -_w(weights, 9)
+        * (np.exp((1 - retrievability_) * _w(weights, 10)) - 1) * hard_penalty * easy_bonus
+    )
+
+
+def forget_stability(
+    weights: np.ndarray, stability: ArrayLike, difficulty: ArrayLike, retrievability_: ArrayLike
+) -> np.ndarray:
+    long_term = (
+        _w(weights, 11) * np.asarray(difficulty) ** -_w(weights, 12)
+        * ((np.asarray(stability) + 1) ** _w(weights, 13) - 1)
+        * np.exp((1 - retrievability_) * _w(weights, 14))
+    )
+    return np.minimum(long_term, stability / np.exp(_w(weights, 17) * _w(weights, 18)))
+
+
+def short_term_stability(weights: np.ndarray, stability: ArrayLike, rating: ArrayLike) -> np.ndarray:
+    return stability * np.exp(_w(weights, 17) * (np.asarray(rating) - 3 + _w(weights, 18)))
+
+
+def next_stability(
+    weights: np.ndarray,
+    stability: ArrayLike,
+    difficulty: ArrayLike,
+    elapsed_days: ArrayLike,
+    rating: ArrayLike,
+) -> np.ndarray:
+    """Estabilidad tras un repaso, eligiendo la fórmula a corto o largo plazo como FSRS."""
+    rating = np.asarray(rating)
+    current = retrievability(elapsed_days, stability)
+    long_term = np.where(
+        rating > 1,
+        recall_stability(weights, stability, difficulty, current, rating),
+        forget_stability(weights, stability, difficulty, current),
+    )
+    return np.where(
+        np.asarray(elapsed_days) >= 1,
+        long_term,
+        short_term_stability(weights, stability, rating),
+    )
@@ -0,0 +1,403 @@
+"""
+Optimizador de parámetros FSRS para JuanPA.
+Ajusta los 19 pesos de FSRS al historial de ReviewLog minimizando la pérdida
+logarítmica de las predicciones de recuerdo. Todo el cálculo está vectorizado
+con NumPy y se ejecuta, junto con la lectura del historial, en un pool de
+procesos para no bloquear la API.
+"""
+
+import threading
+import time
+import uuid
+from concurrent.futures import Future, ProcessPoolExecutor
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Tuple
+
+from sqlmodel import Session, or_, select
+
+from . import db_models as db
+from .config import settings
+from .database import build_engine
+from .exceptions import BusinessLogicError
+from .fsrs_service import epoch_microseconds
+from .logging_config import get_logger
+
+# Importar NumPy con manejo de errores
+try:
+    import numpy as np
+    from . import fsrs_math as fm
+    NUMPY_AVAILABLE = True
+except ImportError:
+    print("WARNING: NumPy not available. FSRS optimization will be disabled.")
+    NUMPY_AVAILABLE = False
+
+logger = get_logger("juanpa.fsrs.optimizer")
+
+DEFAULT_PARAMETERS = (
+    0.40255, 1.18385, 3.173, 15.69105, 7.1949, 0.5345, 1.4604, 0.0046, 1.54575,
+    0.1192, 1.01925, 1.9395, 0.11, 0.29605, 2.2698, 0.2315, 2.9898, 0.51655, 0.6621,
+)
+
+# Límites de cada peso (los mismos rangos que usa el optimizador de referencia de FSRS)
+PARAMETER_BOUNDS = (
+    (0.1, 100.0), (0.1, 100.0), (0.1, 100.0), (0.1, 100.0),
+    (1.0, 10.0), (0.001, 4.0), (0.001, 4.0), (0.001, 0.75), (0.0, 4.5),
+    (0.0, 0.8), (0.001, 3.5), (0.001, 5.0), (0.001, 0.25), (0.001, 0.9),
+    (0.0, 4.0), (0.0, 1.0), (1.0, 6.0), (0.0, 2.0), (0.0, 2.0),
+)
+
+# Filas de ReviewLog leídas por cada ida a la base de datos
+HISTORY_CHUNK_SIZE = 50_000
+# Repasos por tarjeta considerados en el ajuste
+MAX_HISTORY_PER_CARD = 64
+# Mínimo de repasos a largo plazo para que el ajuste sea significativo
+MIN_LONG_TERM_REVIEWS = 50
+# Repasos usados en la búsqueda por coordenadas; la pérdida final se mide sobre todo el historial
+MAX_SEARCH_REVIEWS = 200_000
+
+_SECONDS_PER_DAY = 86400.0
+
+
+def load_review_history(session: Session, chunk_size: int = HISTORY_CHUNK_SIZE) -> Dict[str, "np.ndarray"]:
+    """
+    Lee el historial de repasos en bloques (yield_per) y lo acumula en arrays.
+    Las fechas llegan ya como microsegundos desde epoch y el "primer repaso"
+    como booleano, así que cada bloque se convierte con NumPy sin recorrer las
+    filas en Python. No se ordena en SQL: el orden por (tarjeta, fecha) se
+    hace luego con NumPy.
+    """
+    query = select(
+        db.ReviewLog.card_id,
+        epoch_microseconds(db.ReviewLog.review_timestamp),
+        db.ReviewLog.rating_given,
+        or_(db.ReviewLog.previous_state.is_(None), db.ReviewLog.previous_state == "new"),
+    ).execution_options(yield_per=chunk_size)
+
+    card_chunks, time_chunks, rating_chunks, first_chunks = [], [], [], []
+    for rows in session.exec(query).partitions():
+        card_ids, timestamps, ratings, from_new = zip(*rows)
+        card_chunks.append(np.asarray(card_ids, dtype=np.int64))
+        time_chunks.append(np.asarray(timestamps, dtype=np.float64) / 1e6)
+        rating_chunks.append(np.asarray(ratings, dtype=np.int8))
+        first_chunks.append(np.asarray(from_new, dtype=bool))
+
+    if not card_chunks:
+        empty = np.empty(0)
+        return {"card_ids": empty.astype(np.int64), "timestamps": empty, "ratings": empty.astype(np.int8), "from_new": empty.astype(bool)}
+
+    return {
+        "card_ids": np.concatenate(card_chunks),
+        "timestamps": np.concatenate(time_chunks),
+        "ratings": np.concatenate(rating_chunks),
+        "from_new": np.concatenate(first_chunks),
+    }
+
+
+def has_review_history(session: Session, minimum: int = MIN_LONG_TERM_REVIEWS) -> bool:
+    """Comprueba si hay al menos `minimum` repasos sin leer (ni contar) todo el historial."""
+    return session.exec(select(db.ReviewLog.id).offset(minimum - 1).limit(1)).first() is not None
+
+
+def optimize_from_database(database_url: str, chunk_size: int = HISTORY_CHUNK_SIZE) -> Tuple[int, Dict[str, Any]]:
+    """
+    Trabajo del pool de procesos: lee el historial con su propia conexión (de
+    solo lectura en SQLite) y ajusta los pesos. Devuelve (repasos leídos,
+    resultado del ajuste).
+    """
+    engine = build_engine(url=database_url, read_only=True)
+    try:
+        with Session(engine) as session:
+            history = load_review_history(session, chunk_size)
+    finally:
+        engine.dispose()
+    return int(len(history["card_ids"])), fit_parameters(history)
+
+
+def build_sequences(history: Dict[str, "np.ndarray"], max_history: int = MAX_HISTORY_PER_CARD) -> Dict[str, Any]:
+    """
+    Convierte el historial plano en matrices (paso, tarjeta) de ratings y días
+    transcurridos. Las tarjetas se ordenan por longitud descendente para que las
+    activas en el paso t sean siempre un prefijo de las columnas.
+    """
+    order = np.lexsort((history["timestamps"], history["card_ids"]))
+    card_ids = history["card_ids"][order]
+    timestamps = history["timestamps"][order]
+    ratings = history["ratings"][order]
+    from_new = history["from_new"][order]
+
+    is_start = np.ones(len(card_ids), dtype=bool)
+    is_start[1:] = card_ids[1:] != card_ids[:-1]
+    starts = np.flatnonzero(is_start)
+    lengths = np.diff(np.append(starts, len(card_ids)))
+    positions = np.arange(len(card_ids)) - np.repeat(starts, lengths)
+
+    elapsed = np.zeros(len(card_ids))
+    elapsed[1:] = np.diff(timestamps) / _SECONDS_PER_DAY
+    elapsed[is_start] = 0.0
+
+    # Solo secuencias que empiezan en el primer repaso de la tarjeta
+    valid_card = from_new[starts]
+    group = np.repeat(np.arange(len(starts)), lengths)
+    keep = valid_card[group] & (positions < max_history)
+
+    clipped_lengths = np.where(valid_card, np.minimum(lengths, max_history), 0)
+    card_order = np.argsort(-clipped_lengths, kind="stable")
+    rank = np.empty_like(card_order)
+    rank[card_order] = np.arange(len(card_order))
+    sorted_lengths = clipped_lengths[card_order]
+    n_cards = int(np.count_nonzero(sorted_lengths))
+    n_steps = int(sorted_lengths[0]) if n_cards else 0
+
+    rating_matrix = np.zeros((n_steps, n_cards), dtype=np.int8)
+    elapsed_matrix = np.zeros((n_steps, n_cards))
+    rating_matrix[positions[keep], rank[group[keep]]] = ratings[keep]
+    elapsed_matrix[positions[keep], rank[group[keep]]] = elapsed[keep]
+
+    # Tarjetas activas en cada paso: las que tienen más de t repasos
+    active = n_cards - np.searchsorted(sorted_lengths[:n_cards][::-1], np.arange(n_steps), side="right")
+
+    return {
+        "ratings": rating_matrix,
+        "elapsed": elapsed_matrix,
+        "active": active,
+        "n_cards": n_cards,
+        "n_reviews": int(np.count_nonzero(keep)),
+    }
+
+
+def subsample_sequences(sequences: Dict[str, Any], max_reviews: int, seed: int = 0) -> Dict[str, Any]:
+    """Toma un subconjunto aleatorio de tarjetas con unos `max_reviews` repasos en total."""
+    if sequences["n_reviews"] <= max_reviews:
+        return sequences
+    n_cards = sequences["n_cards"]
+    n_keep = max(1, int(n_cards * max_reviews / sequences["n_reviews"]))
+    # Índices ordenados: se conserva el orden por longitud descendente de las columnas
+    columns = np.sort(np.random.default_rng(seed).choice(n_cards, size=n_keep, replace=False))
+    ratings = sequences["ratings"][:, columns]
+    lengths = np.count_nonzero(ratings, axis=0)
+    n_steps = int(lengths[0])
+    return {
+        "ratings": ratings[:n_steps],
+        "elapsed": sequences["elapsed"][:n_steps, columns],
+        "active": n_keep - np.searchsorted(lengths[::-1], np.arange(n_steps), side="right"),
+        "n_cards": n_keep,
+        "n_reviews": int(lengths.sum()),
+    }
+
+
+def sequence_loss(weights: "np.ndarray", sequences: Dict[str, Any]) -> "np.ndarray":
+    """
+    Pérdida logarítmica media de cada vector de pesos (filas de `weights`, K x 19)
+    al reproducir todas las secuencias a la vez. Coste O(K * repasos).
+    """
+    weights = np.atleast_2d(weights)
+    ratings, elapsed, active = sequences["ratings"], sequences["elapsed"], sequences["active"]
+    k = weights.shape[0]
+    if sequences["n_cards"] == 0:
+        return np.full(k, np.nan)
+
+    first = ratings[0].astype(np.int64)
+    stability = fm.initial_stability(weights, first)
+    difficulty = fm.initial_difficulty(weights, first)
+
+    total = np.zeros(k)
+    count = 0
+    for step in range(1, ratings.shape[0]):
+        n = active[step]
+        rating = ratings[step, :n].astype(np.float64)
+        delta_t = elapsed[step, :n]
+        s = stability[:, :n]
+        d = difficulty[:, :n]
+
+        long_term = delta_t >= 1.0
+        if long_term.any():
+            r_long = np.clip(fm.retrievability(delta_t[long_term], s[:, long_term]), 1e-6, 1 - 1e-6)
+            recalled = rating[long_term] > 1
+            total -= np.where(recalled, np.log(r_long), np.log(1 - r_long)).sum(axis=1)
+            count += int(long_term.sum())
+
+        stability[:, :n] = np.maximum(fm.next_stability(weights, s, d, delta_t, rating), 0.01)
+        difficulty[:, :n] = fm.next_difficulty(weights, d, rating)
+
+    if count == 0:
+        return np.full(k, np.nan)
+    return total / count
+
+
+def _pretrain_initial_stability(weights: "np.ndarray", sequences: Dict[str, Any]) -> "np.ndarray":
+    """
+    Ajusta w0..w3 (estabilidad inicial por rating) con una búsqueda en rejilla
+    sobre el segundo repaso de cada tarjeta, todo en una sola operación matricial.
+    """
+    ratings, elapsed, active = sequences["ratings"], sequences["elapsed"], sequences["active"]
+    if ratings.shape[0] < 2:
+        return weights
+    n = active[1]
+    first = ratings[0, :n]
+    delta_t = elapsed[1, :n]
+    recalled = ratings[1, :n] > 1
+    long_term = delta_t >= 1.0
+
+    grid = np.geomspace(PARAMETER_BOUNDS[0][0], PARAMETER_BOUNDS[0][1], 256)[:, None]
+    weights = weights.copy()
+    for rating in range(1, 5):
+        mask = long_term & (first == rating)
+        if mask.sum() < 10:
+            continue
+        retrievability = np.clip(fm.retrievability(delta_t[mask], grid), 1e-6, 1 - 1e-6)
+        loss = -np.where(recalled[mask], np.log(retrievability), np.log(1 - retrievability)).sum(axis=1)
+        weights[rating - 1] = float(grid[np.argmin(loss), 0])
+    # La estabilidad inicial debe crecer con el rating
+    weights[:4] = np.maximum.accumulate(weights[:4])
+    return weights
+
+
+def fit_parameters(
+    history: Dict[str, "np.ndarray"],
+    initial: Tuple[float, ...] = DEFAULT_PARAMETERS,
+    rounds: int = 2,
+    candidates: int = 7,
+) -> Dict[str, Any]:
+    """
+    Ajusta los pesos FSRS al historial. Primero se preentrena la estabilidad
+    inicial y luego se hace descenso por coordenadas: para cada peso se evalúan
+    `candidates` valores en una única pasada vectorizada y se queda el mejor.
+    """
+    start_time = time.time()
+    sequences = build_sequences(history)
+    long_term_reviews = int((sequences["elapsed"][1:] >= 1.0).sum()) if sequences["n_cards"] else 0
+    if long_term_reviews < MIN_LONG_TERM_REVIEWS:
+        raise BusinessLogicError(
+            f"Historial insuficiente: {long_term_reviews} repasos a largo plazo "
+            f"(mínimo {MIN_LONG_TERM_REVIEWS})",
+            operation="fsrs_optimize"
+        )
+
+    default = np.asarray(initial, dtype=np.float64)
+    loss_default = float(sequence_loss(default, sequences)[0])
+
+    weights = _pretrain_initial_stability(default, sequences)
+    search = subsample_sequences(sequences, MAX_SEARCH_REVIEWS)
+    best_loss = float(sequence_loss(weights, search)[0])
+    offsets = np.linspace(-1.0, 1.0, candidates)
+
+    for round_index in range(rounds):
+        scale = 0.2 / (2 ** round_index)
+        for index in range(4, len(weights)):
+            low, high = PARAMETER_BOUNDS[index]
+            values = np.clip(weights[index] + offsets * scale * (high - low), low, high)
+            batch = np.repeat(weights[None, :], len(values), axis=0)
+            batch[:, index] = values
+            losses = sequence_loss(batch, search)
+            best = int(np.nanargmin(losses))
+            if losses[best] < best_loss:
+                best_loss = float(losses[best])
+                weights = batch[best]
+
+    loss_optimized = float(sequence_loss(weights, sequences)[0])
+    if loss_optimized > loss_default:
+        # El subconjunto no generalizó: los pesos por defecto siguen siendo mejores
+        weights, loss_optimized = default, loss_default
+
+    return {
+        "parameters": [round(float(value), 5) for value in weights],
+        "loss_default": loss_default,
+        "loss_optimized": loss_optimized,
+        "cards_used": sequences["n_cards"],
+        "reviews_used": sequences["n_reviews"],
+        "elapsed_seconds": time.time() - start_time,
+    }
+
+
+class OptimizerJobs:
+    """
+    Registro en memoria de trabajos de optimización ejecutados en un pool de procesos.
+    Se guardan los últimos `max_jobs` trabajos.
+    """
+
+    def __init__(self, max_workers: int = 1, max_jobs: int = 20):
+        self.max_workers = max_workers
+        self.max_jobs = max_jobs
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._jobs: Dict[str, Dict[str, Any]] = {}
+        self._futures: Dict[str, Future] = {}
+        self._lock = threading.Lock()
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self.max_workers)
+        return self._executor
+
+    def submit(self, database_url: str) -> Dict[str, Any]:
+        """
+        Encola la lectura del historial y el ajuste sobre la base `database_url`
+        y devuelve el estado inicial del trabajo. El número de repasos se
+        conoce al terminar la lectura.
+        """
+        job_id = str(uuid.uuid4())
+        job = {
+            "job_id": job_id,
+            "status": "running",
+            "created_at": datetime.now(timezone.utc),
+            "finished_at": None,
+            "reviews": None,
+            "result": None,
+            "error": None,
+        }
+        with self._lock:
+            self._jobs[job_id] = job
+            while len(self._jobs) > self.max_jobs:
+                oldest = next(iter(self._jobs))
+                self._jobs.pop(oldest)
+                self._futures.pop(oldest, None)
+            future = self._get_executor().submit(optimize_from_database, database_url)
+            self._futures[job_id] = future
+        future.add_done_callback(lambda done: self._finish(job_id, done))
+        logger.info(f"Optimización FSRS {job_id} encolada")
+        return dict(job)
+
+    def _finish(self, job_id: str, future: Future) -> None:
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return
+            job["finished_at"] = datetime.now(timezone.utc)
+            exc = future.exception()
+            if exc is not None:
+                job["status"] = "failed"
+                job["error"] = getattr(exc, "message", None) or str(exc)
+                logger.warning(f"Optimización FSRS {job_id} falló: {job['error']}")
+            else:
+                job["status"] = "completed"
+                job["reviews"], job["result"] = future.result()
+                logger.info(
+                    f"Optimización FSRS {job_id} completada con {job['reviews']} repasos "
+                    f"en {job['result']['elapsed_seconds']:.2f}s"
+                )
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return dict(job) if job else None
+
+    def wait(self, job_id: str, timeout: Optional[float] = None) -> Optional[Dict[str, Any]]:
+        """Espera a que termine un trabajo (útil en tests y scripts)."""
+        future = self._futures.get(job_id)
+        if future is not None:
+            try:
+                future.result(timeout=timeout)
+            except Exception:
+                pass
+            # El callback puede no haber corrido todavía; registrar el resultado aquí
+            job = self.get(job_id)
+            if job and job["status"] == "running":
+                self._finish(job_id, future)
+        return self.get(job_id)
+
+    def shutdown(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+optimizer_jobs = OptimizerJobs(max_workers=max(1, settings.max_workers // 2))
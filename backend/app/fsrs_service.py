@@ -0,0 +1,328 @@
+"""
+Servicio FSRS para JuanPA.
+Centraliza la construcción de schedulers (cacheados por parámetros) y la
+conversión entre las tarjetas de la base de datos y las de la librería FSRS.
+"""
+
+from datetime import datetime, timezone, timedelta
+from functools import lru_cache
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from sqlalchemy import BigInteger
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql.functions import FunctionElement
+from sqlmodel import Session, select
+
+from . import db_models as db
+from .config import settings
+from .logging_config import get_logger
+
+# Importar FSRS con manejo de errores
+try:
+    from fsrs import Scheduler, Card as FSRSCard, Rating as FSRSRating, State
+    FSRS_AVAILABLE = True
+except ImportError:
+    print("WARNING: FSRS library not available. Review functionality will be limited.")
+    FSRS_AVAILABLE = False
+    Scheduler = None
+    FSRSCard = None
+    FSRSRating = None
+    State = None
+
+# Importar NumPy con manejo de errores
+try:
+    import numpy as np
+    from . import fsrs_math as fm
+    NUMPY_AVAILABLE = True
+except ImportError:
+    NUMPY_AVAILABLE = False
+
+logger = get_logger("juanpa.fsrs")
+
+DEFAULT_USER_ID = "default"
+
+# Número máximo de schedulers distintos que se mantienen en memoria
+SCHEDULER_CACHE_SIZE = 32
+
+# Nombres de las calificaciones en el orden de Rating (Again=1 ... Easy=4)
+RATING_NAMES = ("again", "hard", "good", "easy")
+
+# Mapeo entre el estado guardado en la base de datos y el enum de FSRS
+_DB_STATE_TO_FSRS = {
+    "new": "Learning",
+    "learning": "Learning",
+    "review": "Review",
+    "relearning": "Relearning",
+}
+
+
+def as_utc(value: Optional[datetime]) -> Optional[datetime]:
+    """Normaliza un datetime a UTC (SQLite devuelve datetimes sin zona horaria)."""
+    if value is None:
+        return None
+    if value.tzinfo is None:
+        return value.replace(tzinfo=timezone.utc)
+    return value.astimezone(timezone.utc)
+
+
+_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+
+def to_epoch_microseconds(value: Optional[datetime]) -> Optional[int]:
+    """Microsegundos desde epoch (UTC) de un datetime; el mismo valor que `epoch_microseconds` en SQL."""
+    if value is None:
+        return None
+    return (as_utc(value) - _EPOCH) // timedelta(microseconds=1)
+
+
+class epoch_microseconds(FunctionElement):
+    """
+    Microsegundos desde epoch (UTC) de una columna DateTime, calculados en
+    SQL para cargar fechas en arrays NumPy sin convertir fila a fila en
+    Python. Divididos entre 1e6 dan exactamente `as_utc(valor).timestamp()`.
+    """
+    type = BigInteger()
+    inherit_cache = True
+
+
+@compiles(epoch_microseconds)
+def _epoch_microseconds_default(element, compiler, **kw):
+    return "CAST(EXTRACT(EPOCH FROM %s) * 1000000 AS BIGINT)" % compiler.process(element.clauses, **kw)
+
+
+@compiles(epoch_microseconds, "sqlite")
+def _epoch_microseconds_sqlite(element, compiler, **kw):
+    # SQLite guarda "YYYY-MM-DD HH:MM:SS.ffffff": segundos enteros más los microsegundos del final
+    column = compiler.process(element.clauses, **kw)
+    return f"(CAST(strftime('%s', {column}) AS INTEGER) * 1000000 + CAST(substr({column}, 21) AS INTEGER))"
+
+
+@lru_cache(maxsize=SCHEDULER_CACHE_SIZE)
+def get_scheduler(
+    desired_retention: float,
+    maximum_interval: int,
+    parameters: Optional[Tuple[float, ...]] = None,
+) -> "Scheduler":
+    """
+    Devuelve un Scheduler FSRS para los parámetros dados.
+
+    Los schedulers son inmutables en la práctica, así que se comparten entre
+    requests mediante un cache LRU indexado por (retención, intervalo máximo,
+    pesos). `parameters` debe ser una tupla para poder usarse como clave.
+    """
+    if not FSRS_AVAILABLE:
+        raise RuntimeError("La librería FSRS no está disponible")
+    if parameters:
+        return Scheduler(
+            parameters=parameters,
+            desired_retention=desired_retention,
+            maximum_interval=maximum_interval,
+        )
+    return Scheduler(
+        desired_retention=desired_retention,
+        maximum_interval=maximum_interval,
+    )
+
+
+def get_scheduler_params(
+    session: Session, user_id: str = DEFAULT_USER_ID
+) -> Tuple[float, int, Optional[Tuple[float, ...]]]:
+    """Obtiene (retención, intervalo máximo, pesos) de las configuraciones del usuario."""
+    user_settings = session.exec(
+        select(db.UserSettings).where(db.UserSettings.user_id == user_id)
+    ).first()
+    if user_settings:
+        parameters = tuple(user_settings.fsrs_parameters) if user_settings.fsrs_parameters else None
+        return user_settings.fsrs_request_retention, user_settings.fsrs_maximum_interval, parameters
+    return settings.fsrs_default_retention, settings.fsrs_max_interval, None
+
+
+def get_user_scheduler(session: Session, user_id: str = DEFAULT_USER_ID) -> "Scheduler":
+    """Obtiene el Scheduler cacheado correspondiente a las configuraciones del usuario."""
+    return get_scheduler(*get_scheduler_params(session, user_id))
+
+
+def to_fsrs_card(card: db.Card) -> "FSRSCard":
+    """Convierte una tarjeta de la base de datos en una tarjeta FSRS."""
+    state = getattr(State, _DB_STATE_TO_FSRS.get(card.fsrs_state or "new", "Learning"))
+    is_new = (card.fsrs_state or "new") == "new"
+    step = None
+    if state in (State.Learning, State.Relearning):
+        step = card.fsrs_step or 0
+
+    return FSRSCard(
+        card_id=card.id,
+        state=state,
+        step=step,
+        stability=None if is_new else card.fsrs_stability,
+        difficulty=None if is_new else card.fsrs_difficulty,
+        due=as_utc(card.next_review_at),
+        last_review=as_utc(card.fsrs_last_review),
+    )
+
+
+def apply_fsrs_card(card: db.Card, fsrs_card: "FSRSCard", lapsed: bool = False) -> None:
+    """Copia el estado de una tarjeta FSRS sobre la tarjeta de la base de datos."""
+    card.fsrs_state = fsrs_card.state.name.lower()
+    card.fsrs_step = fsrs_card.step
+    card.fsrs_stability = fsrs_card.stability
+    card.fsrs_difficulty = fsrs_card.difficulty
+    card.next_review_at = fsrs_card.due
+    card.fsrs_last_review = fsrs_card.last_review
+    if lapsed:
+        card.fsrs_lapses = (card.fsrs_lapses or 0) + 1
+
+
+def review_db_card(
+    card: db.Card,
+    rating: int,
+    scheduler: Optional["Scheduler"],
+    review_datetime: Optional[datetime] = None,
+    time_taken_ms: Optional[int] = None,
+) -> db.ReviewLog:
+    """
+    Aplica un repaso FSRS a la tarjeta (modificándola en sitio) y devuelve el
+    ReviewLog con el snapshot antes/después. No hace commit: el llamador
+    decide la transacción.
+    """
+    review_datetime = as_utc(review_datetime) or datetime.now(timezone.utc)
+
+    review_log = db.ReviewLog(
+        card_id=card.id,
+        rating_given=rating,
+        review_timestamp=review_datetime,
+        previous_stability=card.fsrs_stability,
+        previous_difficulty=card.fsrs_difficulty,
+        previous_lapses=card.fsrs_lapses,
+        previous_state=card.fsrs_state,
+        previous_due_date=card.next_review_at,
+        time_taken_ms=time_taken_ms,
+        # Valores provisionales, se completan tras el repaso
+        new_stability=0.0,
+        new_difficulty=0.0,
+        new_lapses=0,
+        new_state="",
+        new_due_date=review_datetime,
+    )
+
+    if FSRS_AVAILABLE and scheduler is not None:
+        fsrs_card = to_fsrs_card(card)
+        # Un lapso es un olvido de una tarjeta que ya estaba en fase de repaso
+        lapsed = fsrs_card.state == State.Review and rating == FSRSRating.Again
+        updated_card, _ = scheduler.review_card(
+            fsrs_card, FSRSRating(rating), review_datetime=review_datetime
+        )
+        apply_fsrs_card(card, updated_card, lapsed=lapsed)
+    else:
+        # Fallback simple sin FSRS
+        card.next_review_at = review_datetime + timedelta(days=1)
+        card.fsrs_last_review = review_datetime
+        card.fsrs_state = "review"
+
+    card.updated_at = datetime.now(timezone.utc)
+
+    review_log.new_stability = card.fsrs_stability or 0.0
+    review_log.new_difficulty = card.fsrs_difficulty or 0.0
+    review_log.new_lapses = card.fsrs_lapses or 0
+    review_log.new_state = card.fsrs_state
+    review_log.new_due_date = card.next_review_at
+    return review_log
+
+
+def _step_intervals(
+    steps: Sequence[timedelta], step: "np.ndarray", graduated: "np.ndarray"
+) -> "np.ndarray":
+    """
+    Intervalos (segundos, forma (4, N)) de las tarjetas en pasos de
+    aprendizaje o reaprendizaje, con las mismas reglas que Scheduler.review_card.
+    `graduated` son los intervalos en segundos si la tarjeta pasa a repaso.
+    """
+    if not steps:
+        return graduated
+    seconds = np.array([s.total_seconds() for s in steps])
+    n_steps = len(seconds)
+    current = seconds[np.minimum(step, n_steps - 1)]
+    hard_first = seconds[0] * 1.5 if n_steps == 1 else (seconds[0] + seconds[1]) / 2
+    good_next = seconds[np.minimum(step + 1, n_steps - 1)]
+
+    again = np.full(step.shape, seconds[0])
+    hard = np.where(step == 0, hard_first, current)
+    good = np.where(step + 1 == n_steps, graduated[2], good_next)
+    in_steps = np.stack([again, hard, good, graduated[3]])
+    # Tarjetas con más pasos que los configurados: gradúan salvo con "Again"
+    overflow = (step >= n_steps)[None, :] & (np.arange(1, 5) > 1)[:, None]
+    return np.where(overflow, graduated, in_steps)
+
+
+def preview_intervals(
+    cards: List[db.Card], scheduler: Optional["Scheduler"], now: Optional[datetime] = None
+) -> List[Optional[Dict[str, int]]]:
+    """
+    Intervalo en segundos que obtendría cada tarjeta con cada calificación.
+
+    Se calcula en una sola pasada vectorizada sobre el lote con los pesos y los
+    pasos del Scheduler, sin simular cuatro repasos por tarjeta. Los intervalos
+    son los previstos sin fuzzing, como los que muestra Anki.
+    """
+    if not cards or scheduler is None or not FSRS_AVAILABLE:
+        return [None] * len(cards)
+    now = as_utc(now) or datetime.now(timezone.utc)
+    if not NUMPY_AVAILABLE:
+        return [_preview_with_scheduler(card, scheduler, now) for card in cards]
+
+    weights = np.asarray(scheduler.parameters, dtype=np.float64)
+    fsrs_cards = [to_fsrs_card(card) for card in cards]
+    state = np.array([card.state.value for card in fsrs_cards])
+    step = np.array([card.step or 0 for card in fsrs_cards])
+    stability = np.array([np.nan if card.stability is None else card.stability for card in fsrs_cards])
+    difficulty = np.array([np.nan if card.difficulty is None else card.difficulty for card in fsrs_cards])
+    # Días completos desde el último repaso, como timedelta.days en FSRS
+    elapsed = np.array([
+        np.nan if card.last_review is None else max(0, (now - card.last_review).days)
+        for card in fsrs_cards
+    ])
+
+    rating = np.arange(1, 5)[:, None]
+    is_new = np.isnan(stability) | np.isnan(difficulty)
+    safe_stability = np.where(is_new, 1.0, stability)
+    safe_difficulty = np.where(is_new, 5.0, difficulty)
+    has_last_review = ~np.isnan(elapsed)
+    current_r = np.where(has_last_review, fm.retrievability(np.nan_to_num(elapsed), safe_stability), 0.0)
+
+    long_term = np.where(
+        rating > 1,
+        fm.recall_stability(weights, safe_stability, safe_difficulty, current_r, rating),
+        fm.forget_stability(weights, safe_stability, safe_difficulty, current_r),
+    )
+    short_term = fm.short_term_stability(weights, safe_stability, rating)
+    new_stability = np.where(
+        is_new,
+        fm.initial_stability(weights, rating),
+        np.where(has_last_review & (np.nan_to_num(elapsed, nan=1.0) < 1), short_term, long_term),
+    )
+    graduated = fm.next_interval(new_stability, scheduler.desired_retention, scheduler.maximum_interval) * 86400
+
+    learning = _step_intervals(scheduler.learning_steps, step, graduated)
+    relearning = _step_intervals(scheduler.relearning_steps, step, graduated)
+    review = graduated.copy()
+    if scheduler.relearning_steps:
+        review[0] = scheduler.relearning_steps[0].total_seconds()
+
+    intervals = np.where(
+        state == State.Review.value, review,
+        np.where(state == State.Relearning.value, relearning, learning),
+    )
+    return [
+        dict(zip(RATING_NAMES, (int(value) for value in intervals[:, index])))
+        for index in range(len(cards))
+    ]
+
+
+def _preview_with_scheduler(card: db.Card, scheduler: "Scheduler", now: datetime) -> Dict[str, int]:
+    """Intervalos simulando un repaso por calificación (fallback sin NumPy)."""
+    fsrs_card = to_fsrs_card(card)
+    preview = {}
+    for name, rating in zip(RATING_NAMES, FSRSRating):
+        updated, _ = scheduler.review_card(fsrs_card, rating, review_datetime=now)
+        preview[name] = int((updated.due - now).total_seconds())
+    return preview
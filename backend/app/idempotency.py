@@ -0,0 +1,128 @@
+"""
+Cache de respuestas por Idempotency-Key para JuanPA.
+Un push reintentado con la misma clave devuelve la respuesta guardada sin
+volver a tocar la base de datos. La clave se reserva antes de ejecutar el
+push, así que un reintento que llega mientras el original sigue en curso
+espera su respuesta en lugar de aplicarlo otra vez. Es un atajo en memoria por proceso: la
+garantía de no duplicar entre workers o tras caducar la entrada la dan los
+uuid de mazos y tarjetas.
+"""
+
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+from .config import settings
+from .exceptions import ConflictError
+
+
+def payload_fingerprint(payload: Any) -> str:
+    """Huella del cuerpo ya validado, independiente del formato en que llegó."""
+    return hashlib.sha256(payload.model_dump_json().encode("utf-8")).hexdigest()
+
+
+class IdempotencyCache:
+    """Cache LRU con caducidad de respuestas indexadas por Idempotency-Key."""
+
+    def __init__(self, ttl: float = 86400, max_entries: int = 1024, wait_timeout: float = 30):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.wait_timeout = wait_timeout
+        self._entries: "OrderedDict[str, Tuple[float, str, Any]]" = OrderedDict()
+        # Claves reservadas por una petición en curso: huella y evento que se activa al terminar
+        self._in_flight: Dict[str, Tuple[str, threading.Event]] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _check_fingerprint(key: str, stored_fingerprint: str, fingerprint: str) -> None:
+        """Reutilizar una clave con un cuerpo distinto es un error del cliente."""
+        if stored_fingerprint != fingerprint:
+            raise ConflictError(
+                "Idempotency-Key reutilizada con un cuerpo distinto",
+                conflicting_field="Idempotency-Key",
+                conflicting_value=key
+            )
+
+    def _lookup(self, key: str, fingerprint: str) -> Optional[Any]:
+        """Respuesta guardada y vigente para `key`, o None. Requiere el lock."""
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        stored_at, stored_fingerprint, response = entry
+        if time.monotonic() - stored_at >= self.ttl:
+            del self._entries[key]
+            return None
+        self._check_fingerprint(key, stored_fingerprint, fingerprint)
+        self._entries.move_to_end(key)
+        return response
+
+    def get(self, key: str, fingerprint: str) -> Optional[Any]:
+        """
+        Respuesta guardada para `key`, o None. Reutilizar una clave con un
+        cuerpo distinto es un error del cliente (ConflictError).
+        """
+        with self._lock:
+            return self._lookup(key, fingerprint)
+
+    def reserve(self, key: str, fingerprint: str) -> Optional[Any]:
+        """
+        Respuesta guardada para `key`, o None si la clave queda reservada
+        para quien llama, que debe cerrarla con `put` o `release`.
+        Comprobar y reservar es un único paso bajo el lock; si otra petición
+        tiene la clave en curso se espera a que termine (hasta `wait_timeout`
+        segundos, después ConflictError) y se devuelve su respuesta.
+        """
+        deadline = time.monotonic() + self.wait_timeout
+        while True:
+            with self._lock:
+                response = self._lookup(key, fingerprint)
+                if response is not None:
+                    return response
+                in_flight = self._in_flight.get(key)
+                if in_flight is None:
+                    self._in_flight[key] = (fingerprint, threading.Event())
+                    return None
+                self._check_fingerprint(key, in_flight[0], fingerprint)
+            # Si el original falla (release) o no se guarda (ttl 0) se reintenta la reserva
+            if not in_flight[1].wait(max(0.0, deadline - time.monotonic())):
+                raise ConflictError(
+                    "Ya hay una petición en curso con esta Idempotency-Key",
+                    conflicting_field="Idempotency-Key",
+                    conflicting_value=key
+                )
+
+    def put(self, key: str, fingerprint: str, response: Any) -> None:
+        """Guarda la respuesta de `key` y libera su reserva."""
+        with self._lock:
+            if self.ttl > 0:
+                self._entries[key] = (time.monotonic(), fingerprint, response)
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+            self._release(key)
+
+    def release(self, key: str) -> None:
+        """Libera la reserva de `key` sin guardar respuesta (la petición falló)."""
+        with self._lock:
+            self._release(key)
+
+    def _release(self, key: str) -> None:
+        in_flight = self._in_flight.pop(key, None)
+        if in_flight is not None:
+            in_flight[1].set()
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            for _, done in self._in_flight.values():
+                done.set()
+            self._in_flight.clear()
+
+
+push_idempotency_cache = IdempotencyCache(
+    ttl=settings.idempotency_key_ttl,
+    max_entries=settings.idempotency_cache_max_entries,
+    wait_timeout=settings.idempotency_wait_timeout
+)
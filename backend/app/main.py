@@ -1,7 +1,13 @@
-from fastapi import FastAPI, Depends, HTTPException, UploadFile, File, Response, Query
+from fastapi import FastAPI, BackgroundTasks, Depends, HTTPException, UploadFile, File, Header, Request, Response, Query, WebSocket, WebSocketDisconnect, Path as FastAPIPath
+from fastapi.concurrency import run_in_threadpool
+from fastapi.exceptions import RequestValidationError
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
+from fastapi.responses import FileResponse, StreamingResponse
 from sqlmodel import Session, select, func, or_, asc, desc
+from pydantic import ValidationError as PydanticValidationError
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import joinedload
 from typing import List, Optional, Dict, Any 
 from datetime import datetime, timezone, timedelta, date as DateObject 
 import logging
@@ -9,43 +15,12 @@ import re
 import shutil 
 import uuid   
 import os     
+from pathlib import Path
 import json
 import time
-
-# Importar FSRS con manejo de errores
-try:
-    from fsrs import Scheduler, Card as FSRSCard, Rating as FSRSRating, State 
-    FSRS_AVAILABLE = True
-    # --- DIAGNOSTIC PRINT FOR FSRS STATE ENUM ---
-    print(f"DEBUG: FSRS State Enum Members available: {State.__members__}")
-    # --- END DIAGNOSTIC --- 
-except ImportError:
-    print("WARNING: FSRS library not available. Review functionality will be limited.")
-    FSRS_AVAILABLE = False
-    # Crear stubs para evitar errores
-    class FSRSCard:
-        def __init__(self):
-            self.due = None
-            self.lapses = 0
-            self.state = None
-            self.stability = 0.0
-            self.difficulty = 0.0
-            self.last_review = None
-    
-    class FSRSRating:
-        Again = 1
-        Hard = 2
-        Good = 3
-        Easy = 4
-    
-    class State:
-        Learning = "learning"
-        Review = "review"
-        Relearning = "relearning"
-    
-    class Scheduler:
-        def review_card(self, card, rating):
-            return card, None
+import asyncio
+import hashlib
+from urllib.parse import urlencode
 
 # Importar Gemini con manejo de errores
 try:
@@ -61,15 +36,39 @@ except ImportError as e:
     GEMINI_AVAILABLE = False
 
 from contextlib import asynccontextmanager
-from .database import engine, create_db_and_tables
+from .database import (
+    engine, close_write_coordinator, create_db_and_tables, dispose_async_engine, get_read_only_session, get_session,
+    get_replica_engine, get_write_coordinator, pool_status
+)
+from .db_routing import get_async_read_session, get_read_session, pin_to_primary, read_your_writes
+from .write_coordinator import WriteCoordinator, run_write
+from sqlmodel.ext.asyncio.session import AsyncSession
 from . import db_models as db
 from . import models as m
+from .fsrs_service import FSRS_AVAILABLE, as_utc, get_user_scheduler, preview_intervals, review_db_card
+from .pagination import encode_cursor, decode_cursor
+from .sync_service import (
+    NDJSON_MEDIA_TYPE, apply_push, device_deck_ids, fetch_sync_page, ingest_review_logs, insert_review_logs,
+    registered_review_keys, set_device_subscriptions, stream_pull_ndjson
+)
+from .sync_codec import decode_body, sync_response
+from .idempotency import payload_fingerprint, push_idempotency_cache
+from .sync_notifications import change_broadcaster
+from .sync_snapshot import iter_decompressed, load_snapshot_meta, refresh_snapshot_once, run_periodic_snapshots, snapshot_paths
+from .change_log import collapse_change_log, current_seq, run_periodic_compaction, sync_watermark
+from .review_queue import REVIEW_MODES, REVIEW_ORDERS, due_queue_cache, fetch_due_cards, get_cards_per_session
+from .fsrs_optimizer import (
+    NUMPY_AVAILABLE, MIN_LONG_TERM_REVIEWS, has_review_history, optimizer_jobs
+)
+from .stats_service import FORECAST_MAX_DAYS, get_forecast
 # from .config import settings  # Comentado para evitar conflictos con CORS
+from .config import settings as app_settings
 
 # Importar sistemas de seguridad y logging
 from .logging_config import get_logger, setup_logging
 from .exceptions import (
     JuanPAException, NotFoundError, ConflictError, ValidationError as JuanPAValidationError,
+    BusinessLogicError,
     FileProcessingError, to_http_exception
 )
 from .validators import ContentValidator, FileValidator
@@ -85,6 +84,8 @@ logger = get_logger("juanpa.main")
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 STATIC_DIR = os.path.join(BASE_DIR, "static")
 UPLOADS_DIR = os.path.join(STATIC_DIR, "uploads", "images")
+# Fuera de STATIC_DIR: el volcado completo de la cuenta solo se sirve por /api/v1/sync/snapshot
+SNAPSHOTS_DIR = Path(BASE_DIR) / app_settings.sync_snapshot_dir
 os.makedirs(UPLOADS_DIR, exist_ok=True)
 
 @asynccontextmanager
@@ -94,8 +95,27 @@ async def lifespan(app: FastAPI):
     logger.info("Base de datos y tablas verificadas/creadas.")
     app.mount("/static", StaticFiles(directory=STATIC_DIR), name="static")
     logger.info(f"Sirviendo archivos estáticos desde: {STATIC_DIR}")
+    change_broadcaster.attach(asyncio.get_running_loop())
+    compaction_task = None
+    if app_settings.change_log_compaction_interval:
+        compaction_task = asyncio.create_task(
+            run_periodic_compaction(engine, app_settings.change_log_compaction_interval)
+        )
+    snapshot_task = None
+    if app_settings.sync_snapshot_interval:
+        snapshot_task = asyncio.create_task(
+            run_periodic_snapshots(engine, SNAPSHOTS_DIR, app_settings.sync_snapshot_interval)
+        )
     yield
     logger.info("Aplicación apagándose...")
+    change_broadcaster.detach()
+    if compaction_task:
+        compaction_task.cancel()
+    if snapshot_task:
+        snapshot_task.cancel()
+    optimizer_jobs.shutdown()
+    close_write_coordinator()
+    await dispose_async_engine()
 
 app = FastAPI(
     title="Juanpa Spaced Repetition App API",
@@ -165,14 +185,18 @@ app.add_middleware(
         "Authorization",
         "X-Requested-With",
         "X-CSRFToken",
-        "X-API-Key"
+        "X-API-Key",
+        "Idempotency-Key",
+        "If-None-Match",
+        "X-Device-Id"
+    ],
+    # Cabeceras de respuesta que el cliente web necesita leer
+    expose_headers=[
+        "Idempotent-Replayed",
+        "ETag"
     ],
 )
 
-def get_session():
-    with Session(engine) as session:
-        yield session
-
 @app.get("/")
 async def read_root():
     return {"message": "Welcome to Juanpa API!"}
@@ -241,163 +265,476 @@ async def upload_image(file: UploadFile = File(...)):
         if hasattr(file, 'file') and file.file:
             file.file.close()
 
-@app.post("/api/v1/decks/", response_model=m.DeckRead)
-def create_deck(*, session: Session = Depends(get_session), deck_in: m.DeckCreate):
-    existing_deck = session.exec(select(db.Deck).where(db.Deck.name == deck_in.name)).first()
-    if existing_deck:
-        raise HTTPException(status_code=400, detail=f"Deck with name '{deck_in.name}' already exists.")
-    db_deck = db.Deck.model_validate(deck_in)
-    session.add(db_deck)
-    session.commit()
-    session.refresh(db_deck)
-    return db_deck
+@app.post("/api/v1/decks/", response_model=m.DeckRead, dependencies=[Depends(pin_to_primary)])
+def create_deck(
+    *,
+    session: Session = Depends(get_session),
+    write_coordinator: Optional[WriteCoordinator] = Depends(get_write_coordinator),
+    deck_in: m.DeckCreate
+):
+    def apply_create(write_session: Session) -> db.Deck:
+        existing_deck = write_session.exec(select(db.Deck).where(db.Deck.name == deck_in.name)).first()
+        if existing_deck:
+            raise HTTPException(status_code=400, detail=f"Deck with name '{deck_in.name}' already exists.")
+        db_deck = db.Deck.model_validate(deck_in)
+        write_session.add(db_deck)
+        write_session.flush()
+        return db_deck
+    
+    return run_write(write_coordinator, session, apply_create)
 
 @app.get("/api/v1/decks/", response_model=List[m.DeckRead])
-def read_decks(*, session: Session = Depends(get_session), skip: int = 0, limit: int = 100):
+async def read_decks(*, session: AsyncSession = Depends(get_async_read_session), skip: int = 0, limit: int = 100):
     # Filtrar mazos no eliminados
-    decks = session.exec(
+    decks = (await session.exec(
         select(db.Deck)
         .where(db.Deck.is_deleted == False)
         .offset(skip)
         .limit(limit)
-    ).all()
+    )).all()
     return decks
 
 @app.get("/api/v1/decks/{deck_id}", response_model=m.DeckReadWithCards)
-def read_deck(*, session: Session = Depends(get_session), deck_id: int):
+def read_deck(*, session: Session = Depends(get_read_session), deck_id: int):
     deck = session.get(db.Deck, deck_id)
     if not deck:
         raise HTTPException(status_code=404, detail="Deck not found")
     return deck
 
-@app.put("/api/v1/decks/{deck_id}", response_model=m.DeckRead)
-def update_deck(*, session: Session = Depends(get_session), deck_id: int, deck_in: m.DeckUpdate ):
-    db_deck = session.get(db.Deck, deck_id)
-    if not db_deck:
-        raise HTTPException(status_code=404, detail="Deck not found")
-    if deck_in.name and deck_in.name != db_deck.name:
-        existing_deck_with_new_name = session.exec(select(db.Deck).where(db.Deck.name == deck_in.name)).first()
-        if existing_deck_with_new_name:
-            raise HTTPException(status_code=400, detail=f"Another deck with name '{deck_in.name}' already exists.")
-    deck_data = deck_in.model_dump(exclude_unset=True)
-    for key, value in deck_data.items():
-        setattr(db_deck, key, value)
-    session.add(db_deck)
-    session.commit()
-    session.refresh(db_deck)
-    return db_deck
-
-@app.delete("/api/v1/decks/{deck_id}", response_model=m.DeckRead)
-def delete_deck(*, session: Session = Depends(get_session), deck_id: int):
-    deck = session.get(db.Deck, deck_id)
-    if not deck:
-        raise HTTPException(status_code=404, detail="Deck not found")
+@app.put("/api/v1/decks/{deck_id}", response_model=m.DeckRead, dependencies=[Depends(pin_to_primary)])
+def update_deck(
+    *,
+    session: Session = Depends(get_session),
+    write_coordinator: Optional[WriteCoordinator] = Depends(get_write_coordinator),
+    deck_id: int,
+    deck_in: m.DeckUpdate
+):
+    def apply_update(write_session: Session) -> db.Deck:
+        db_deck = write_session.get(db.Deck, deck_id)
+        if not db_deck:
+            raise HTTPException(status_code=404, detail="Deck not found")
+        if deck_in.name and deck_in.name != db_deck.name:
+            existing_deck_with_new_name = write_session.exec(select(db.Deck).where(db.Deck.name == deck_in.name)).first()
+            if existing_deck_with_new_name:
+                raise HTTPException(status_code=400, detail=f"Another deck with name '{deck_in.name}' already exists.")
+        deck_data = deck_in.model_dump(exclude_unset=True)
+        for key, value in deck_data.items():
+            setattr(db_deck, key, value)
+        write_session.add(db_deck)
+        write_session.flush()
+        return db_deck
     
-    # Soft delete: marcar como eliminado en lugar de eliminar físicamente
-    deck.is_deleted = True
-    deck.deleted_at = datetime.now(timezone.utc)
-    deck.updated_at = datetime.now(timezone.utc)  # Actualizar timestamp para sincronización
+    return run_write(write_coordinator, session, apply_update)
+
+@app.delete("/api/v1/decks/{deck_id}", response_model=m.DeckRead, dependencies=[Depends(pin_to_primary)])
+def delete_deck(
+    *,
+    session: Session = Depends(get_session),
+    write_coordinator: Optional[WriteCoordinator] = Depends(get_write_coordinator),
+    deck_id: int
+):
+    def apply_delete(write_session: Session) -> db.Deck:
+        deck = write_session.get(db.Deck, deck_id)
+        if not deck:
+            raise HTTPException(status_code=404, detail="Deck not found")
+        
+        # Soft delete: marcar como eliminado en lugar de eliminar físicamente
+        deck.is_deleted = True
+        deck.deleted_at = datetime.now(timezone.utc)
+        deck.updated_at = datetime.now(timezone.utc)  # Actualizar timestamp para sincronización
+        
+        write_session.add(deck)
+        write_session.flush()
+        return deck
     
-    session.add(deck)
-    session.commit()
-    session.refresh(deck)
-    return deck
+    return run_write(write_coordinator, session, apply_delete)
 
-@app.post("/api/v1/cards/", response_model=List[m.CardRead])
-def create_card(*, session: Session = Depends(get_session), card_in: m.CardCreate):
-    deck = session.get(db.Deck, card_in.deck_id)
-    if not deck:
-        raise HTTPException(status_code=404, detail="Deck not found")
+@app.post("/api/v1/cards/", response_model=List[m.CardRead], dependencies=[Depends(pin_to_primary)])
+def create_card(
+    *,
+    session: Session = Depends(get_session),
+    write_coordinator: Optional[WriteCoordinator] = Depends(get_write_coordinator),
+    card_in: m.CardCreate
+):
+    def apply_create(write_session: Session) -> db.Card:
+        deck = write_session.get(db.Deck, card_in.deck_id)
+        if not deck:
+            raise HTTPException(status_code=404, detail="Deck not found")
+        
+        # Procesar tarjeta estándar por simplicidad
+        db_card = db.Card.model_validate(card_in)
+        write_session.add(db_card)
+        write_session.flush()
+        return db_card
     
-    # Procesar tarjeta estándar por simplicidad
-    db_card = db.Card.model_validate(card_in)
-    session.add(db_card)
-    session.commit()
-    session.refresh(db_card)
+    db_card = run_write(write_coordinator, session, apply_create)
+    due_queue_cache.cards_changed([db_card])
     return [db_card]
 
 @app.get("/api/v1/cards/", response_model=List[m.CardRead])
-def read_cards(*, session: Session = Depends(get_session), skip: int = 0, limit: int = 100, deck_id: Optional[int] = None):
+async def read_cards(*, session: AsyncSession = Depends(get_async_read_session), skip: int = 0, limit: int = 100, deck_id: Optional[int] = None):
     query = select(db.Card)
     if deck_id:
         query = query.where(db.Card.deck_id == deck_id)
-    cards = session.exec(query.offset(skip).limit(limit)).all()
+    cards = (await session.exec(query.offset(skip).limit(limit))).all()
     return cards
 
 @app.get("/api/v1/cards/{card_id}", response_model=m.CardReadWithDeck)
-def read_card(*, session: Session = Depends(get_session), card_id: int):
-    card = session.get(db.Card, card_id)
+def read_card(*, session: Session = Depends(get_read_session), card_id: int):
+    # El mazo viaja en la respuesta: cargarlo en la misma consulta y no de forma perezosa
+    card = session.get(db.Card, card_id, options=[joinedload(db.Card.deck)])
     if not card:
         raise HTTPException(status_code=404, detail="Card not found")
     return card
 
-@app.put("/api/v1/cards/{card_id}", response_model=m.CardRead)
-def update_card(*, session: Session = Depends(get_session), card_id: int, card_in: m.CardUpdate):
-    db_card = session.get(db.Card, card_id)
-    if not db_card:
-        raise HTTPException(status_code=404, detail="Card not found")
-    card_data = card_in.model_dump(exclude_unset=True)
-    for key, value in card_data.items():
-        setattr(db_card, key, value)
-    session.add(db_card)
-    session.commit()
-    session.refresh(db_card)
+@app.put("/api/v1/cards/{card_id}", response_model=m.CardRead, dependencies=[Depends(pin_to_primary)])
+def update_card(
+    *,
+    session: Session = Depends(get_session),
+    write_coordinator: Optional[WriteCoordinator] = Depends(get_write_coordinator),
+    card_id: int,
+    card_in: m.CardUpdate
+):
+    def apply_update(write_session: Session) -> db.Card:
+        db_card = write_session.get(db.Card, card_id)
+        if not db_card:
+            raise HTTPException(status_code=404, detail="Card not found")
+        card_data = card_in.model_dump(exclude_unset=True)
+        for key, value in card_data.items():
+            setattr(db_card, key, value)
+        write_session.add(db_card)
+        write_session.flush()
+        return db_card
+    
+    db_card = run_write(write_coordinator, session, apply_update)
+    due_queue_cache.cards_changed([db_card])
     return db_card
 
-@app.delete("/api/v1/cards/{card_id}", response_model=m.CardRead)
-def delete_card(*, session: Session = Depends(get_session), card_id: int):
-    card = session.get(db.Card, card_id)
-    if not card:
-        raise HTTPException(status_code=404, detail="Card not found")
-    
-    # Soft delete: marcar como eliminado en lugar de eliminar físicamente
-    card.is_deleted = True
-    card.deleted_at = datetime.now(timezone.utc)
-    card.updated_at = datetime.now(timezone.utc)  # Actualizar timestamp para sincronización
+@app.delete("/api/v1/cards/{card_id}", response_model=m.CardRead, dependencies=[Depends(pin_to_primary)])
+def delete_card(
+    *,
+    session: Session = Depends(get_session),
+    write_coordinator: Optional[WriteCoordinator] = Depends(get_write_coordinator),
+    card_id: int
+):
+    def apply_delete(write_session: Session) -> db.Card:
+        card = write_session.get(db.Card, card_id)
+        if not card:
+            raise HTTPException(status_code=404, detail="Card not found")
+        
+        # Soft delete: marcar como eliminado en lugar de eliminar físicamente
+        card.is_deleted = True
+        card.deleted_at = datetime.now(timezone.utc)
+        card.updated_at = datetime.now(timezone.utc)  # Actualizar timestamp para sincronización
+        
+        write_session.add(card)
+        write_session.flush()
+        return card
     
-    session.add(card)
-    session.commit()
-    session.refresh(card)
+    card = run_write(write_coordinator, session, apply_delete)
+    due_queue_cache.cards_changed([card])
     return card
 
-@app.post("/api/v1/cards/{card_id}/review", response_model=m.CardRead)
-def review_card(*, session: Session = Depends(get_session), card_id: int, review_input: m.CardReviewPayload):
-    card = session.get(db.Card, card_id)
-    if not card:
-        raise HTTPException(status_code=404, detail="Card not found")
+@app.post("/api/v1/cards/{card_id}/review", response_model=m.CardRead, dependencies=[Depends(pin_to_primary)])
+def review_card(
+    *,
+    session: Session = Depends(get_session),
+    write_coordinator: Optional[WriteCoordinator] = Depends(get_write_coordinator),
+    card_id: int,
+    review_input: m.CardReviewPayload
+):
+    """
+    Registra un repaso. En SQLite pasa por el coordinador de escrituras, que
+    agrupa los repasos concurrentes en un mismo commit.
+    """
+    def apply_review(write_session: Session) -> db.Card:
+        card = write_session.get(db.Card, card_id)
+        if not card or card.is_deleted:
+            raise HTTPException(status_code=404, detail="Card not found")
+        
+        # El scheduler se obtiene del cache LRU según las configuraciones del usuario
+        scheduler = get_user_scheduler(write_session) if FSRS_AVAILABLE else None
+        review_log = review_db_card(
+            card,
+            review_input.rating,
+            scheduler,
+            time_taken_ms=review_input.time_taken_ms
+        )
+        
+        # Tarjeta y log de repaso se guardan en la misma transacción
+        write_session.add(card)
+        write_session.add(review_log)
+        write_session.flush()
+        return card
     
-    # Fallback simple sin FSRS por ahora
-    next_review = datetime.now(timezone.utc) + timedelta(days=1)
-    card.next_review_at = next_review
-    session.add(card)
-    session.commit() 
-    session.refresh(card)
+    card = run_write(write_coordinator, session, apply_review)
+    due_queue_cache.cards_changed([card])
     return card
 
-@app.get("/api/v1/review/next-card", response_model=Optional[m.CardReadWithDeck])
-def get_next_review_card(
+@app.post("/api/v1/reviews/batch", response_model=m.ReviewBatchResponse, dependencies=[Depends(pin_to_primary)])
+def review_cards_batch(
     *,
     session: Session = Depends(get_session),
-    deck_id: Optional[int] = Query(None, description="ID del mazo para filtrar las tarjetas a repasar")
+    write_coordinator: Optional[WriteCoordinator] = Depends(get_write_coordinator),
+    payload: m.ReviewBatchRequest
+):
+    """
+    Aplica un lote de repasos hechos offline en una sola transacción, que en
+    SQLite se ejecuta en el coordinador de escrituras (lecturas incluidas).
+    Las tarjetas se cargan con una única consulta IN, los repasos se aplican
+    en orden cronológico y los ReviewLog se insertan en bloque.
+    Un repaso ya registrado (misma tarjeta y `reviewed_at`, p. ej. al reenviar
+    el lote) no se vuelve a aplicar: se marca como `duplicate` en su ítem.
+    """
+    start_time = time.time()
+    logger.operation_start("review_cards_batch", reviews=len(payload.reviews))
+    
+    def apply_batch(write_session: Session):
+        card_ids = {item.card_id for item in payload.reviews}
+        cards = write_session.exec(
+            select(db.Card).where(db.Card.id.in_(card_ids), db.Card.is_deleted == False)
+        ).all()
+        cards_by_id = {card.id: card for card in cards}
+    
+        scheduler = get_user_scheduler(write_session) if FSRS_AVAILABLE else None
+        now = datetime.now(timezone.utc)
+        # Los repasos sin reviewed_at se separan un microsegundo para no compartir clave única
+        review_times = {
+            index: as_utc(item.reviewed_at) or now + timedelta(microseconds=index)
+            for index, item in enumerate(payload.reviews)
+        }
+        registered = registered_review_keys(write_session, list(cards_by_id), list(review_times.values()))
+    
+        # Orden cronológico estable: los repasos de una misma tarjeta se encadenan
+        ordered_items = sorted(enumerate(payload.reviews), key=lambda pair: review_times[pair[0]])
+    
+        results: Dict[int, m.ReviewBatchItemResult] = {}
+        review_logs = []
+        duplicated = 0
+        for index, item in ordered_items:
+            card = cards_by_id.get(item.card_id)
+            if not card:
+                results[index] = m.ReviewBatchItemResult(
+                    index=index, card_id=item.card_id, success=False, error="Card not found"
+                )
+                continue
+        
+            review_key = (card.id, review_times[index])
+            if review_key in registered:
+                duplicated += 1
+                results[index] = m.ReviewBatchItemResult(
+                    index=index, card_id=item.card_id, success=True, duplicate=True, card=m.CardRead.model_validate(card)
+                )
+                continue
+        
+            try:
+                review_log = review_db_card(
+                    card,
+                    item.rating,
+                    scheduler,
+                    review_datetime=review_times[index],
+                    time_taken_ms=item.time_taken_ms
+                )
+            except Exception as e:
+                logger.error(f"Error aplicando repaso {index} a la tarjeta {item.card_id}: {e}")
+                results[index] = m.ReviewBatchItemResult(
+                    index=index, card_id=item.card_id, success=False, error=str(e)
+                )
+                continue
+        
+            review_logs.append(review_log.model_dump(exclude={"id"}))
+            registered.add(review_key)
+            # Se serializa ya: tras el commit la sesión expira las tarjetas y recargarlas costaría una query cada una
+            results[index] = m.ReviewBatchItemResult(
+                index=index, card_id=item.card_id, success=True, card=m.CardRead.model_validate(card)
+            )
+        
+        # Capturado antes del commit, que expira las tarjetas de la sesión
+        queue_updates = [
+            (
+                card.id, card.deck_id, card.next_review_at, False,
+                card.fsrs_stability, card.fsrs_last_review, card.updated_at
+            )
+            for card in cards_by_id.values()
+        ]
+        # Ignora además los repasos que un envío concurrente del mismo lote registró antes
+        insert_review_logs(write_session, review_logs)
+        return results, queue_updates, len(review_logs), duplicated
+    
+    try:
+        results, queue_updates, processed, duplicated = run_write(write_coordinator, session, apply_batch)
+    except Exception as e:
+        session.rollback()
+        logger.operation_error("review_cards_batch", e, time.time() - start_time)
+        raise HTTPException(status_code=500, detail=f"Error guardando repasos: {str(e)}")
+    for queue_update in queue_updates:
+        due_queue_cache.card_changed(*queue_update)
+    
+    failed = len(payload.reviews) - processed - duplicated
+    logger.operation_success(
+        "review_cards_batch",
+        execution_time=time.time() - start_time,
+        processed=processed,
+        failed=failed
+    )
+    
+    message = f"{processed} repasos aplicados"
+    if duplicated:
+        message += f", {duplicated} ya registrados"
+    if failed:
+        message += f", {failed} rechazados"
+    return m.ReviewBatchResponse(
+        message=message,
+        processed=processed,
+        failed=failed,
+        duplicated=duplicated,
+        results=[results[index] for index in range(len(payload.reviews))]
+    )
+
+def with_interval_previews(session: Session, cards: List[db.Card], now: datetime) -> List[m.CardReadForReview]:
+    """Serializa las tarjetas de repaso añadiendo los intervalos previstos de las cuatro calificaciones."""
+    scheduler = get_user_scheduler(session) if FSRS_AVAILABLE else None
+    previews = preview_intervals(cards, scheduler, now)
+    return [
+        m.CardReadForReview.model_validate(card, from_attributes=True).model_copy(update={
+            "intervals": m.IntervalPreview(**preview) if preview else None
+        })
+        for card, preview in zip(cards, previews)
+    ]
+
+@app.get("/api/v1/review/next-card", response_model=Optional[m.CardReadForReview])
+def get_next_review_card(
+    *,
+    session: Session = Depends(get_read_session),
+    deck_id: Optional[int] = Query(None, description="ID del mazo para filtrar las tarjetas a repasar"),
+    order: str = Query("due", pattern=f"^({'|'.join(REVIEW_ORDERS)})$", description="Por vencimiento o la de mayor riesgo de olvido primero")
 ):
-    """Obtiene la próxima tarjeta que necesita repaso."""
+    """Obtiene la próxima tarjeta que necesita repaso, con los intervalos de cada calificación."""
     now = datetime.now(timezone.utc)
+    card = due_queue_cache.next_card(session, now, deck_id=deck_id, order=order)
+    if card is None:
+        return None
+    return with_interval_previews(session, [card], now)[0]
+
+@app.get("/api/v1/review/queue/stats")
+def get_review_queue_stats():
+    """Contadores de la cola de repaso en memoria (aciertos, cargas, desalojos)."""
+    return due_queue_cache.stats()
+
+@app.get("/api/v1/db/pool/stats")
+def get_db_pool_stats(
+    write_coordinator: Optional[WriteCoordinator] = Depends(get_write_coordinator),
+    replica: Optional[Engine] = Depends(get_replica_engine)
+):
+    """
+    Estado del pool de conexiones a la base de datos (ocupadas, libres,
+    overflow), del coordinador de escrituras y, si hay réplica, de su pool y
+    del reparto de lecturas entre primario y réplica.
+    """
+    stats = pool_status(engine)
+    stats["write_coordinator"] = write_coordinator.stats() if write_coordinator else None
+    stats["replica"] = pool_status(replica) if replica is not None else None
+    stats["read_routing"] = read_your_writes.stats()
+    return stats
+
+@app.get("/api/v1/review/session", response_model=m.ReviewSessionResponse)
+def get_review_session(
+    *,
+    session: Session = Depends(get_read_session),
+    deck_id: Optional[int] = Query(None, description="ID del mazo para filtrar las tarjetas a repasar"),
+    limit: Optional[int] = Query(None, ge=1, le=100, description="Tarjetas a devolver (por defecto, las de la configuración)"),
+    mode: str = Query("mixed", pattern=f"^({'|'.join(REVIEW_MODES)})$", description="Repasos, nuevas o ambas intercaladas"),
+    cursor: Optional[str] = Query(None, description="Token de continuación devuelto por la página anterior")
+):
+    """Obtiene un lote de tarjetas pendientes para estudiar en una sola petición."""
+    try:
+        cursor_data = decode_cursor(cursor)
+    except JuanPAException as exc:
+        raise to_http_exception(exc)
     
-    # Query simplificada
-    query = select(db.Card).where(
-        or_(
-            db.Card.next_review_at == None,  # Nunca repasadas
-            db.Card.next_review_at <= now    # Vencidas
-        )
+    now = datetime.now(timezone.utc)
+    cards, next_cursor = fetch_due_cards(
+        session,
+        now,
+        limit=limit or get_cards_per_session(session),
+        deck_id=deck_id,
+        mode=mode,
+        cursor=cursor_data
     )
+    return m.ReviewSessionResponse(
+        cards=with_interval_previews(session, cards, now),
+        next_cursor=encode_cursor(next_cursor) if next_cursor else None
+    )
+
+@app.post("/api/v1/fsrs/optimize", response_model=m.FSRSOptimizationJob, status_code=202)
+def start_fsrs_optimization(*, session: Session = Depends(get_read_session)):
+    """
+    Lanza el ajuste de los pesos FSRS sobre el historial de ReviewLog.
+    Aquí solo se comprueba que haya historial suficiente: la lectura del
+    historial en bloques y el cálculo corren en un pool de procesos, con su
+    propia conexión; el resultado se consulta en /api/v1/fsrs/optimize/{job_id}.
+    """
+    if not NUMPY_AVAILABLE:
+        raise HTTPException(status_code=503, detail="Optimización FSRS no disponible: falta NumPy")
     
-    if deck_id:
-        query = query.where(db.Card.deck_id == deck_id)
+    if not has_review_history(session):
+        raise to_http_exception(BusinessLogicError(
+            f"Historial insuficiente: se necesitan al menos {MIN_LONG_TERM_REVIEWS} repasos",
+            operation="fsrs_optimize"
+        ))
+    return optimizer_jobs.submit(session.get_bind().url.render_as_string(hide_password=False))
+
+@app.get("/api/v1/fsrs/optimize/{job_id}", response_model=m.FSRSOptimizationJob)
+def get_fsrs_optimization(*, job_id: str):
+    """Consulta el estado y el resultado de un trabajo de optimización FSRS."""
+    job = optimizer_jobs.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Optimization job not found")
+    return job
+
+@app.post("/api/v1/fsrs/optimize/{job_id}/apply", response_model=m.FSRSParametersApplied, dependencies=[Depends(pin_to_primary)])
+def apply_fsrs_optimization(
+    *,
+    session: Session = Depends(get_session),
+    write_coordinator: Optional[WriteCoordinator] = Depends(get_write_coordinator),
+    job_id: str
+):
+    """Guarda los pesos ajustados en las configuraciones del usuario."""
+    job = optimizer_jobs.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Optimization job not found")
+    if job["status"] != "completed":
+        raise HTTPException(status_code=409, detail=f"Optimization job is {job['status']}")
     
-    query = query.order_by(asc(db.Card.id))
+    parameters = job["result"]["parameters"]
     
-    card = session.exec(query).first()
-    return card
+    def save_parameters(write_session: Session) -> None:
+        user_settings = write_session.exec(
+            select(db.UserSettings).where(db.UserSettings.user_id == "default")
+        ).first()
+        if not user_settings:
+            user_settings = db.UserSettings(user_id="default")
+        user_settings.fsrs_parameters = parameters
+        user_settings.update_timestamp()
+        write_session.add(user_settings)
+    
+    run_write(write_coordinator, session, save_parameters)
+    return m.FSRSParametersApplied(message="Pesos FSRS aplicados", parameters=parameters)
+
+# --- Endpoints para Estadísticas ---
+@app.get("/api/v1/stats/forecast", response_model=m.ForecastResponse)
+def get_review_forecast(
+    *,
+    session: Session = Depends(get_read_session),
+    days: int = Query(default=30, ge=1, le=FORECAST_MAX_DAYS)
+):
+    """
+    Pronostica cuántos repasos habrá cada día simulando FSRS sobre todas las
+    tarjetas. El resultado se cachea hasta que cambie alguna tarjeta.
+    """
+    if not NUMPY_AVAILABLE:
+        raise HTTPException(status_code=503, detail="NumPy is not available")
+    return get_forecast(session, days)
 
 @app.get("/api/v1/gemini/status", response_model=m.GeminiStatusResponse)
 async def get_gemini_status():
@@ -442,10 +779,11 @@ async def get_gemini_status():
             last_error=str(e)
         ) 
 
-@app.post("/api/v1/gemini/generate-cards", response_model=m.CardGenerationResult)
+@app.post("/api/v1/gemini/generate-cards", response_model=m.CardGenerationResult, dependencies=[Depends(pin_to_primary)])
 async def generate_cards_with_gemini(
     *,
     session: Session = Depends(get_session),
+    write_coordinator: Optional[WriteCoordinator] = Depends(get_write_coordinator),
     request: m.CardGenerationRequest
 ):
     """Genera tarjetas usando Gemini AI."""
@@ -467,10 +805,8 @@ async def generate_cards_with_gemini(
                 detail="Gemini no está configurado correctamente. Verifica la API key."
             )
         
-        # Manejar creación de mazo si es necesario
-        target_deck = None
+        # Validar el mazo antes de llamar a Gemini; se escribe después, en una sola transacción
         if request.deck_id == -1:
-            # Crear nuevo mazo
             if not request.deck_name:
                 raise HTTPException(
                     status_code=400,
@@ -487,26 +823,15 @@ async def generate_cards_with_gemini(
                     status_code=409,
                     detail=f"Ya existe un mazo con el nombre '{request.deck_name}'"
                 )
-            
-            # Crear el nuevo mazo
-            target_deck = db.Deck(
-                name=request.deck_name,
-                description=request.deck_description or f"Mazo generado por IA sobre: {request.topic}",
-                created_at=datetime.now(timezone.utc),
-                updated_at=datetime.now(timezone.utc)
-            )
-            session.add(target_deck)
-            session.flush()  # Para obtener el ID
-            logger.info(f"Nuevo mazo creado: '{target_deck.name}' (ID: {target_deck.id})")
         else:
             # Usar mazo existente
-            target_deck = session.get(db.Deck, request.deck_id)
-            if not target_deck:
+            existing_deck = session.get(db.Deck, request.deck_id)
+            if not existing_deck:
                 raise HTTPException(
                     status_code=404,
                     detail=f"Mazo con ID {request.deck_id} no encontrado"
                 )
-            logger.info(f"Usando mazo existente: '{target_deck.name}' (ID: {target_deck.id})")
+            logger.info(f"Usando mazo existente: '{existing_deck.name}' (ID: {existing_deck.id})")
         
         # Generar tarjetas con Gemini
         logger.info("Llamando al servicio Gemini...")
@@ -534,48 +859,79 @@ async def generate_cards_with_gemini(
         
         logger.info(f"Gemini generó {len(gemini_response.cards)} tarjetas")
         
-        # Crear las tarjetas en la base de datos
-        created_cards = []
         warnings = []
         errors = []
         
-        for i, generated_card in enumerate(gemini_response.cards):
-            try:
-                # Determinar contenido basado en el tipo de tarjeta
-                front_content = None
-                back_content = None
-                cloze_data = None
-                
-                if hasattr(generated_card, 'cloze_text') and generated_card.cloze_text:
-                    # Tarjeta cloze
-                    cloze_data = {"cloze_text": generated_card.cloze_text}
-                else:
-                    # Tarjeta estándar
-                    front_content = generated_card.front_content
-                    back_content = generated_card.back_content
-                
-                # Crear la tarjeta en la DB
-                db_card = db.Card(
-                    deck_id=target_deck.id or 0,  # Asegurar que no sea None
-                    front_content=front_content,
-                    back_content=back_content,
-                    cloze_data=cloze_data,
-                    tags=generated_card.tags or [],
+        def save_generated_cards(write_session: Session):
+            if request.deck_id == -1:
+                # Otra request pudo crear el mazo mientras Gemini generaba
+                if write_session.exec(select(db.Deck.id).where(db.Deck.name == request.deck_name)).first():
+                    raise HTTPException(
+                        status_code=409,
+                        detail=f"Ya existe un mazo con el nombre '{request.deck_name}'"
+                    )
+                target_deck = db.Deck(
+                    name=request.deck_name,
+                    description=request.deck_description or f"Mazo generado por IA sobre: {request.topic}",
                     created_at=datetime.now(timezone.utc),
-                    updated_at=datetime.now(timezone.utc),
-                    # Inicializar campos FSRS
-                    next_review_at=datetime.now(timezone.utc),
-                    fsrs_state="new",
-                    fsrs_stability=2.5,
-                    fsrs_difficulty=6.0,
-                    fsrs_lapses=0
+                    updated_at=datetime.now(timezone.utc)
                 )
-                
-                session.add(db_card)
-                session.flush()  # Para obtener el ID
-                
-                # Convertir a CardRead para la respuesta
-                card_read = m.CardRead(
+                write_session.add(target_deck)
+                write_session.flush()  # Para obtener el ID
+                logger.info(f"Nuevo mazo creado: '{target_deck.name}' (ID: {target_deck.id})")
+            else:
+                target_deck = write_session.get(db.Deck, request.deck_id)
+                if not target_deck:
+                    raise HTTPException(
+                        status_code=404,
+                        detail=f"Mazo con ID {request.deck_id} no encontrado"
+                    )
+            
+            # Crear las tarjetas en la base de datos
+            db_cards = []
+            for i, generated_card in enumerate(gemini_response.cards):
+                try:
+                    # Determinar contenido basado en el tipo de tarjeta
+                    front_content = None
+                    back_content = None
+                    cloze_data = None
+                    
+                    if hasattr(generated_card, 'cloze_text') and generated_card.cloze_text:
+                        # Tarjeta cloze
+                        cloze_data = {"cloze_text": generated_card.cloze_text}
+                    else:
+                        # Tarjeta estándar
+                        front_content = generated_card.front_content
+                        back_content = generated_card.back_content
+                    
+                    # Crear la tarjeta en la DB
+                    db_cards.append(db.Card(
+                        deck_id=target_deck.id or 0,  # Asegurar que no sea None
+                        front_content=front_content,
+                        back_content=back_content,
+                        cloze_data=cloze_data,
+                        tags=generated_card.tags or [],
+                        created_at=datetime.now(timezone.utc),
+                        updated_at=datetime.now(timezone.utc),
+                        # Inicializar campos FSRS
+                        next_review_at=datetime.now(timezone.utc),
+                        fsrs_state="new",
+                        fsrs_stability=2.5,
+                        fsrs_difficulty=6.0,
+                        fsrs_lapses=0
+                    ))
+                    
+                except Exception as e:
+                    error_msg = f"Error creando tarjeta {i+1}: {str(e)}"
+                    logger.error(error_msg)
+                    errors.append(error_msg)
+            
+            write_session.add_all(db_cards)
+            write_session.flush()  # Para obtener los IDs
+            
+            # Convertir a CardRead para la respuesta
+            created_cards = [
+                m.CardRead(
                     id=db_card.id or 0,
                     deck_id=db_card.deck_id,
                     front_content=db_card.front_content,
@@ -590,17 +946,21 @@ async def generate_cards_with_gemini(
                     created_at=db_card.created_at,
                     updated_at=db_card.updated_at
                 )
-                
-                created_cards.append(card_read)
-                logger.info(f"Tarjeta {i+1} creada con ID: {db_card.id}")
-                
-            except Exception as e:
-                error_msg = f"Error creando tarjeta {i+1}: {str(e)}"
-                logger.error(error_msg)
-                errors.append(error_msg)
+                for db_card in db_cards
+            ]
+            return target_deck.id, target_deck.name, created_cards
         
-        # Guardar cambios
-        session.commit()
+        # Mazo y tarjetas se guardan juntos por el coordinador de escrituras
+        deck_id, deck_name, created_cards = await run_in_threadpool(
+            run_write, write_coordinator, session, save_generated_cards
+        )
+        for card_read in created_cards:
+            logger.info(f"Tarjeta creada con ID: {card_read.id}")
+            due_queue_cache.card_changed(
+                card_read.id, card_read.deck_id, card_read.next_review_at,
+                stability=card_read.fsrs_stability, last_review=card_read.fsrs_last_review,
+                updated_at=card_read.updated_at
+            )
         
         execution_time = time.time() - start_time
         logger.info(f"Generación completada: {len(created_cards)} tarjetas creadas en {execution_time:.2f}s")
@@ -609,8 +969,8 @@ async def generate_cards_with_gemini(
         metadata = {
             "generation_time": execution_time,
             "gemini_model": getattr(generator, 'model_name', 'unknown'),
-            "deck_id": target_deck.id,
-            "deck_name": target_deck.name,
+            "deck_id": deck_id,
+            "deck_name": deck_name,
             "request_params": {
                 "topic": request.topic,
                 "num_cards": request.num_cards,
@@ -646,292 +1006,378 @@ async def generate_cards_with_gemini(
             warnings=[]
         )
 
+# Parámetros del pull que solo trocean la respuesta: un pull paginado completo equivale al entero
+SYNC_PAGING_PARAMS = ("cursor", "limit")
+
+def sync_variant(request: Request) -> str:
+    """
+    Huella de los parámetros del pull (deviceId, delta, sinceSeq,
+    lastSyncTimestamp...) normalizados, para que cada variante tenga su ETag.
+    """
+    params = sorted((key, value) for key, value in request.query_params.multi_items() if key not in SYNC_PAGING_PARAMS)
+    return hashlib.sha1(urlencode(params).encode("utf-8")).hexdigest()[:16]
+
+def sync_etag(seq: int, variant: str) -> str:
+    """
+    ETag débil del estado de sincronización: cambia con cada entrada del
+    registro de cambios y con la variante del pull pedida.
+    """
+    return f'W/"sync-{seq}-{variant}"'
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Comparación débil de If-None-Match (lista de etiquetas o "*")."""
+    if not if_none_match:
+        return False
+    candidates = [tag.strip() for tag in if_none_match.split(",")]
+    return "*" in candidates or any(tag.removeprefix("W/") == etag.removeprefix("W/") for tag in candidates)
+
+def not_modified(etag: str) -> Response:
+    return Response(status_code=304, headers={"ETag": etag, "Vary": "Accept, Accept-Encoding"})
+
+# Identificador de dispositivo elegido por el cliente (p. ej. un UUID)
+DEVICE_ID_PATTERN = r"^[A-Za-z0-9._-]{1,64}$"
+
+@app.head("/api/v1/sync/pull")
+async def sync_pull_probe(*, request: Request, session: AsyncSession = Depends(get_async_read_session)):
+    """
+    Sondeo barato de "¿hay cambios?": responde solo con el ETag del último
+    seq (cacheado en memoria), o 304 si coincide con `If-None-Match`.
+    No lee mazos ni tarjetas.
+    """
+    etag = sync_etag(await session.run_sync(sync_watermark.get), sync_variant(request))
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return not_modified(etag)
+    return Response(status_code=200, headers={"ETag": etag})
+
 @app.get("/api/v1/sync/pull", response_model=m.PullResponse)
-def sync_pull(
+async def sync_pull(
     *,
-    session: Session = Depends(get_session),
-    last_sync_timestamp_param: Optional[datetime] = Query(None, alias="lastSyncTimestamp")
+    request: Request,
+    session: AsyncSession = Depends(get_async_read_session),
+    last_sync_timestamp_param: Optional[datetime] = Query(None, alias="lastSyncTimestamp"),
+    since_seq: Optional[int] = Query(None, ge=0, alias="sinceSeq", description="Último seq del registro de cambios recibido"),
+    limit: Optional[int] = Query(None, ge=1, le=5000, description="Máximo de filas por página (sin límite si se omite)"),
+    cursor: Optional[str] = Query(None, description="Token de continuación devuelto por la página anterior"),
+    delta: bool = Query(False, description="Con sinceSeq, enviar las tarjetas modificadas solo con las columnas cambiadas"),
+    device_id: Optional[str] = Query(None, alias="deviceId", pattern=DEVICE_ID_PATTERN, description="Dispositivo cuyas suscripciones a mazos limitan el pull")
 ):
     """
     Endpoint para pull de sincronización. 
     Devuelve todos los cambios desde el último timestamp proporcionado por el cliente.
+    Con `sinceSeq` se devuelven las entidades con entradas en el registro de
+    cambios posteriores a ese seq, sin depender de relojes; `last_seq` es el
+    valor a enviar en el próximo pull.
+    Con `limit` la respuesta se pagina y `next_cursor` permite retomar una
+    sincronización interrumpida.
+    Con `delta` (solo junto a `sinceSeq`) las tarjetas actualizadas llegan en
+    `card_patches` con únicamente `id`, `updated_at` y las columnas cambiadas.
+    El formato (JSON, JSON columnar o MessagePack) y la compresión se negocian
+    con `Accept` y `Accept-Encoding`.
+    Es asíncrono: las ráfagas de pulls esperan a la base de datos sin ocupar
+    hilos del pool de anyio.
+    Las respuestas completas (sin `next_cursor`) llevan un ETag propio de la
+    variante pedida (mismos parámetros salvo la paginación); si el cliente lo
+    reenvía en `If-None-Match` con esos parámetros y no hubo escrituras desde
+    entonces se responde 304 sin consultar mazos ni tarjetas.
+    Con `deviceId` solo se sincronizan los mazos suscritos por ese dispositivo
+    (todos si no tiene suscripciones); los mazos de los que se desuscribió
+    llegan en `evicted_deck_ids` para que los borre localmente.
     """
-    server_timestamp = datetime.now(timezone.utc)
-    
-    if last_sync_timestamp_param:
-        # Asegurar que el parámetro tenga timezone
-        if last_sync_timestamp_param.tzinfo is None:
-            last_sync_timestamp = last_sync_timestamp_param.replace(tzinfo=timezone.utc)
-        else:
-            last_sync_timestamp = last_sync_timestamp_param
-        
-        # Obtener mazos modificados desde el último sync
-        decks_query = select(db.Deck).where(db.Deck.updated_at > last_sync_timestamp)
-        cards_query = select(db.Card).where(db.Card.updated_at > last_sync_timestamp)
-    else:
-        # Primer sync, obtener todo
-        decks_query = select(db.Deck)
-        cards_query = select(db.Card)
-    
-    decks = session.exec(decks_query).all()
-    cards = session.exec(cards_query).all()
-    
-    # Convertir a modelos de sincronización (que incluyen campos como is_deleted)
-    deck_sync_reads = []
-    for deck in decks:
-        deck_sync_reads.append(m.DeckSyncRead(
-            id=deck.id or 0,
-            name=deck.name,
-            description=deck.description,
-            created_at=deck.created_at,
-            updated_at=deck.updated_at,
-            is_deleted=deck.is_deleted,  # Usar valor real de la base de datos
-            deleted_at=deck.deleted_at
-        ))
-    
-    card_sync_reads = []
-    for card in cards:
-        card_sync_reads.append(m.CardSyncRead(
-            id=card.id or 0,
-            deck_id=card.deck_id,
-            front_content=card.front_content,
-            back_content=card.back_content,
-            cloze_data=card.cloze_data,
-            tags=card.tags,
-            next_review_at=card.next_review_at,
-            fsrs_stability=card.fsrs_stability,
-            fsrs_difficulty=card.fsrs_difficulty,
-            fsrs_lapses=card.fsrs_lapses,
-            fsrs_state=card.fsrs_state,
-            created_at=card.created_at,
-            updated_at=card.updated_at,
-            is_deleted=card.is_deleted,  # Usar valor real de la base de datos
-            deleted_at=card.deleted_at
-        ))
+    if not cursor:
+        etag = sync_etag(await session.run_sync(sync_watermark.get), sync_variant(request))
+        if etag_matches(request.headers.get("if-none-match"), etag):
+            return not_modified(etag)
+
+    try:
+        server_timestamp, last_seq, pages, next_cursor = await session.run_sync(
+            fetch_sync_page,
+            since=as_utc(last_sync_timestamp_param),
+            since_seq=since_seq,
+            server_timestamp=datetime.now(timezone.utc),
+            limit=limit,
+            cursor=decode_cursor(cursor),
+            delta=delta,
+            device_id=device_id
+        )
+    except JuanPAException as exc:
+        raise to_http_exception(exc)
     
-    return m.PullResponse(
+    return sync_response(request, m.PullResponse(
         server_timestamp=server_timestamp,
-        decks=deck_sync_reads,
-        cards=card_sync_reads
-    )
+        decks=[m.DeckSyncRead(**deck) for deck in pages["decks"]],
+        cards=[m.CardSyncRead(**card) for card in pages["cards"]],
+        card_patches=[m.CardSyncPatch(**patch) for patch in pages["card_patches"]],
+        last_seq=last_seq,
+        next_cursor=encode_cursor(next_cursor) if next_cursor else None,
+        evicted_deck_ids=pages["evicted_deck_ids"]
+    ), headers=None if next_cursor else {"ETag": sync_etag(last_seq, sync_variant(request))})
 
-@app.post("/api/v1/sync/push", response_model=m.PushResponse)
-def sync_push(
+@app.get("/api/v1/sync/devices/{device_id}/subscriptions", response_model=m.DeckSubscriptionsRead)
+def get_device_subscriptions(
+    *,
+    session: Session = Depends(get_read_session),
+    device_id: str = FastAPIPath(..., pattern=DEVICE_ID_PATTERN)
+):
+    """
+    Mazos suscritos por un dispositivo. Sin suscripciones registradas
+    sincroniza todos (`all_decks`); con la lista vacía y `all_decks` falso
+    se desuscribió de todos y no sincroniza ninguno.
+    """
+    deck_ids = device_deck_ids(session, device_id)
+    return m.DeckSubscriptionsRead(device_id=device_id, deck_ids=deck_ids or [], all_decks=deck_ids is None)
+
+@app.put("/api/v1/sync/devices/{device_id}/subscriptions", response_model=m.DeckSubscriptionsRead, dependencies=[Depends(pin_to_primary)])
+def update_device_subscriptions(
     *,
     session: Session = Depends(get_session),
-    payload: m.PushRequest
+    write_coordinator: Optional[WriteCoordinator] = Depends(get_write_coordinator),
+    device_id: str = FastAPIPath(..., pattern=DEVICE_ID_PATTERN),
+    subscriptions: m.DeckSubscriptionsUpdate
 ):
     """
-    Endpoint para push de sincronización.
-    Procesa cambios del cliente y retorna conflictos si los hay.
+    Reemplaza los mazos que sincroniza un dispositivo. A partir de ahí
+    `GET /api/v1/sync/pull?deviceId=...` solo trae esos mazos: los nuevos
+    llegan completos y los retirados como `evicted_deck_ids`, que también se
+    devuelven aquí.
     """
-    logger.info(f"=== SYNC PUSH INICIADO ===")
-    logger.info(f"Payload recibido: new_decks={payload.new_decks}, new_cards={payload.new_cards}")
-    
-    # Asegurar que client_timestamp tenga timezone
-    if payload.client_timestamp.tzinfo is None:
-        client_timestamp = payload.client_timestamp.replace(tzinfo=timezone.utc)
-    else:
-        client_timestamp = payload.client_timestamp
-    
-    conflicts = []
-    created_decks = []
-    created_cards = []
-    
-    # Procesar nuevos mazos del cliente
-    if payload.new_decks:
-        logger.info(f"Procesando {len(payload.new_decks)} mazos nuevos")
-        for i, new_deck_data in enumerate(payload.new_decks):
-            logger.info(f"Procesando mazo {i+1}: {new_deck_data}")
-            try:
-                # Verificar si ya existe un mazo con ese nombre
-                existing_deck = session.exec(
-                    select(db.Deck).where(db.Deck.name == new_deck_data.name)
-                ).first()
-                
-                if existing_deck:
-                    logger.warning(f"Conflicto: Ya existe mazo con nombre '{new_deck_data.name}' (ID: {existing_deck.id})")
-                    # Conflicto: ya existe un mazo con ese nombre
-                    conflicts.append(m.ConflictInfo(
-                        type="deck",
-                        id=existing_deck.id or 0,
-                        message=f"Ya existe un mazo con el nombre '{new_deck_data.name}' (ID: {existing_deck.id})"
-                    ))
-                    continue
+    try:
+        deck_ids, evicted = run_write(
+            write_coordinator, session,
+            lambda write_session: set_device_subscriptions(write_session, device_id, subscriptions.deck_ids)
+        )
+    except JuanPAException as exc:
+        session.rollback()
+        raise to_http_exception(exc)
+    logger.info(f"Suscripciones del dispositivo {device_id}: {len(deck_ids)} mazos, {len(evicted)} desalojados")
+    return m.DeckSubscriptionsRead(device_id=device_id, deck_ids=deck_ids, evicted_deck_ids=evicted)
 
-                logger.info(f"Creando nuevo mazo: {new_deck_data.name}")
-                # Crear el nuevo mazo
-                db_deck = db.Deck(
-                    name=new_deck_data.name,
-                    description=new_deck_data.description,
-                    created_at=datetime.now(timezone.utc),
-                    updated_at=datetime.now(timezone.utc)
-                )
-                session.add(db_deck)
-                session.flush()  # Para obtener el ID
-                
-                logger.info(f"Mazo creado con ID: {db_deck.id}")
-                
-                # Convertir a DeckSyncRead para la respuesta
-                created_deck = m.DeckSyncRead(
-                    id=db_deck.id or 0,
-                    name=db_deck.name,
-                    description=db_deck.description,
-                    created_at=db_deck.created_at,
-                    updated_at=db_deck.updated_at,
-                    is_deleted=False,
-                    deleted_at=None
+@app.post("/api/v1/sync/changes/compact", response_model=m.ChangeLogCompactionResult)
+def compact_sync_changes(
+    *,
+    session: Session = Depends(get_session),
+    write_coordinator: Optional[WriteCoordinator] = Depends(get_write_coordinator)
+):
+    """Colapsa el registro de cambios dejando solo la última entrada de cada entidad."""
+    removed = run_write(write_coordinator, session, collapse_change_log)
+    logger.info(f"Registro de cambios compactado: {removed} entradas eliminadas")
+    return m.ChangeLogCompactionResult(removed=removed, last_seq=current_seq(session))
+
+@app.get("/api/v1/sync/pull/stream")
+def sync_pull_stream(
+    *,
+    session: Session = Depends(get_session),
+    last_sync_timestamp_param: Optional[datetime] = Query(None, alias="lastSyncTimestamp")
+):
+    """
+    Variante en streaming del pull de sincronización (NDJSON, una línea por
+    mazo o tarjeta). Las filas se leen por bloques y se serializan desde las
+    tuplas de columnas, así que la memoria no crece con el tamaño de la cuenta.
+    """
+    return StreamingResponse(
+        stream_pull_ndjson(session.get_bind(), as_utc(last_sync_timestamp_param), datetime.now(timezone.utc)),
+        media_type=NDJSON_MEDIA_TYPE
+    )
+
+# Segundos que se pide esperar a un cliente cuando el snapshot aún no existe
+SNAPSHOT_RETRY_AFTER_SECONDS = 5
+
+@app.get("/api/v1/sync/snapshot")
+def sync_snapshot(
+    *,
+    request: Request,
+    background_tasks: BackgroundTasks,
+    session: Session = Depends(get_read_only_session)
+):
+    """
+    Snapshot precomputado de toda la cuenta para la primera sincronización:
+    el NDJSON de /api/v1/sync/pull/stream servido desde disco ya comprimido
+    (Content-Encoding gzip). La primera línea trae el `last_seq` con el que
+    seguir mediante pull con `sinceSeq`.
+    Si aún no existe se responde 202 con `Retry-After` y se genera en segundo
+    plano; mientras tanto el cliente puede usar el pull paginado.
+    """
+    meta = load_snapshot_meta(SNAPSHOTS_DIR)
+    if meta is None:
+        background_tasks.add_task(refresh_snapshot_once, session.get_bind(), SNAPSHOTS_DIR)
+        return Response(
+            status_code=202,
+            content=json.dumps({"detail": "Snapshot en preparación; usar /api/v1/sync/pull paginado mientras tanto"}),
+            media_type="application/json",
+            headers={"Retry-After": str(SNAPSHOT_RETRY_AFTER_SECONDS), "Cache-Control": "no-cache"}
+        )
+    etag = f'"snapshot-{meta["last_seq"]}"'
+    headers = {"ETag": etag, "X-Snapshot-Seq": str(meta["last_seq"]), "Cache-Control": "no-cache", "Vary": "Accept-Encoding"}
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+
+    data_path, _ = snapshot_paths(SNAPSHOTS_DIR)
+    accepted = [encoding.split(";")[0].strip().lower() for encoding in request.headers.get("accept-encoding", "").split(",")]
+    if "gzip" in accepted:
+        return FileResponse(data_path, media_type=NDJSON_MEDIA_TYPE, headers={**headers, "Content-Encoding": "gzip"})
+    return StreamingResponse(iter_decompressed(data_path), media_type=NDJSON_MEDIA_TYPE, headers=headers)
+
+async def sync_change_events(request: Request, last_seq: int):
+    """Eventos SSE: el estado actual al conectar y luego un evento por cada avance del seq."""
+    with change_broadcaster.subscription():
+        yield f"id: {last_seq}\nevent: changed\ndata: {json.dumps(change_broadcaster.message(last_seq))}\n\n"
+        while not await request.is_disconnected():
+            if await change_broadcaster.wait_for_change(last_seq, app_settings.sync_notify_heartbeat):
+                last_seq = change_broadcaster.last_seq
+                yield f"id: {last_seq}\nevent: changed\ndata: {json.dumps(change_broadcaster.message())}\n\n"
+            else:
+                # Comentario SSE: mantiene viva la conexión a través de proxies
+                yield ": ping\n\n"
+
+def read_watermark_and_release(session: Session) -> int:
+    """Seq actual para una suscripción; la conexión vuelve al pool, porque la suscripción puede durar horas."""
+    try:
+        return sync_watermark.get(session)
+    finally:
+        session.close()
+
+@app.get("/api/v1/sync/subscribe")
+async def sync_subscribe(*, request: Request, session: Session = Depends(get_session)):
+    """
+    Canal Server-Sent Events de avisos de cambios: en lugar de sondear el
+    pull, el cliente recibe "cambios hasta seq X" cada vez que se confirma una
+    escritura (push, repasos o CRUD) y solo entonces hace pull con `sinceSeq`.
+    El primer evento trae el seq actual.
+    """
+    last_seq = await run_in_threadpool(read_watermark_and_release, session)
+    return StreamingResponse(
+        sync_change_events(request, last_seq),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+async def _drain_websocket(websocket: WebSocket) -> None:
+    """Consume lo que envíe el cliente; termina cuando cierra la conexión."""
+    try:
+        while True:
+            await websocket.receive_text()
+    except WebSocketDisconnect:
+        pass
+
+@app.websocket("/api/v1/sync/subscribe")
+async def sync_subscribe_websocket(websocket: WebSocket, session: Session = Depends(get_session)):
+    """Variante WebSocket de /api/v1/sync/subscribe: mensajes JSON "changed" y "ping"."""
+    await websocket.accept()
+    last_seq = await run_in_threadpool(read_watermark_and_release, session)
+    receiver = asyncio.ensure_future(_drain_websocket(websocket))
+    try:
+        with change_broadcaster.subscription():
+            await websocket.send_json(change_broadcaster.message(last_seq))
+            while not receiver.done():
+                waiter = asyncio.ensure_future(
+                    change_broadcaster.wait_for_change(last_seq, app_settings.sync_notify_heartbeat)
                 )
-                created_decks.append(created_deck)
-                logger.info(f"Mazo añadido a created_decks: {created_deck}")
-                
-            except Exception as e:
-                logger.error(f"Error creando mazo '{new_deck_data.name}': {e}")
-                conflicts.append(m.ConflictInfo(
-                    type="deck",
-                    id=0,
-                    message=f"Error creando mazo '{new_deck_data.name}': {str(e)}"
-                ))
-    else:
-        logger.info("No hay mazos nuevos en el payload")
+                await asyncio.wait({waiter, receiver}, return_when=asyncio.FIRST_COMPLETED)
+                if receiver.done():
+                    waiter.cancel()
+                    break
+                if waiter.result():
+                    last_seq = change_broadcaster.last_seq
+                    await websocket.send_json(change_broadcaster.message())
+                else:
+                    await websocket.send_json({"type": "ping"})
+    except (WebSocketDisconnect, RuntimeError):
+        pass
+    finally:
+        receiver.cancel()
+
+async def sync_push_payload(request: Request) -> m.PushRequest:
+    """Lee el cuerpo del push en el formato y la codificación indicados por el cliente."""
+    try:
+        data = decode_body(
+            await request.body(),
+            request.headers.get("content-type"),
+            request.headers.get("content-encoding")
+        )
+    except JuanPAException as exc:
+        raise to_http_exception(exc)
+    try:
+        return m.PushRequest.model_validate(data)
+    except PydanticValidationError as exc:
+        raise RequestValidationError(exc.errors(include_url=False), body=data)
+
+def push_changes(session: Session, write_coordinator: Optional[WriteCoordinator], payload: m.PushRequest) -> m.PushResponse:
+    """Aplica un push de sincronización y construye su respuesta."""
+    logger.info(
+        f"Sync push: {len(payload.new_decks or [])} mazos nuevos, {len(payload.new_cards or [])} tarjetas nuevas, "
+        f"{len(payload.updated_decks or [])} mazos y {len(payload.updated_cards or [])} tarjetas actualizadas, "
+        f"{len(payload.card_patches or [])} parches de tarjeta, {len(payload.review_logs or [])} repasos offline"
+    )
     
-    # Procesar nuevas tarjetas del cliente
-    if payload.new_cards:
-        for new_card_data in payload.new_cards:
-            try:
-                # Verificar que el deck existe
-                deck = session.get(db.Deck, new_card_data.deck_id)
-                if not deck:
-                    conflicts.append(m.ConflictInfo(
-                        type="card",
-                        id=0,
-                        message=f"Mazo con ID {new_card_data.deck_id} no encontrado al intentar crear tarjeta"
-                    ))
-                    continue
-                
-                # Crear la nueva tarjeta (simplificado)
-                db_card = db.Card(
-                    deck_id=new_card_data.deck_id,
-                    front_content=new_card_data.front_content,
-                    back_content=new_card_data.back_content,
-                    cloze_data=new_card_data.cloze_data,
-                    tags=new_card_data.tags,
-                    created_at=datetime.now(timezone.utc),
-                    updated_at=datetime.now(timezone.utc)
-                )
-                
-                session.add(db_card)
-                session.flush()  # Para obtener el ID
-                
-                # Convertir a CardSyncRead para la respuesta
-                created_card = m.CardSyncRead(
-                    id=db_card.id or 0,
-                    deck_id=db_card.deck_id,
-                    front_content=db_card.front_content,
-                    back_content=db_card.back_content,
-                    cloze_data=db_card.cloze_data,
-                    tags=db_card.tags,
-                    next_review_at=db_card.next_review_at,
-                    fsrs_stability=db_card.fsrs_stability,
-                    fsrs_difficulty=db_card.fsrs_difficulty,
-                    fsrs_lapses=db_card.fsrs_lapses,
-                    fsrs_state=db_card.fsrs_state,
-                    created_at=db_card.created_at,
-                    updated_at=db_card.updated_at,
-                    is_deleted=False,
-                    deleted_at=None
-                )
-                created_cards.append(created_card)
-                
-            except Exception as e:
-                # Error genérico creando una tarjeta
-                conflicts.append(m.ConflictInfo(
-                    type="card",
-                    id=0,
-                    message=f"Error creando tarjeta en mazo ID {new_card_data.deck_id}: {str(e)}"
-                ))
-    
-    # Procesar mazos actualizados del cliente (incluyendo eliminaciones)
-    if payload.updated_decks:
-        logger.info(f"Procesando {len(payload.updated_decks)} mazos actualizados")
-        for updated_deck_data in payload.updated_decks:
-            try:
-                # Buscar el mazo existente
-                existing_deck = session.get(db.Deck, updated_deck_data.id)
-                if not existing_deck:
-                    conflicts.append(m.ConflictInfo(
-                        type="deck",
-                        id=updated_deck_data.id,
-                        message=f"Mazo con ID {updated_deck_data.id} no encontrado para actualizar"
-                    ))
-                    continue
-                
-                # Actualizar campos
-                existing_deck.name = updated_deck_data.name
-                existing_deck.description = updated_deck_data.description
-                existing_deck.is_deleted = updated_deck_data.is_deleted
-                existing_deck.deleted_at = updated_deck_data.deleted_at
-                existing_deck.updated_at = datetime.now(timezone.utc)
-                
-                session.add(existing_deck)
-                logger.info(f"Mazo ID {updated_deck_data.id} actualizado. is_deleted: {updated_deck_data.is_deleted}")
-                
-            except Exception as e:
-                logger.error(f"Error actualizando mazo ID {updated_deck_data.id}: {e}")
-                conflicts.append(m.ConflictInfo(
-                    type="deck",
-                    id=updated_deck_data.id,
-                    message=f"Error actualizando mazo ID {updated_deck_data.id}: {str(e)}"
-                ))
-    
-    # Procesar tarjetas actualizadas del cliente (incluyendo eliminaciones)  
-    if payload.updated_cards:
-        logger.info(f"Procesando {len(payload.updated_cards)} tarjetas actualizadas")
-        for updated_card_data in payload.updated_cards:
-            try:
-                # Buscar la tarjeta existente
-                existing_card = session.get(db.Card, updated_card_data.id)
-                if not existing_card:
-                    conflicts.append(m.ConflictInfo(
-                        type="card",
-                        id=updated_card_data.id,
-                        message=f"Tarjeta con ID {updated_card_data.id} no encontrada para actualizar"
-                    ))
-                    continue
-                
-                # Actualizar campos
-                existing_card.front_content = updated_card_data.front_content
-                existing_card.back_content = updated_card_data.back_content
-                existing_card.cloze_data = updated_card_data.cloze_data
-                existing_card.tags = updated_card_data.tags
-                existing_card.is_deleted = updated_card_data.is_deleted
-                existing_card.deleted_at = updated_card_data.deleted_at
-                existing_card.updated_at = datetime.now(timezone.utc)
-                
-                session.add(existing_card)
-                logger.info(f"Tarjeta ID {updated_card_data.id} actualizada. is_deleted: {updated_card_data.is_deleted}")
-                
-            except Exception as e:
-                logger.error(f"Error actualizando tarjeta ID {updated_card_data.id}: {e}")
-                conflicts.append(m.ConflictInfo(
-                    type="card", 
-                    id=updated_card_data.id,
-                    message=f"Error actualizando tarjeta ID {updated_card_data.id}: {str(e)}"
-                ))
-    
-    # Commit cambios
+    def apply_sync_push(write_session: Session):
+        created_decks, created_cards, conflicts, queue_updates = apply_push(write_session, payload)
+        review_logs_ingested, review_logs_duplicated = 0, 0
+        if payload.review_logs:
+            review_logs_ingested, review_logs_duplicated = ingest_review_logs(write_session, payload.review_logs, conflicts)
+        return created_decks, created_cards, conflicts, queue_updates, review_logs_ingested, review_logs_duplicated
+    
+    # En SQLite el push completo (lecturas y escrituras) se ejecuta en el coordinador de escrituras
     try:
-        session.commit()
-        message = "Sincronización completada exitosamente"
-        if conflicts:
-            message += f" con {len(conflicts)} conflictos"
+        (
+            created_decks, created_cards, conflicts, queue_updates, review_logs_ingested, review_logs_duplicated
+        ) = run_write(write_coordinator, session, apply_sync_push)
     except Exception as e:
         session.rollback()
+        logger.error(f"Error aplicando push de sincronización: {e}")
         raise HTTPException(status_code=500, detail=f"Error guardando cambios: {str(e)}")
     
+    message = "Sincronización completada exitosamente"
+    if conflicts:
+        message += f" con {len(conflicts)} conflictos"
+    
+    for queue_update in queue_updates:
+        due_queue_cache.card_changed(*queue_update)
+    
     return m.PushResponse(
         message=message,
         created_decks=created_decks if created_decks else None,
         created_cards=created_cards if created_cards else None,
-        conflicts=conflicts
-    ) 
\ No newline at end of file
+        conflicts=conflicts,
+        review_logs_ingested=review_logs_ingested,
+        review_logs_duplicated=review_logs_duplicated
+    )
+
+@app.post("/api/v1/sync/push", response_model=m.PushResponse, dependencies=[Depends(pin_to_primary)])
+def sync_push(
+    *,
+    request: Request,
+    session: Session = Depends(get_session),
+    write_coordinator: Optional[WriteCoordinator] = Depends(get_write_coordinator),
+    payload: m.PushRequest = Depends(sync_push_payload),
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key", min_length=1, max_length=255)
+):
+    """
+    Endpoint para push de sincronización.
+    Procesa cambios del cliente y retorna conflictos si los hay.
+    Acepta JSON, JSON columnar o MessagePack (`Content-Type`), opcionalmente
+    comprimidos (`Content-Encoding`), y responde en el formato negociado.
+    Con `Idempotency-Key`, un reintento con el mismo cuerpo devuelve la
+    respuesta original sin volver a aplicar el push; si llega mientras el
+    original sigue en curso, espera a su respuesta.
+    Si hay réplica de lectura, el dispositivo (cabecera `X-Device-Id`) lee
+    del primario durante `read_your_writes_seconds` tras el push.
+    """
+    fingerprint = None
+    if idempotency_key:
+        fingerprint = payload_fingerprint(payload)
+        try:
+            replayed = push_idempotency_cache.reserve(idempotency_key, fingerprint)
+        except JuanPAException as exc:
+            raise to_http_exception(exc)
+        if replayed is not None:
+            logger.info(f"Sync push repetido con Idempotency-Key {idempotency_key}: respuesta cacheada")
+            return sync_response(request, replayed, headers={"Idempotent-Replayed": "true"})
+
+    try:
+        response = push_changes(session, write_coordinator, payload)
+    except BaseException:
+        if idempotency_key:
+            push_idempotency_cache.release(idempotency_key)
+        raise
+    if idempotency_key:
+        push_idempotency_cache.put(idempotency_key, fingerprint, response)
+    return sync_response(request, response) 
\ No newline at end of file
@@ -11,9 +11,12 @@ from fastapi.responses import JSONResponse
 from starlette.middleware.base import BaseHTTPMiddleware
 from starlette.types import ASGIApp
 
+from .config import settings
 from .exceptions import JuanPAException, to_http_exception, handle_database_error
 from .logging_config import get_logger
 from .validators import SyncValidator
+from .sync_codec import sync_media_types
+from .query_stats import DB_QUERIES_HEADER, DB_TIME_HEADER, QueryStats, track_queries
 import sqlalchemy.exc
 
 
@@ -181,12 +184,19 @@ class PerformanceMiddleware(BaseHTTPMiddleware):
         # Umbrales de alerta (en segundos)
         self.slow_request_threshold = 5.0
         self.very_slow_request_threshold = 10.0
+        # Repeticiones de una sentencia SQL que se avisan como posible N+1
+        self.n_plus_one_threshold = settings.n_plus_one_threshold
     
     async def dispatch(self, request: Request, call_next: Callable) -> Response:
         start_time = time.time()
         start_cpu_time = time.process_time()
         
-        response = await call_next(request)
+        if settings.db_query_instrumentation:
+            with track_queries() as queries:
+                response = await call_next(request)
+        else:
+            queries = None
+            response = await call_next(request)
         
         execution_time = time.time() - start_time
         cpu_time = time.process_time() - start_cpu_time
@@ -215,8 +225,22 @@ class PerformanceMiddleware(BaseHTTPMiddleware):
         # Agregar headers de rendimiento
         response.headers["X-Response-Time"] = f"{execution_time:.3f}s"
         response.headers["X-CPU-Time"] = f"{cpu_time:.3f}s"
+        if queries is not None:
+            # Cuentan las sentencias hasta que empieza la respuesta (no las de un cuerpo en streaming)
+            response.headers[DB_QUERIES_HEADER] = str(queries.count)
+            response.headers[DB_TIME_HEADER] = f"{queries.duration:.3f}s"
+            self._warn_repeated_statements(request, queries)
         
         return response
+    
+    def _warn_repeated_statements(self, request: Request, queries: QueryStats) -> None:
+        for statement, times in queries.repeated(self.n_plus_one_threshold):
+            self.logger.warning(
+                f"Posible N+1: {request.method} {request.url.path} ejecutó {times} veces la misma sentencia",
+                endpoint=str(request.url.path),
+                repetitions=times,
+                statement=" ".join(statement.split())[:300]
+            )
 
 
 class SecurityMiddleware(BaseHTTPMiddleware):
@@ -377,7 +401,7 @@ class RequestValidationMiddleware(BaseHTTPMiddleware):
         # Verificar Content-Type para requests POST
         if request.method == "POST":
             content_type = request.headers.get("content-type", "")
-            if not content_type.startswith("application/json"):
+            if not any(content_type.startswith(media_type) for media_type in sync_media_types()):
                 self.logger.security_event(
                     "invalid_content_type_sync",
                     {
@@ -388,7 +412,7 @@ class RequestValidationMiddleware(BaseHTTPMiddleware):
                     severity="warning"
                 )
                 
-                raise ValueError("Content-Type debe ser application/json para endpoints de sincronización")
+                raise ValueError(f"Content-Type debe ser uno de {', '.join(sync_media_types())} para endpoints de sincronización")
     
     def _get_client_ip(self, request: Request) -> str:
         """Obtiene la IP del cliente considerando proxies."""
@@ -1,6 +1,7 @@
-from datetime import datetime
+from datetime import date, datetime
 from typing import List, Optional, Any, Dict
-from pydantic import BaseModel, Field, model_validator, validator # Agregar validator
+from uuid import UUID
+from pydantic import BaseModel, Field, model_serializer, model_validator, validator # Agregar validator
 from .validators import ContentValidator # Importar validadores personalizados
 
 # --- Schemas para Mazo (Deck) ---
@@ -36,6 +37,7 @@ class DeckUpdate(BaseModel):
 
 class DeckRead(DeckBase):
     id: int
+    uuid: Optional[str] = None
     created_at: datetime
     updated_at: datetime
 
@@ -56,6 +58,8 @@ class CardBase(BaseModel):
     fsrs_difficulty: Optional[float] = Field(None, ge=0.0, le=10.0, description="Dificultad FSRS")
     fsrs_lapses: Optional[int] = Field(None, ge=0, description="Número de lapsos FSRS")
     fsrs_state: Optional[str] = Field(None, pattern="^(new|learning|review|relearning)$", description="Estado FSRS")
+    fsrs_step: Optional[int] = Field(None, ge=0, description="Paso de aprendizaje FSRS")
+    fsrs_last_review: Optional[datetime] = Field(None, description="Fecha del último repaso")
     
     @validator('front_content')
     def validate_front_content(cls, v):
@@ -126,6 +130,7 @@ class CardUpdate(BaseModel): # Actualización parcial
 
 class CardRead(CardBase):
     id: int
+    uuid: Optional[str] = None
     deck_id: int
     created_at: datetime
     updated_at: datetime
@@ -144,15 +149,52 @@ class DeckReadBasic(DeckBase): # Solo lo básico para no anidar demasiado
 class CardReadWithDeck(CardRead):
     deck: DeckReadBasic
 
+class IntervalPreview(BaseModel):
+    """Intervalo previsto en segundos para cada calificación."""
+    again: int
+    hard: int
+    good: int
+    easy: int
+
+class CardReadForReview(CardReadWithDeck):
+    intervals: Optional[IntervalPreview] = Field(None, description="Intervalos previstos por calificación (nulo sin FSRS)")
+
 # --- Schema para Repaso de Tarjeta (Card Review) ---
 
 class CardReviewPayload(BaseModel):
     rating: int = Field(..., ge=1, le=4, description="Calificación del repaso: 1=Again, 2=Hard, 3=Good, 4=Easy")
+    time_taken_ms: Optional[int] = Field(None, ge=0, description="Tiempo de respuesta en milisegundos")
     
     @validator('rating')
     def validate_rating(cls, v):
         return ContentValidator.validate_fsrs_rating(v)
 
+class ReviewBatchItem(CardReviewPayload):
+    card_id: int = Field(..., gt=0, description="ID de la tarjeta repasada")
+    reviewed_at: Optional[datetime] = Field(None, description="Momento del repaso en el cliente (por defecto, ahora)")
+
+class ReviewBatchRequest(BaseModel):
+    reviews: List[ReviewBatchItem] = Field(..., min_length=1, max_length=1000, description="Repasos en el orden en que se hicieron")
+
+class ReviewBatchItemResult(BaseModel):
+    index: int = Field(..., ge=0, description="Posición del repaso en la petición")
+    card_id: int = Field(..., description="ID de la tarjeta repasada")
+    success: bool = Field(..., description="Si el repaso se aplicó")
+    card: Optional[CardRead] = Field(None, description="Estado de la tarjeta tras el repaso")
+    error: Optional[str] = Field(None, description="Motivo del fallo, si lo hubo")
+    duplicate: bool = Field(False, description="El repaso ya estaba registrado (lote reenviado) y no se volvió a aplicar")
+
+class ReviewBatchResponse(BaseModel):
+    message: str = Field(..., description="Mensaje del resultado del lote")
+    processed: int = Field(0, ge=0, description="Repasos aplicados")
+    failed: int = Field(0, ge=0, description="Repasos rechazados")
+    duplicated: int = Field(0, ge=0, description="Repasos que ya estaban registrados")
+    results: List[ReviewBatchItemResult] = Field([], description="Resultado por repaso, en el orden de la petición")
+
+class ReviewSessionResponse(BaseModel):
+    cards: List[CardReadForReview] = Field([], description="Tarjetas pendientes de la sesión, en orden de repaso")
+    next_cursor: Optional[str] = Field(None, description="Token para pedir más tarjetas; nulo si no quedan")
+
 # --- Schema para Resumen de Importación ---
 
 class ImportSummary(BaseModel):
@@ -166,9 +208,16 @@ class ImportSummary(BaseModel):
 
 class ConflictInfo(BaseModel):
     type: str = Field(..., pattern="^(deck|card)$", description="Tipo de conflicto")
-    id: int = Field(..., gt=0, description="ID del objeto en conflicto")
+    id: Optional[int] = Field(None, ge=0, description="ID del objeto en conflicto; 0 si el objeto aún no tiene ID en el servidor")
+    uuid: Optional[str] = Field(None, description="UUID del objeto en conflicto si no tiene ID en el servidor")
     message: str = Field(..., min_length=1, description="Descripción del conflicto")
 
+    @model_validator(mode='after')
+    def check_id_or_uuid(self):
+        if self.id is None and self.uuid is None:
+            raise ValueError('Un conflicto debe indicar "id" o "uuid".')
+        return self
+
 # Primero los modelos de lectura para Sync, ya que PushRequest los usa
 class DeckSyncRead(DeckRead): # Hereda de DeckRead y añade campos de sync
     is_deleted: bool = Field(False, description="Indica si el mazo está eliminado")
@@ -178,15 +227,77 @@ class CardSyncRead(CardRead): # Hereda de CardRead y añade campos de sync
     is_deleted: bool = Field(False, description="Indica si la tarjeta está eliminada")
     deleted_at: Optional[datetime] = Field(None, description="Fecha de eliminación")
 
+class CardSyncPatch(CardUpdate):
+    """
+    Registro parcial de tarjeta para la sincronización por deltas: solo viaja
+    `id` y las columnas presentes (las ausentes no cambiaron). Al serializar se
+    omiten los campos no asignados, de modo que null significa "borrar valor".
+    """
+    id: int = Field(..., gt=0, description="ID de la tarjeta")
+    deck_id: Optional[int] = Field(None, gt=0, description="ID del mazo (solo en pull)")
+    fsrs_step: Optional[int] = Field(None, ge=0, description="Paso de aprendizaje/reaprendizaje actual")
+    fsrs_last_review: Optional[datetime] = Field(None, description="Fecha del último repaso")
+    is_deleted: Optional[bool] = Field(None, description="Indica si la tarjeta está eliminada")
+    deleted_at: Optional[datetime] = Field(None, description="Fecha de eliminación")
+    updated_at: Optional[datetime] = Field(None, description="Última modificación (solo en pull)")
+
+    @model_serializer(mode="wrap")
+    def _only_set_fields(self, handler):
+        data = handler(self)
+        return {key: value for key, value in data.items() if key in self.model_fields_set}
+
+class DeckSyncCreate(DeckCreate):
+    uuid: Optional[UUID] = Field(None, description="UUID generado por el cliente; reenviarlo no duplica el mazo")
+
+class CardSyncCreate(CardCreate):
+    uuid: Optional[UUID] = Field(None, description="UUID generado por el cliente; reenviarlo no duplica la tarjeta")
+    deck_id: Optional[int] = Field(None, gt=0, description="ID del mazo al que pertenece la tarjeta")
+    deck_uuid: Optional[UUID] = Field(None, description="UUID del mazo, p. ej. uno creado offline en este mismo push")
+
+    @model_validator(mode='after')
+    def check_deck_reference(self):
+        if self.deck_id is None and self.deck_uuid is None:
+            raise ValueError('Se debe proporcionar "deck_id" o "deck_uuid".')
+        return self
+
+class ReviewLogSyncCreate(BaseModel):
+    """Repaso hecho offline; (tarjeta, review_timestamp) lo identifica y reenviarlo no lo duplica."""
+    card_id: Optional[int] = Field(None, gt=0, description="ID de la tarjeta repasada")
+    card_uuid: Optional[UUID] = Field(None, description="UUID de la tarjeta, p. ej. una creada en este mismo push")
+    rating_given: int = Field(..., ge=1, le=4, description="Calificación: 1 Again, 2 Hard, 3 Good, 4 Easy")
+    review_timestamp: datetime = Field(..., description="Momento del repaso en el cliente")
+
+    previous_stability: Optional[float] = Field(None, ge=0.0, description="Estabilidad FSRS antes del repaso")
+    previous_difficulty: Optional[float] = Field(None, ge=0.0, le=10.0, description="Dificultad FSRS antes del repaso")
+    previous_lapses: Optional[int] = Field(None, ge=0, description="Lapsos antes del repaso")
+    previous_state: Optional[str] = Field(None, pattern="^(new|learning|review|relearning)$", description="Estado FSRS antes del repaso")
+    previous_due_date: Optional[datetime] = Field(None, description="Fecha de repaso prevista antes de este repaso")
+
+    new_stability: float = Field(..., ge=0.0, description="Estabilidad FSRS tras el repaso")
+    new_difficulty: float = Field(..., ge=0.0, le=10.0, description="Dificultad FSRS tras el repaso")
+    new_lapses: int = Field(..., ge=0, description="Lapsos tras el repaso")
+    new_state: str = Field(..., pattern="^(new|learning|review|relearning)$", description="Estado FSRS tras el repaso")
+    new_due_date: datetime = Field(..., description="Próxima fecha de repaso tras este repaso")
+
+    time_taken_ms: Optional[int] = Field(None, ge=0, description="Tiempo de respuesta en milisegundos")
+
+    @model_validator(mode='after')
+    def check_card_reference(self):
+        if self.card_id is None and self.card_uuid is None:
+            raise ValueError('Se debe proporcionar "card_id" o "card_uuid".')
+        return self
+
 # Luego PushRequest
 class PushRequest(BaseModel):
     client_timestamp: datetime = Field(..., description="Timestamp del último pull exitoso del cliente")
     
-    new_decks: Optional[List[DeckCreate]] = Field(None, description="Nuevos mazos a crear")
-    new_cards: Optional[List[CardCreate]] = Field(None, description="Nuevas tarjetas a crear")
+    new_decks: Optional[List[DeckSyncCreate]] = Field(None, description="Nuevos mazos a crear")
+    new_cards: Optional[List[CardSyncCreate]] = Field(None, description="Nuevas tarjetas a crear")
     
     updated_decks: Optional[List[DeckSyncRead]] = Field(None, description="Mazos actualizados")
     updated_cards: Optional[List[CardSyncRead]] = Field(None, description="Tarjetas actualizadas")
+    card_patches: Optional[List[CardSyncPatch]] = Field(None, description="Actualizaciones parciales de tarjetas (solo columnas cambiadas)")
+    review_logs: Optional[List[ReviewLogSyncCreate]] = Field(None, description="Repasos hechos offline para el historial")
 
 # Finalmente PushResponse y PullResponse
 class PushResponse(BaseModel):
@@ -194,11 +305,30 @@ class PushResponse(BaseModel):
     created_decks: Optional[List[DeckRead]] = Field(None, description="Mazos creados en el servidor")
     created_cards: Optional[List[CardRead]] = Field(None, description="Tarjetas creadas en el servidor")
     conflicts: List[ConflictInfo] = Field([], description="Lista de conflictos encontrados")
+    review_logs_ingested: int = Field(0, ge=0, description="Repasos offline añadidos al historial")
+    review_logs_duplicated: int = Field(0, ge=0, description="Repasos offline que ya estaban registrados")
 
 class PullResponse(BaseModel):
     server_timestamp: datetime = Field(..., description="Timestamp actual del servidor")
     decks: List[DeckSyncRead] = Field([], description="Mazos sincronizados")
     cards: List[CardSyncRead] = Field([], description="Tarjetas sincronizadas")
+    card_patches: List[CardSyncPatch] = Field([], description="Tarjetas con solo las columnas cambiadas (pull con delta)")
+    last_seq: int = Field(0, description="Último seq del registro de cambios incluido; usar como sinceSeq en el próximo pull")
+    next_cursor: Optional[str] = Field(None, description="Token para pedir la página siguiente; nulo en la última")
+    evicted_deck_ids: List[int] = Field([], description="Mazos de los que el dispositivo se desuscribió: borrarlos localmente junto con sus tarjetas")
+
+class DeckSubscriptionsUpdate(BaseModel):
+    deck_ids: List[int] = Field(..., description="Mazos que el dispositivo quiere sincronizar (reemplaza la lista anterior)")
+
+class DeckSubscriptionsRead(BaseModel):
+    device_id: str = Field(..., description="Identificador del dispositivo")
+    deck_ids: List[int] = Field([], description="Mazos suscritos")
+    all_decks: bool = Field(False, description="True si el dispositivo no tiene suscripciones registradas y sincroniza todos los mazos")
+    evicted_deck_ids: List[int] = Field([], description="Mazos que dejaron de estar suscritos con este cambio")
+
+class ChangeLogCompactionResult(BaseModel):
+    removed: int = Field(..., description="Entradas eliminadas del registro de cambios")
+    last_seq: int = Field(..., description="Último seq del registro de cambios")
 
 # === MODELOS PARA CONFIGURACIONES DE USUARIO ===
 
@@ -277,6 +407,47 @@ class UserSettingsResetResponse(BaseModel):
     message: str
     settings: UserSettingsRead
 
+# === MODELOS PARA OPTIMIZACIÓN FSRS ===
+
+class FSRSOptimizationResult(BaseModel):
+    """Pesos FSRS ajustados al historial de repasos."""
+    parameters: List[float] = Field(..., min_length=19, max_length=19, description="Los 19 pesos FSRS ajustados")
+    loss_default: float = Field(..., description="Pérdida logarítmica con los pesos por defecto")
+    loss_optimized: float = Field(..., description="Pérdida logarítmica con los pesos ajustados")
+    cards_used: int = Field(..., ge=0, description="Tarjetas con historial completo usadas en el ajuste")
+    reviews_used: int = Field(..., ge=0, description="Repasos usados en el ajuste")
+    elapsed_seconds: float = Field(..., ge=0, description="Duración del ajuste en segundos")
+
+class FSRSOptimizationJob(BaseModel):
+    """Estado de un trabajo de optimización FSRS."""
+    job_id: str
+    status: str = Field(..., pattern="^(running|completed|failed)$", description="Estado del trabajo")
+    created_at: datetime
+    finished_at: Optional[datetime] = None
+    reviews: Optional[int] = Field(None, ge=0, description="Repasos leídos del historial (nulo hasta terminar la lectura)")
+    result: Optional[FSRSOptimizationResult] = None
+    error: Optional[str] = None
+
+class FSRSParametersApplied(BaseModel):
+    """Respuesta al aplicar pesos FSRS a las configuraciones del usuario."""
+    message: str
+    parameters: List[float]
+
+# === MODELOS PARA ESTADÍSTICAS ===
+
+class ForecastDay(BaseModel):
+    """Repasos previstos para un día."""
+    date: date
+    reviews: int
+
+class ForecastResponse(BaseModel):
+    """Pronóstico de carga de repasos simulado con FSRS."""
+    generated_at: datetime
+    days: int
+    total_reviews: int
+    cached: bool = False
+    forecast: List[ForecastDay]
+
 # === MODELOS PARA GENERACIÓN DE TARJETAS CON GEMINI ===
 
 class CardGenerationRequest(BaseModel):
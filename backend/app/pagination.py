@@ -0,0 +1,36 @@
+"""
+Utilidades de paginación por keyset para JuanPA.
+Los cursores se exponen al cliente como tokens opacos (JSON en base64 URL-safe).
+"""
+
+import base64
+import binascii
+import json
+from typing import Any, Dict, Optional
+
+from .exceptions import ValidationError
+
+
+def encode_cursor(data: Dict[str, Any]) -> str:
+    """Codifica la posición de continuación como un token opaco."""
+    raw = json.dumps(data, separators=(",", ":"), default=str).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_cursor(token: Optional[str], field: str = "cursor") -> Dict[str, Any]:
+    """
+    Decodifica un token generado por encode_cursor.
+
+    Raises:
+        ValidationError: Si el token no es válido.
+    """
+    if not token:
+        return {}
+    try:
+        padded = token + "=" * (-len(token) % 4)
+        data = json.loads(base64.urlsafe_b64decode(padded.encode("ascii")))
+    except (binascii.Error, ValueError, UnicodeError):
+        raise ValidationError("Token de continuación inválido", field=field, value=token)
+    if not isinstance(data, dict):
+        raise ValidationError("Token de continuación inválido", field=field, value=token)
+    return data
@@ -0,0 +1,86 @@
+"""
+Instrumentación de SQL por request para JuanPA.
+
+Mientras un request está en curso, los eventos de SQLAlchemy cuentan las
+sentencias que ejecuta y el tiempo que pasan en la base de datos, sea por
+el engine síncrono o por el asíncrono. PerformanceMiddleware publica los
+totales en las cabeceras `X-DB-Queries` y `X-DB-Time`. Si una misma
+sentencia se repite muchas veces, lo anota en el log de rendimiento como
+posible N+1.
+
+El request se sigue con una ContextVar. El objeto de estadísticas se crea
+antes de llamar al endpoint, así que lo comparten las tareas, los hilos del
+pool de anyio y los greenlets de SQLAlchemy que heredan el contexto, y
+también los trabajos del coordinador de escrituras, que corren en su hilo con
+una copia del contexto de la request que los envió.
+"""
+
+import time
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Iterator, List, Optional, Tuple
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+_current_stats: ContextVar[Optional["QueryStats"]] = ContextVar("juanpa_query_stats", default=None)
+_START_ATTRIBUTE = "_juanpa_query_start"
+
+DB_QUERIES_HEADER = "X-DB-Queries"
+DB_TIME_HEADER = "X-DB-Time"
+
+
+class QueryStats:
+    """Sentencias, tiempo de base de datos y repeticiones de cada sentencia en un request."""
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+        self.statements: Counter = Counter()
+
+    def record(self, statement: str, elapsed: float) -> None:
+        self.count += 1
+        self.duration += elapsed
+        self.statements[statement] += 1
+
+    def repeated(self, threshold: int) -> List[Tuple[str, int]]:
+        """Sentencias ejecutadas al menos `threshold` veces, de más a menos."""
+        return [(statement, times) for statement, times in self.statements.most_common() if times >= threshold]
+
+
+@contextmanager
+def track_queries() -> Iterator[QueryStats]:
+    """Cuenta las sentencias SQL ejecutadas dentro del bloque (y de lo que herede su contexto)."""
+    stats = QueryStats()
+    token = _current_stats.set(stats)
+    try:
+        yield stats
+    finally:
+        _current_stats.reset(token)
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _start_timer(conn, cursor, statement, parameters, context, executemany) -> None:
+    if context is not None and _current_stats.get() is not None:
+        setattr(context, _START_ATTRIBUTE, time.perf_counter())
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _record_statement(conn, cursor, statement, parameters, context, executemany) -> None:
+    stats = _current_stats.get()
+    start = getattr(context, _START_ATTRIBUTE, None)
+    if stats is not None and start is not None:
+        stats.record(statement, time.perf_counter() - start)
+
+
+def assert_max_queries(response, limit: int) -> None:
+    """
+    Para tests: falla si el request respondido ejecutó más de `limit`
+    sentencias SQL, según su cabecera X-DB-Queries.
+    """
+    header = response.headers.get(DB_QUERIES_HEADER)
+    assert header is not None, f"La respuesta no trae {DB_QUERIES_HEADER}: ¿instrumentación desactivada?"
+    assert int(header) <= limit, (
+        f"{response.request.method} {response.request.url.path} ejecutó {header} sentencias SQL (máximo {limit})"
+    )
@@ -0,0 +1,594 @@
+"""
+Cola de repaso para JuanPA.
+Consultas de tarjetas pendientes pensadas para recorrer el índice compuesto
+(is_deleted, deck_id, next_review_at) como un rango, con continuación por keyset,
+y colas de prioridad en memoria por mazo para servir la próxima tarjeta, ya sea
+por vencimiento o por menor retrievability.
+"""
+
+import heapq
+import threading
+from collections import OrderedDict
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+from sqlalchemy.orm import selectinload
+from sqlmodel import Session, select, and_, or_, asc
+
+from . import db_models as db
+from .config import settings
+from .fsrs_service import as_utc, epoch_microseconds, to_epoch_microseconds
+
+# Importar NumPy con manejo de errores
+try:
+    import numpy as np
+    from . import fsrs_math as fm
+    NUMPY_AVAILABLE = True
+except ImportError:
+    NUMPY_AVAILABLE = False
+
+# Modos de sesión: solo repasos, solo nuevas o ambas intercaladas
+REVIEW_MODES = ("mixed", "review", "new")
+
+# Orden de la próxima tarjeta: por vencimiento o la de menor retrievability primero
+REVIEW_ORDERS = ("due", "risk")
+
+DEFAULT_CARDS_PER_SESSION = 20
+
+
+def due_review_query(
+    now: datetime,
+    deck_id: Optional[int] = None,
+    after: Optional[Tuple[datetime, int]] = None,
+):
+    """
+    Tarjetas ya repasadas cuyo vencimiento llegó, de la más atrasada a la más reciente.
+    `after` es la última posición (next_review_at, id) servida al cliente.
+    """
+    query = select(db.Card).where(
+        db.Card.is_deleted == False,
+        db.Card.next_review_at != None,
+        db.Card.next_review_at <= now
+    )
+    if deck_id:
+        query = query.where(db.Card.deck_id == deck_id)
+    if after:
+        after_due, after_id = after
+        query = query.where(or_(
+            db.Card.next_review_at > after_due,
+            and_(db.Card.next_review_at == after_due, db.Card.id > after_id)
+        ))
+    return query.order_by(asc(db.Card.next_review_at), asc(db.Card.id))
+
+
+def new_cards_query(deck_id: Optional[int] = None, after_id: Optional[int] = None):
+    """Tarjetas nunca repasadas (next_review_at nulo), en orden de creación."""
+    query = select(db.Card).where(
+        db.Card.is_deleted == False,
+        db.Card.next_review_at == None
+    )
+    if deck_id:
+        query = query.where(db.Card.deck_id == deck_id)
+    if after_id:
+        query = query.where(db.Card.id > after_id)
+    return query.order_by(asc(db.Card.id))
+
+
+def get_cards_per_session(session: Session, user_id: str = "default") -> int:
+    """Obtiene el tamaño de sesión configurado por el usuario."""
+    user_settings = session.exec(
+        select(db.UserSettings).where(db.UserSettings.user_id == user_id)
+    ).first()
+    return user_settings.default_cards_per_session if user_settings else DEFAULT_CARDS_PER_SESSION
+
+
+def fetch_due_cards(
+    session: Session,
+    now: datetime,
+    limit: int,
+    deck_id: Optional[int] = None,
+    mode: str = "mixed",
+    cursor: Optional[Dict[str, Any]] = None,
+) -> Tuple[List[db.Card], Optional[Dict[str, Any]]]:
+    """
+    Obtiene hasta `limit` tarjetas pendientes y la posición para continuar.
+
+    En modo "mixed" los repasos vencidos y las tarjetas nuevas se intercalan,
+    empezando por los repasos. Cada flujo se lee con su propia consulta por rango
+    y el cursor guarda la última posición de ambos.
+    """
+    cursor = cursor or {}
+    review_after = None
+    if cursor.get("review"):
+        review_due, review_id = cursor["review"]
+        review_after = (as_utc(datetime.fromisoformat(review_due)), int(review_id))
+    new_after = cursor.get("new")
+
+    # El deck se carga en la misma ida a la base de datos para evitar lazy loads por tarjeta
+    reviews: List[db.Card] = []
+    if mode in ("mixed", "review"):
+        reviews = session.exec(
+            due_review_query(now, deck_id, review_after)
+            .options(selectinload(db.Card.deck))
+            .limit(limit + 1)
+        ).all()
+    new_cards: List[db.Card] = []
+    if mode in ("mixed", "new"):
+        new_cards = session.exec(
+            new_cards_query(deck_id, new_after)
+            .options(selectinload(db.Card.deck))
+            .limit(limit + 1)
+        ).all()
+
+    selected: List[db.Card] = []
+    review_index = new_index = 0
+    while len(selected) < limit and (review_index < len(reviews) or new_index < len(new_cards)):
+        take_review = review_index < len(reviews) and (
+            new_index >= len(new_cards) or review_index <= new_index
+        )
+        if take_review:
+            selected.append(reviews[review_index])
+            review_index += 1
+        else:
+            selected.append(new_cards[new_index])
+            new_index += 1
+
+    has_more = review_index < len(reviews) or new_index < len(new_cards)
+    if not has_more:
+        return selected, None
+
+    next_cursor: Dict[str, Any] = {"review": cursor.get("review"), "new": new_after}
+    if review_index:
+        last_review = reviews[review_index - 1]
+        next_cursor["review"] = [as_utc(last_review.next_review_at).isoformat(), last_review.id]
+    if new_index:
+        next_cursor["new"] = new_cards[new_index - 1].id
+    return selected, next_cursor
+
+
+class RiskIndex:
+    """
+    Estado FSRS de las tarjetas de una cola en arrays NumPy paralelos, para
+    calcular la retrievability de todas las pendientes en una sola pasada.
+
+    Cada tarjeta ocupa un slot fijo; las bajas solo lo marcan como libre y los
+    arrays se compactan cuando los huecos dominan.
+    """
+
+    def __init__(self, capacity: int = 1024):
+        self._slots: Dict[int, int] = {}
+        self._size = 0
+        self._ids = np.zeros(capacity, dtype=np.int64)
+        self._due = np.full(capacity, np.nan)
+        self._stability = np.full(capacity, np.nan)
+        self._last_review = np.full(capacity, np.nan)
+        self._alive = np.zeros(capacity, dtype=bool)
+
+    @classmethod
+    def from_arrays(
+        cls, ids: "np.ndarray", due: "np.ndarray", stability: "np.ndarray", last_review: "np.ndarray"
+    ) -> "RiskIndex":
+        """Índice con las tarjetas ya cargadas en arrays paralelos (NaN donde falta el dato)."""
+        index = cls(capacity=max(len(ids), 1024))
+        n = len(ids)
+        index._size = n
+        index._ids[:n] = ids
+        index._due[:n] = due
+        index._stability[:n] = stability
+        index._last_review[:n] = last_review
+        index._alive[:n] = True
+        index._slots = {card_id: slot for slot, card_id in enumerate(ids.tolist())}
+        return index
+
+    def _grow(self) -> None:
+        capacity = max(2 * len(self._ids), 1024)
+        for name, fill in (("_ids", 0), ("_due", np.nan), ("_stability", np.nan), ("_last_review", np.nan), ("_alive", False)):
+            current = getattr(self, name)
+            grown = np.full(capacity, fill, dtype=current.dtype)
+            grown[:self._size] = current[:self._size]
+            setattr(self, name, grown)
+
+    def upsert(self, card_id: int, due_ts: Optional[float], stability: Optional[float], last_review_ts: Optional[float]) -> None:
+        slot = self._slots.get(card_id)
+        if slot is None:
+            if self._size == len(self._ids):
+                self._grow()
+            slot = self._size
+            self._size += 1
+            self._slots[card_id] = slot
+            self._ids[slot] = card_id
+            self._alive[slot] = True
+        self._due[slot] = np.nan if due_ts is None else due_ts
+        self._stability[slot] = np.nan if stability is None else stability
+        self._last_review[slot] = np.nan if last_review_ts is None else last_review_ts
+
+    def remove(self, card_id: int) -> None:
+        slot = self._slots.pop(card_id, None)
+        if slot is None:
+            return
+        self._alive[slot] = False
+        if self._size > 2 * len(self._slots) + 1024:
+            self._compact()
+
+    def _compact(self) -> None:
+        keep = np.flatnonzero(self._alive[:self._size])
+        for name in ("_ids", "_due", "_stability", "_last_review", "_alive"):
+            current = getattr(self, name)
+            current[:len(keep)] = current[keep]
+            current[len(keep):self._size] = False if name == "_alive" else (0 if name == "_ids" else np.nan)
+        self._size = len(keep)
+        self._slots = {int(card_id): slot for slot, card_id in enumerate(self._ids[:self._size])}
+
+    def lowest_retrievability(self, now_ts: float) -> Optional[int]:
+        """Tarjeta vencida con menor retrievability actual (None si no hay ninguna con estado FSRS)."""
+        n = self._size
+        # Las comparaciones con NaN son falsas: quedan fuera las nuevas y las que no tienen estado FSRS
+        candidates = np.flatnonzero(
+            self._alive[:n]
+            & (self._due[:n] <= now_ts)
+            & (self._stability[:n] > 0)
+            & (self._last_review[:n] <= now_ts)
+        )
+        if not len(candidates):
+            return None
+        elapsed_days = (now_ts - self._last_review[candidates]) / 86400
+        current = fm.retrievability(elapsed_days, self._stability[candidates])
+        return int(self._ids[candidates[np.argmin(current)]])
+
+
+class DueCardQueue:
+    """
+    Cola de prioridad en memoria con las tarjetas de un mazo (o de todos).
+
+    Los repasos se guardan en un min-heap de (next_review_at, card_id) y las
+    tarjetas nuevas en otro ordenado por id. Las actualizaciones no reordenan el
+    heap: se apila una entrada nueva y las obsoletas se descartan al consultar.
+    Cada tarjeta guarda además su versión (updated_at en microsegundos) para
+    validar contra la fila leída sin consultas adicionales.
+    Si NumPy está disponible, un RiskIndex permite servir primero la tarjeta
+    con menor retrievability.
+    """
+
+    def __init__(self):
+        self._review_heap: List[Tuple[float, int]] = []
+        self._new_heap: List[int] = []
+        # card_id -> (timestamp de vencimiento o None si es nueva, versión o None si se desconoce)
+        self._entries: Dict[int, Tuple[Optional[float], Optional[int]]] = {}
+        self._risk = RiskIndex() if NUMPY_AVAILABLE else None
+
+    @classmethod
+    def from_arrays(
+        cls,
+        ids: "np.ndarray",
+        due: "np.ndarray",
+        stability: "np.ndarray",
+        last_review: "np.ndarray",
+        versions: "np.ndarray",
+    ) -> "DueCardQueue":
+        """
+        Cola construida de una vez desde arrays paralelos (fechas en segundos
+        desde epoch, NaN para las nulas): los heaps se montan con heapify en
+        O(n) en lugar de un push por tarjeta.
+        """
+        queue = cls()
+        scheduled = ~np.isnan(due)
+        id_list = ids.tolist()
+        due_list = np.where(scheduled, due, 0.0).tolist()
+        queue._entries = {
+            card_id: (due_ts if is_scheduled else None, version)
+            for card_id, due_ts, is_scheduled, version in zip(id_list, due_list, scheduled.tolist(), versions.tolist())
+        }
+        queue._review_heap = list(zip(due[scheduled].tolist(), ids[scheduled].tolist()))
+        queue._new_heap = ids[~scheduled].tolist()
+        heapq.heapify(queue._review_heap)
+        heapq.heapify(queue._new_heap)
+        if queue._risk is not None:
+            queue._risk = RiskIndex.from_arrays(ids, due, stability, last_review)
+        return queue
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def upsert(
+        self,
+        card_id: int,
+        due: Optional[datetime],
+        stability: Optional[float] = None,
+        last_review: Optional[datetime] = None,
+        updated_at: Optional[datetime] = None,
+    ) -> None:
+        """Añade o reubica una tarjeta. O(log n)."""
+        self.upsert_timestamps(
+            card_id,
+            as_utc(due).timestamp() if due is not None else None,
+            stability,
+            as_utc(last_review).timestamp() if last_review is not None else None,
+            to_epoch_microseconds(updated_at),
+        )
+
+    def upsert_timestamps(
+        self,
+        card_id: int,
+        due_ts: Optional[float],
+        stability: Optional[float],
+        last_review_ts: Optional[float],
+        version: Optional[int],
+    ) -> None:
+        """Como `upsert`, con las fechas ya en segundos desde epoch y la versión en microsegundos."""
+        if self._risk is not None:
+            self._risk.upsert(card_id, due_ts, stability, last_review_ts)
+        previous = self._entries.get(card_id)
+        self._entries[card_id] = (due_ts, version)
+        # Si el vencimiento no cambia, la entrada del heap sigue siendo válida
+        if previous is not None and previous[0] == due_ts:
+            return
+        if due_ts is None:
+            heapq.heappush(self._new_heap, card_id)
+        else:
+            heapq.heappush(self._review_heap, (due_ts, card_id))
+        self._maybe_compact()
+
+    def remove(self, card_id: int) -> None:
+        """Quita una tarjeta; su entrada en el heap se descarta perezosamente."""
+        self._entries.pop(card_id, None)
+        if self._risk is not None:
+            self._risk.remove(card_id)
+
+    def expected_state(self, card_id: int) -> Optional[Tuple[Optional[float], Optional[int]]]:
+        """(vencimiento, versión) con que la cola conoce la tarjeta, o None si no está."""
+        return self._entries.get(card_id)
+
+    def peek_due(self, now: datetime) -> Optional[int]:
+        """Devuelve la próxima tarjeta pendiente: repasos vencidos antes que nuevas."""
+        now_ts = as_utc(now).timestamp()
+        while self._review_heap:
+            due_ts, card_id = self._review_heap[0]
+            if card_id in self._entries and self._entries[card_id][0] == due_ts:
+                if due_ts <= now_ts:
+                    return card_id
+                break
+            heapq.heappop(self._review_heap)
+        while self._new_heap:
+            card_id = self._new_heap[0]
+            if card_id in self._entries and self._entries[card_id][0] is None:
+                return card_id
+            heapq.heappop(self._new_heap)
+        return None
+
+    def peek_at_risk(self, now: datetime) -> Optional[int]:
+        """
+        Devuelve la tarjeta vencida con menor retrievability; las que no tienen
+        estado FSRS y las nuevas se sirven después, en el orden habitual.
+        """
+        if self._risk is not None:
+            card_id = self._risk.lowest_retrievability(as_utc(now).timestamp())
+            if card_id is not None:
+                return card_id
+        return self.peek_due(now)
+
+    def _maybe_compact(self) -> None:
+        """Reconstruye los heaps cuando las entradas obsoletas dominan."""
+        if len(self._review_heap) + len(self._new_heap) <= 2 * len(self._entries) + 64:
+            return
+        self._review_heap = [(due_ts, card_id) for card_id, (due_ts, _) in self._entries.items() if due_ts is not None]
+        self._new_heap = [card_id for card_id, (due_ts, _) in self._entries.items() if due_ts is None]
+        heapq.heapify(self._review_heap)
+        heapq.heapify(self._new_heap)
+
+
+class DueQueueCache:
+    """
+    Colas de repaso por mazo, cargadas bajo demanda y acotadas por un LRU.
+
+    La clave None representa la cola de todos los mazos. Los endpoints que
+    escriben tarjetas notifican los cambios (write-through) tras el commit.
+    """
+
+    # Reintentos ante entradas obsoletas antes de recurrir a la consulta SQL
+    MAX_STALE_RETRIES = 3
+
+    def __init__(self, max_decks: int = 64):
+        self.max_decks = max_decks
+        self._queues: "OrderedDict[Optional[int], DueCardQueue]" = OrderedDict()
+        self._lock = threading.Lock()
+        # Cambios recibidos mientras se carga alguna cola fuera del lock, para reaplicarlos al instalarla
+        self._load_buffers: Dict[int, List[Optional[Tuple]]] = {}
+        self._counters = {"hits": 0, "misses": 0, "evictions": 0, "stale": 0, "fallbacks": 0, "updates": 0}
+
+    def _load(self, session: Session, deck_id: Optional[int]) -> DueCardQueue:
+        query = select(
+            db.Card.id,
+            epoch_microseconds(db.Card.next_review_at),
+            db.Card.fsrs_stability,
+            epoch_microseconds(db.Card.fsrs_last_review),
+            epoch_microseconds(db.Card.updated_at),
+        ).where(db.Card.is_deleted == False)
+        if deck_id:
+            query = query.where(db.Card.deck_id == deck_id)
+        rows = session.exec(query).all()
+        if not NUMPY_AVAILABLE:
+            queue = DueCardQueue()
+            for card_id, due_us, stability, last_review_us, version in rows:
+                queue.upsert_timestamps(
+                    card_id,
+                    due_us / 1e6 if due_us is not None else None,
+                    stability,
+                    last_review_us / 1e6 if last_review_us is not None else None,
+                    version,
+                )
+            return queue
+        # Una matriz directamente desde las tuplas (None pasa a NaN), sin convertir fila a fila.
+        # Ids y microsegundos caben de sobra en los 53 bits exactos de un float64
+        columns = np.array(rows, dtype=np.float64).reshape(-1, 5)
+        return DueCardQueue.from_arrays(
+            ids=columns[:, 0].astype(np.int64),
+            due=columns[:, 1] / 1e6,
+            stability=columns[:, 2].copy(),
+            last_review=columns[:, 3] / 1e6,
+            versions=columns[:, 4].astype(np.int64),
+        )
+
+    def _get_queue(self, session: Session, deck_id: Optional[int]) -> DueCardQueue:
+        """
+        Cola del mazo, cargándola si no está. La consulta se hace fuera del lock
+        para que la carga en frío de un mazo grande no bloquee al resto; los
+        cambios que llegan mientras tanto se reaplican antes de instalarla.
+        """
+        with self._lock:
+            queue = self._queues.get(deck_id)
+            if queue is not None:
+                self._queues.move_to_end(deck_id)
+                self._counters["hits"] += 1
+                return queue
+            self._counters["misses"] += 1
+            buffer: List[Optional[Tuple]] = []
+            self._load_buffers[id(buffer)] = buffer
+
+        try:
+            loaded = self._load(session, deck_id)
+        except BaseException:
+            with self._lock:
+                del self._load_buffers[id(buffer)]
+            raise
+
+        with self._lock:
+            del self._load_buffers[id(buffer)]
+            for change in buffer:
+                if change is not None:
+                    self._apply_change(deck_id, loaded, *change)
+            queue = self._queues.get(deck_id)
+            if queue is not None:
+                # Otro hilo la instaló mientras cargábamos
+                return queue
+            # Si se invalidó durante la carga (None), la cola puede ser anterior al cambio: no se cachea
+            if None not in buffer:
+                self._queues[deck_id] = loaded
+                if len(self._queues) > self.max_decks:
+                    self._queues.popitem(last=False)
+                    self._counters["evictions"] += 1
+            return loaded
+
+    @staticmethod
+    def _apply_change(
+        key: Optional[int],
+        queue: DueCardQueue,
+        card_id: int,
+        deck_id: int,
+        due: Optional[datetime],
+        is_deleted: bool,
+        stability: Optional[float],
+        last_review: Optional[datetime],
+        updated_at: Optional[datetime] = None,
+    ) -> None:
+        if is_deleted or key not in (deck_id, None):
+            queue.remove(card_id)
+        else:
+            queue.upsert(card_id, due, stability, last_review, updated_at)
+
+    def next_card(
+        self, session: Session, now: datetime, deck_id: Optional[int] = None, order: str = "due"
+    ) -> Optional[db.Card]:
+        """
+        Obtiene la próxima tarjeta a repasar consultando la cola en memoria.
+        Con order="risk" se sirve primero la de menor retrievability actual.
+
+        La única consulta por tarjeta es la carga de la fila que se devuelve,
+        que trae su vencimiento y versión en microsegundos: si coinciden con
+        los de la cola se sirve tal cual; si no, la misma fila corrige la cola.
+        Solo tras varios desajustes seguidos se recurre a la consulta SQL.
+        """
+        deck_id = deck_id or None
+        for _ in range(self.MAX_STALE_RETRIES):
+            queue = self._get_queue(session, deck_id)
+            with self._lock:
+                card_id = queue.peek_at_risk(now) if order == "risk" else queue.peek_due(now)
+                expected = queue.expected_state(card_id) if card_id is not None else None
+            if card_id is None:
+                return None
+
+            row = session.exec(
+                select(db.Card, epoch_microseconds(db.Card.next_review_at), epoch_microseconds(db.Card.updated_at))
+                .where(db.Card.id == card_id)
+                .options(selectinload(db.Card.deck))
+            ).first()
+            card, due_us, version = row if row is not None else (None, None, None)
+            in_deck = card is not None and not card.is_deleted and (deck_id is None or card.deck_id == deck_id)
+            if in_deck and expected is not None:
+                expected_due, expected_version = expected
+                card_due = due_us / 1e6 if due_us is not None else None
+                if card_due == expected_due and expected_version in (None, version):
+                    return card
+
+            # La cola quedó desfasada (p. ej. otro worker escribió o la tarjeta cambió de mazo): corregir y reintentar
+            with self._lock:
+                self._counters["stale"] += 1
+                if not in_deck:
+                    queue.remove(card_id)
+                else:
+                    queue.upsert(
+                        card_id, card.next_review_at, card.fsrs_stability, card.fsrs_last_review, card.updated_at
+                    )
+
+        with self._lock:
+            self._counters["fallbacks"] += 1
+        cards, _ = fetch_due_cards(session, now, limit=1, deck_id=deck_id)
+        return cards[0] if cards else None
+
+    def card_changed(
+        self,
+        card_id: int,
+        deck_id: int,
+        due: Optional[datetime],
+        is_deleted: bool = False,
+        stability: Optional[float] = None,
+        last_review: Optional[datetime] = None,
+        updated_at: Optional[datetime] = None,
+    ) -> None:
+        """
+        Refleja en las colas cargadas el estado de una tarjeta ya persistida.
+        Si la tarjeta cambió de mazo, sale de las colas de los demás mazos.
+        """
+        change = (card_id, deck_id, due, is_deleted, stability, last_review, updated_at)
+        with self._lock:
+            self._counters["updates"] += 1
+            for key, queue in self._queues.items():
+                self._apply_change(key, queue, *change)
+            for buffer in self._load_buffers.values():
+                buffer.append(change)
+
+    def cards_changed(self, cards: List[db.Card]) -> None:
+        for card in cards:
+            self.card_changed(
+                card.id, card.deck_id, card.next_review_at, card.is_deleted,
+                card.fsrs_stability, card.fsrs_last_review, card.updated_at
+            )
+
+    def invalidate(self, deck_id: Optional[int] = None) -> None:
+        """Descarta la cola de un mazo (y la global) para recargarla en la próxima consulta."""
+        with self._lock:
+            self._queues.pop(deck_id, None)
+            self._queues.pop(None, None)
+            for buffer in self._load_buffers.values():
+                buffer.append(None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._queues.clear()
+            for buffer in self._load_buffers.values():
+                buffer.append(None)
+            for key in self._counters:
+                self._counters[key] = 0
+
+    def stats(self) -> Dict[str, Any]:
+        """Contadores de uso para medir la tasa de aciertos."""
+        with self._lock:
+            lookups = self._counters["hits"] + self._counters["misses"]
+            return {
+                **self._counters,
+                "hit_rate": self._counters["hits"] / lookups if lookups else 0.0,
+                "loaded_decks": len(self._queues),
+                "cached_cards": sum(len(queue) for queue in self._queues.values()),
+            }
+
+
+due_queue_cache = DueQueueCache(max_decks=settings.review_queue_max_decks)
@@ -0,0 +1,175 @@
+"""
+Servicio de estadísticas para JuanPA.
+Pronóstico de carga de repasos simulado con FSRS sobre arrays NumPy de todas
+las tarjetas, con cache invalidado por el registro de cambios.
+"""
+
+import threading
+from collections import OrderedDict
+from datetime import datetime, timezone, timedelta
+from typing import Any, Dict, List, Optional, Tuple
+
+from sqlmodel import Session, select
+
+from . import db_models as db
+from .change_log import current_seq
+from .fsrs_optimizer import DEFAULT_PARAMETERS
+from .fsrs_service import DEFAULT_USER_ID, epoch_microseconds, get_scheduler_params
+from .logging_config import get_logger
+
+# Importar NumPy con manejo de errores
+try:
+    import numpy as np
+    from . import fsrs_math as fm
+    NUMPY_AVAILABLE = True
+except ImportError:
+    NUMPY_AVAILABLE = False
+
+logger = get_logger("juanpa.stats")
+
+FORECAST_MAX_DAYS = 365
+CARD_CHUNK_SIZE = 50_000
+# Semilla fija: el mismo estado de tarjetas produce siempre el mismo pronóstico
+FORECAST_SEED = 20240601
+
+
+def load_card_arrays(session: Session) -> Dict[str, "np.ndarray"]:
+    """
+    Carga en bloques el estado FSRS de las tarjetas no eliminadas ya repasadas
+    alguna vez. Las fechas llegan de SQL como microsegundos desde epoch y cada
+    bloque de filas se convierte de una vez en una matriz (None pasa a NaN).
+    """
+    query = select(
+        db.Card.fsrs_stability,
+        db.Card.fsrs_difficulty,
+        epoch_microseconds(db.Card.next_review_at),
+        epoch_microseconds(db.Card.fsrs_last_review),
+    ).where(
+        db.Card.is_deleted == False,
+        db.Card.fsrs_state != "new",
+    ).execution_options(yield_per=CARD_CHUNK_SIZE)
+
+    blocks = [np.array(rows, dtype=np.float64) for rows in session.exec(query).partitions()]
+    columns = np.concatenate(blocks) if blocks else np.empty((0, 4))
+    return {
+        "stability": columns[:, 0].copy(),
+        "difficulty": columns[:, 1].copy(),
+        "due": columns[:, 2] / 1e6,
+        "last_review": columns[:, 3] / 1e6,
+    }
+
+
+def simulate_forecast(
+    cards: Dict[str, "np.ndarray"],
+    days: int,
+    today: datetime,
+    desired_retention: float,
+    maximum_interval: int,
+    parameters: Optional[Tuple[float, ...]] = None,
+    seed: int = FORECAST_SEED,
+) -> List[int]:
+    """
+    Simula día a día los repasos de las tarjetas ya programadas.
+
+    Cada día se repasan las tarjetas que vencen; el recuerdo se sortea con su
+    retrievability en ese momento y la tarjeta se reprograma con FSRS (las
+    olvidadas vuelven al día siguiente). Las tarjetas nuevas no se simulan.
+    Devuelve el número de repasos de cada día.
+    """
+    weights = np.asarray(parameters or DEFAULT_PARAMETERS, dtype=np.float64)
+    day_seconds = 86400.0
+    start = today.replace(hour=0, minute=0, second=0, microsecond=0).timestamp()
+
+    scheduled = ~np.isnan(cards["due"])
+    due_day = np.maximum(np.floor((cards["due"][scheduled] - start) / day_seconds), 0).astype(np.int64)
+    last_day = np.floor((cards["last_review"][scheduled] - start) / day_seconds)
+    stability = cards["stability"][scheduled]
+    difficulty = cards["difficulty"][scheduled]
+
+    # Tarjetas sin historial FSRS: se asumen recién aprendidas con "Good"
+    missing = np.isnan(stability) | np.isnan(difficulty)
+    stability[missing] = fm.initial_stability(weights, 3)
+    difficulty[missing] = fm.initial_difficulty(weights, 3)[0]
+    last_day = np.where(np.isnan(last_day), due_day - 1, last_day)
+
+    rng = np.random.default_rng(seed)
+    counts = []
+    for day in range(days):
+        today_mask = due_day == day
+        n_due = int(today_mask.sum())
+        counts.append(n_due)
+        if not n_due:
+            continue
+
+        s = stability[today_mask]
+        d = difficulty[today_mask]
+        elapsed = day - last_day[today_mask]
+        recalled = rng.random(n_due) < fm.retrievability(elapsed, s)
+        rating = np.where(recalled, 3, 1)
+
+        new_stability = np.maximum(fm.next_stability(weights, s, d, elapsed, rating), 0.01)
+        interval = np.where(recalled, fm.next_interval(new_stability, desired_retention, maximum_interval), 1)
+
+        stability[today_mask] = new_stability
+        difficulty[today_mask] = fm.next_difficulty(weights, d, rating)
+        last_day[today_mask] = day
+        due_day[today_mask] = day + interval.astype(np.int64)
+
+    return counts
+
+
+class ForecastCache:
+    """Cache LRU de pronósticos indexado por parámetros, día y seq del registro de cambios."""
+
+    def __init__(self, max_entries: int = 16):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[Tuple, Dict[str, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Tuple) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def put(self, key: Tuple, value: Dict[str, Any]) -> None:
+        with self._lock:
+            self._entries[key] = value
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+
+forecast_cache = ForecastCache()
+
+
+def get_forecast(session: Session, days: int, user_id: str = DEFAULT_USER_ID) -> Dict[str, Any]:
+    """Pronóstico de repasos diarios para los próximos `days` días (cacheado)."""
+    now = datetime.now(timezone.utc)
+    desired_retention, maximum_interval, parameters = get_scheduler_params(session, user_id)
+    # Cualquier escritura de tarjetas (ORM o masiva, de cualquier worker) avanza el seq
+    key = (days, desired_retention, maximum_interval, parameters, now.date(), current_seq(session))
+
+    cached = forecast_cache.get(key)
+    if cached is not None:
+        return {**cached, "cached": True}
+
+    cards = load_card_arrays(session)
+    counts = simulate_forecast(cards, days, now, desired_retention, maximum_interval, parameters)
+    start_date = now.date()
+    forecast = {
+        "generated_at": now,
+        "days": days,
+        "total_reviews": int(sum(counts)),
+        "forecast": [
+            {"date": start_date + timedelta(days=offset), "reviews": count}
+            for offset, count in enumerate(counts)
+        ],
+    }
+    forecast_cache.put(key, forecast)
+    logger.info(f"Pronóstico de {days} días calculado sobre {len(cards['due'])} tarjetas")
+    return {**forecast, "cached": False}
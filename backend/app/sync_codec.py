@@ -0,0 +1,227 @@
+"""
+Codificación negociada de los cuerpos de sincronización para JuanPA.
+
+El formato se elige con `Accept` (respuestas) y `Content-Type` (push):
+  - application/json: el JSON de siempre, una lista de objetos por tipo.
+  - application/vnd.juanpa.columnar+json: JSON columnar; cada lista de
+    mazos o tarjetas viaja como {"columns": [...], "rows": [[...], ...]}
+    y las claves no se repiten por fila. Los parches de tarjeta van como una
+    lista de esos bloques, uno por conjunto de columnas.
+  - application/x-msgpack: el mismo layout columnar en MessagePack
+    (requiere el paquete msgpack).
+
+Encima se aplica compresión según `Accept-Encoding` / `Content-Encoding`:
+zstd si el paquete zstandard está instalado y gzip en cualquier caso.
+"""
+
+import gzip
+import json
+import zlib
+from typing import Any, Dict, List, Optional, Tuple
+
+from fastapi import Request, Response
+from fastapi.encoders import jsonable_encoder
+
+from .exceptions import ValidationError
+
+# Importar codecs opcionales con manejo de errores
+try:
+    import msgpack
+    MSGPACK_AVAILABLE = True
+except ImportError:
+    MSGPACK_AVAILABLE = False
+
+try:
+    import zstandard
+    ZSTD_AVAILABLE = True
+except ImportError:
+    ZSTD_AVAILABLE = False
+
+JSON_MEDIA_TYPE = "application/json"
+COLUMNAR_MEDIA_TYPE = "application/vnd.juanpa.columnar+json"
+MSGPACK_MEDIA_TYPE = "application/x-msgpack"
+
+# Claves de los cuerpos de sync que son listas homogéneas de registros
+COLUMNAR_KEYS = ("decks", "cards", "new_decks", "new_cards", "updated_decks", "updated_cards", "created_decks", "created_cards", "review_logs")
+# Listas de registros parciales: un bloque columnar por conjunto de columnas,
+# porque en un parche una clave ausente no equivale a null
+SPARSE_COLUMNAR_KEYS = ("card_patches",)
+
+# Por debajo de este tamaño la compresión no compensa la cabecera
+COMPRESSION_MIN_SIZE = 512
+GZIP_LEVEL = 6
+ZSTD_LEVEL = 3
+
+# Tope del cuerpo descomprimido de un push (mismo límite que SecurityMiddleware)
+MAX_DECODED_SIZE = 100 * 1024 * 1024
+
+
+def sync_media_types() -> List[str]:
+    """Formatos disponibles en este servidor, en orden de preferencia del servidor."""
+    media_types = [JSON_MEDIA_TYPE, COLUMNAR_MEDIA_TYPE]
+    if MSGPACK_AVAILABLE:
+        media_types.append(MSGPACK_MEDIA_TYPE)
+    return media_types
+
+
+def sync_encodings() -> List[str]:
+    encodings = ["gzip"]
+    if ZSTD_AVAILABLE:
+        encodings.insert(0, "zstd")
+    return encodings
+
+
+def _parse_header_list(header: str) -> List[Tuple[str, float]]:
+    """Parsea una cabecera tipo Accept en [(valor, q)], ignorando parámetros distintos de q."""
+    items = []
+    for part in header.split(","):
+        value, *params = [piece.strip() for piece in part.split(";")]
+        if not value:
+            continue
+        q = 1.0
+        for param in params:
+            name, _, raw = param.partition("=")
+            if name.strip().lower() == "q":
+                try:
+                    q = float(raw)
+                except ValueError:
+                    q = 0.0
+        items.append((value.lower(), q))
+    return items
+
+
+def _negotiate(header: Optional[str], available: List[str], default: Optional[str]) -> Optional[str]:
+    """Elige el valor disponible con mayor q; a igual q gana el orden del cliente."""
+    if not header:
+        return default
+    best, best_q = None, 0.0
+    for value, q in _parse_header_list(header):
+        if q <= best_q:
+            continue
+        if value in available:
+            best, best_q = value, q
+        elif value == "*/*" or value == "*":
+            best, best_q = default or available[0], q
+    return best if best is not None else default
+
+
+def negotiate_media_type(accept: Optional[str]) -> str:
+    """Formato de respuesta; JSON si el cliente no pide (o no podemos dar) otro."""
+    return _negotiate(accept, sync_media_types(), JSON_MEDIA_TYPE) or JSON_MEDIA_TYPE
+
+
+def negotiate_encoding(accept_encoding: Optional[str]) -> Optional[str]:
+    return _negotiate(accept_encoding, sync_encodings(), None)
+
+
+def _table(columns: List[str], records: List[Dict[str, Any]]) -> Dict[str, Any]:
+    return {"columns": columns, "rows": [[record.get(column) for column in columns] for record in records]}
+
+
+def _records(key: str, table: Any) -> List[Dict[str, Any]]:
+    try:
+        columns = table["columns"]
+        return [dict(zip(columns, row)) for row in table["rows"]]
+    except (KeyError, TypeError):
+        raise ValidationError(f"Bloque columnar inválido en '{key}'", field=key)
+
+
+def to_columnar(data: Dict[str, Any]) -> Dict[str, Any]:
+    """Convierte las listas de registros del cuerpo a {"columns", "rows"}."""
+    result = dict(data)
+    for key in COLUMNAR_KEYS:
+        records = result.get(key)
+        if records:
+            result[key] = _table(list(records[0]), records)
+    for key in SPARSE_COLUMNAR_KEYS:
+        records = result.get(key)
+        if records:
+            groups: Dict[Tuple[str, ...], List[Dict[str, Any]]] = {}
+            for record in records:
+                groups.setdefault(tuple(record), []).append(record)
+            result[key] = [_table(list(columns), group) for columns, group in groups.items()]
+    return result
+
+
+def from_columnar(data: Any) -> Any:
+    """Inversa de to_columnar; deja intactas las listas que ya vienen como objetos."""
+    if not isinstance(data, dict):
+        return data
+    result = dict(data)
+    for key in COLUMNAR_KEYS:
+        if isinstance(result.get(key), dict):
+            result[key] = _records(key, result[key])
+    for key in SPARSE_COLUMNAR_KEYS:
+        blocks = result.get(key)
+        if isinstance(blocks, list) and any(isinstance(block, dict) and "rows" in block for block in blocks):
+            result[key] = [record for block in blocks for record in _records(key, block)]
+    return result
+
+
+def encode_body(data: Dict[str, Any], media_type: str) -> bytes:
+    """Serializa un cuerpo ya convertido a tipos JSON en el formato pedido."""
+    if media_type == MSGPACK_MEDIA_TYPE:
+        return msgpack.packb(to_columnar(data), use_bin_type=True)
+    if media_type == COLUMNAR_MEDIA_TYPE:
+        data = to_columnar(data)
+    return json.dumps(data, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def compress(body: bytes, encoding: Optional[str]) -> Tuple[bytes, Optional[str]]:
+    """Comprime con la codificación negociada si el cuerpo es lo bastante grande."""
+    if encoding is None or len(body) < COMPRESSION_MIN_SIZE:
+        return body, None
+    if encoding == "zstd":
+        return zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(body), "zstd"
+    return gzip.compress(body, compresslevel=GZIP_LEVEL, mtime=0), "gzip"
+
+
+def _decompress(body: bytes, encoding: str) -> bytes:
+    """Descomprime con un tope de tamaño para no aceptar bombas de compresión."""
+    if encoding == "gzip":
+        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        data = decompressor.decompress(body, MAX_DECODED_SIZE + 1)
+        if len(data) <= MAX_DECODED_SIZE and not decompressor.eof:
+            raise ValidationError("Cuerpo gzip truncado", field="content-encoding")
+    elif encoding == "zstd" and ZSTD_AVAILABLE:
+        with zstandard.ZstdDecompressor().stream_reader(body) as reader:
+            data = reader.read(MAX_DECODED_SIZE + 1)
+    else:
+        raise ValidationError(f"Content-Encoding no soportado: {encoding}", field="content-encoding")
+    if len(data) > MAX_DECODED_SIZE:
+        raise ValidationError("Cuerpo descomprimido demasiado grande", field="content-encoding")
+    return data
+
+
+def decode_body(body: bytes, content_type: Optional[str], content_encoding: Optional[str]) -> Any:
+    """Decodifica un cuerpo de push en cualquiera de los formatos soportados."""
+    encoding = (content_encoding or "").strip().lower()
+    try:
+        if encoding and encoding != "identity":
+            body = _decompress(body, encoding)
+        media_type = (content_type or JSON_MEDIA_TYPE).split(";")[0].strip().lower()
+        if media_type == MSGPACK_MEDIA_TYPE:
+            if not MSGPACK_AVAILABLE:
+                raise ValidationError("MessagePack no disponible en el servidor", field="content-type")
+            return from_columnar(msgpack.unpackb(body, raw=False))
+        if media_type in (JSON_MEDIA_TYPE, COLUMNAR_MEDIA_TYPE):
+            return from_columnar(json.loads(body))
+    except (zlib.error, EOFError, ValueError) as e:
+        # JSON y MessagePack inválidos (y UTF-8 roto) son ValueError
+        raise ValidationError(f"Cuerpo de sincronización ilegible: {e}", field="body")
+    raise ValidationError(f"Content-Type no soportado: {media_type}", field="content-type")
+
+
+def sync_response(
+    request: Request, content: Any, status_code: int = 200, headers: Optional[Dict[str, str]] = None
+) -> Response:
+    """Respuesta de sync en el formato y la compresión negociados con el cliente."""
+    media_type = negotiate_media_type(request.headers.get("accept"))
+    body, encoding = compress(
+        encode_body(jsonable_encoder(content), media_type),
+        negotiate_encoding(request.headers.get("accept-encoding"))
+    )
+    headers = {**(headers or {}), "Vary": "Accept, Accept-Encoding"}
+    if encoding:
+        headers["Content-Encoding"] = encoding
+    return Response(content=body, status_code=status_code, media_type=media_type, headers=headers)
@@ -0,0 +1,107 @@
+"""
+Notificaciones de cambios para la sincronización de JuanPA.
+Un único difusor en memoria por worker avisa a los clientes suscritos (SSE o
+WebSocket) de que hay cambios hasta un seq dado, para que hagan pull solo
+entonces en lugar de sondear.
+
+Cada suscriptor solo espera sobre un asyncio.Event compartido que se
+reemplaza en cada cambio, así que una conexión inactiva no cuesta más que
+una corrutina suspendida: no hay colas por cliente y las ráfagas de commits
+se coalescen en el último seq.
+"""
+
+import asyncio
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterator, Optional
+
+from .logging_config import get_logger
+
+logger = get_logger("juanpa.sync_notifications")
+
+
+class ChangeBroadcaster:
+    """Difusor in-process del último seq confirmado del registro de cambios."""
+
+    def __init__(self):
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._event = asyncio.Event()
+        self._seq = 0
+        self._changed_at: Optional[datetime] = None
+        self.subscribers = 0
+
+    def attach(self, loop: asyncio.AbstractEventLoop) -> None:
+        """Asocia el difusor al event loop de la aplicación (al arrancar)."""
+        self._loop = loop
+        self._event = asyncio.Event()
+        self._seq = 0
+        self._changed_at = None
+
+    def detach(self) -> None:
+        self._loop = None
+        self._event.set()
+
+    @property
+    def has_subscribers(self) -> bool:
+        return self._loop is not None and self.subscribers > 0
+
+    def subscribe(self) -> None:
+        """Registra un cliente suscrito: los commits solo leen el seq si hay alguno."""
+        self.subscribers += 1
+
+    def unsubscribe(self) -> None:
+        self.subscribers = max(self.subscribers - 1, 0)
+
+    @contextmanager
+    def subscription(self) -> Iterator["ChangeBroadcaster"]:
+        """Mantiene registrado al cliente mientras dura el bloque."""
+        self.subscribe()
+        try:
+            yield self
+        finally:
+            self.unsubscribe()
+
+    def notify(self, seq: int) -> None:
+        """Publica un nuevo seq; se puede llamar desde cualquier hilo (p. ej. tras un commit)."""
+        loop = self._loop
+        if loop is None or loop.is_closed():
+            return
+        loop.call_soon_threadsafe(self._publish, seq, datetime.now(timezone.utc))
+
+    def _publish(self, seq: int, changed_at: datetime) -> None:
+        # Los avisos de commits concurrentes pueden llegar desordenados
+        if seq <= self._seq:
+            return
+        self._seq = seq
+        self._changed_at = changed_at
+        event, self._event = self._event, asyncio.Event()
+        event.set()
+
+    async def wait_for_change(self, after_seq: int, timeout: float) -> bool:
+        """Espera a que haya un seq mayor que `after_seq`; False si vence `timeout` antes."""
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while self._seq <= after_seq:
+            remaining = deadline - loop.time()
+            if remaining <= 0 or self._loop is None:
+                return False
+            try:
+                await asyncio.wait_for(self._event.wait(), remaining)
+            except asyncio.TimeoutError:
+                return False
+        return True
+
+    def message(self, seq: Optional[int] = None) -> Dict[str, Any]:
+        """Aviso "cambios hasta seq X" que se envía a los clientes."""
+        return {
+            "type": "changed",
+            "last_seq": self._seq if seq is None else seq,
+            "changed_at": (self._changed_at or datetime.now(timezone.utc)).isoformat(),
+        }
+
+    @property
+    def last_seq(self) -> int:
+        return self._seq
+
+
+change_broadcaster = ChangeBroadcaster()
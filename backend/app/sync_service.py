@@ -0,0 +1,845 @@
+"""
+Servicio de sincronización para JuanPA.
+Lectura de cambios para el pull de sincronización directamente como tuplas de
+columnas, sin instanciar modelos ORM ni Pydantic por fila, de modo que pueda
+emitirse en streaming (NDJSON) con memoria constante, paginarse por keyset
+sobre (updated_at, id) o leerse a partir del registro de cambios por seq,
+opcionalmente como deltas con solo las columnas de tarjeta que cambiaron.
+"""
+
+import json
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Set, Tuple
+
+from sqlalchemy import insert, update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.engine import Engine
+from sqlmodel import Session, select, and_, or_, asc
+
+from . import db_models as db
+from . import models as m
+from .change_log import CARD_TRACKED_COLUMNS, column_mask, current_seq, mask_columns, record_changes
+from .exceptions import NotFoundError, ValidationError
+from .fsrs_service import as_utc
+
+# Filas leídas por ida a la base de datos al recorrer los cambios
+SYNC_STREAM_CHUNK_SIZE = 1000
+
+# Ids por consulta IN (por debajo del límite de parámetros de SQLite)
+ID_LOOKUP_CHUNK_SIZE = 900
+
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+
+# Columnas en el mismo orden y con los mismos nombres que DeckSyncRead / CardSyncRead
+DECK_SYNC_COLUMNS = (
+    db.Deck.id, db.Deck.uuid, db.Deck.name, db.Deck.description,
+    db.Deck.created_at, db.Deck.updated_at, db.Deck.is_deleted, db.Deck.deleted_at,
+)
+CARD_SYNC_COLUMNS = (
+    db.Card.id, db.Card.uuid, db.Card.deck_id,
+    db.Card.front_content, db.Card.back_content, db.Card.cloze_data, db.Card.tags,
+    db.Card.next_review_at, db.Card.fsrs_stability, db.Card.fsrs_difficulty, db.Card.fsrs_lapses,
+    db.Card.fsrs_state, db.Card.fsrs_step, db.Card.fsrs_last_review,
+    db.Card.created_at, db.Card.updated_at, db.Card.is_deleted, db.Card.deleted_at,
+)
+
+
+def _json_default(value: Any) -> Any:
+    if isinstance(value, datetime):
+        return as_utc(value).isoformat()
+    raise TypeError(f"Tipo no serializable: {type(value).__name__}")
+
+
+def dumps(value: Any) -> str:
+    """JSON compacto; las fechas se emiten en ISO 8601 con zona UTC."""
+    return json.dumps(value, default=_json_default, ensure_ascii=False, separators=(",", ":"))
+
+
+def row_to_dict(columns: Sequence[Any], row: Sequence[Any]) -> Dict[str, Any]:
+    return {column.key: value for column, value in zip(columns, row)}
+
+
+# Columna que liga cada entidad del pull con su mazo, para la sincronización parcial
+DECK_SCOPE_COLUMNS = {db.Deck: db.Deck.id, db.Card: db.Card.deck_id}
+
+
+def changed_rows_query(
+    model: Any,
+    columns: Sequence[Any],
+    since: Optional[datetime],
+    after: Optional[Tuple[datetime, int]] = None,
+    deck_ids: Optional[Sequence[int]] = None,
+    backfill_deck_ids: Sequence[int] = (),
+):
+    """
+    Columnas de sincronización de las filas modificadas después de `since`
+    (todas si es None), en orden (updated_at, id). `after` es la última
+    posición ya entregada al cliente.
+
+    `deck_ids` restringe el resultado a esos mazos (None = todos) y las filas
+    de `backfill_deck_ids` se entregan aunque no hayan cambiado desde `since`
+    (mazos recién suscritos).
+    """
+    query = select(*columns)
+    if deck_ids is not None:
+        query = query.where(DECK_SCOPE_COLUMNS[model].in_(deck_ids))
+    if since is not None:
+        if backfill_deck_ids:
+            query = query.where(or_(model.updated_at > since, DECK_SCOPE_COLUMNS[model].in_(backfill_deck_ids)))
+        else:
+            query = query.where(model.updated_at > since)
+    if after is not None:
+        after_updated_at, after_id = after
+        query = query.where(or_(
+            model.updated_at > after_updated_at,
+            and_(model.updated_at == after_updated_at, model.id > after_id)
+        ))
+    return query.order_by(asc(model.updated_at), asc(model.id))
+
+
+# Entidades del pull en el orden en que se entregan
+PULL_ENTITIES = (
+    ("decks", db.Deck, DECK_SYNC_COLUMNS),
+    ("cards", db.Card, CARD_SYNC_COLUMNS),
+)
+
+
+def _parse_pull_cursor(cursor: Dict[str, Any]) -> Tuple[datetime, int, Optional[datetime], Dict[str, Tuple[datetime, int]], set]:
+    try:
+        server_timestamp = as_utc(datetime.fromisoformat(cursor["server_timestamp"]))
+        last_seq = int(cursor["last_seq"])
+        since = as_utc(datetime.fromisoformat(cursor["since"])) if cursor.get("since") else None
+        after = {
+            name: (as_utc(datetime.fromisoformat(updated_at)), int(row_id))
+            for name, (updated_at, row_id) in cursor.get("after", {}).items()
+        }
+        done = set(cursor.get("done", []))
+    except (KeyError, TypeError, ValueError):
+        raise ValidationError("Token de continuación inválido", field="cursor")
+    return server_timestamp, last_seq, since, after, done
+
+
+def device_deck_ids(session: Session, device_id: Optional[str]) -> Optional[List[int]]:
+    """
+    Mazos suscritos por el dispositivo, o None si no restringe la
+    sincronización (sin dispositivo o sin suscripciones registradas). Un
+    dispositivo que se desuscribió de todos sus mazos obtiene una lista
+    vacía: no sincroniza ninguno.
+    """
+    if device_id is None:
+        return None
+    rows = session.execute(
+        select(db.DeckSubscription.deck_id, db.DeckSubscription.is_active)
+        .where(db.DeckSubscription.device_id == device_id)
+    ).all()
+    if not rows:
+        return None
+    return sorted(deck_id for deck_id, is_active in rows if is_active)
+
+
+def _subscription_changes(session: Session, device_id: str, query) -> Tuple[List[int], List[int]]:
+    """(mazos suscritos, mazos desuscritos) entre las suscripciones del dispositivo que cumplen `query`."""
+    subscribed, evicted = [], []
+    rows = session.execute(
+        query.where(db.DeckSubscription.device_id == device_id).order_by(asc(db.DeckSubscription.deck_id))
+    )
+    for deck_id, is_active in rows:
+        (subscribed if is_active else evicted).append(deck_id)
+    return subscribed, evicted
+
+
+def fetch_pull_page(
+    session: Session,
+    since: Optional[datetime],
+    server_timestamp: datetime,
+    limit: Optional[int] = None,
+    cursor: Optional[Dict[str, Any]] = None,
+    device_id: Optional[str] = None,
+) -> Tuple[datetime, int, Dict[str, List[Any]], Optional[Dict[str, Any]]]:
+    """
+    Obtiene una página del pull: hasta `limit` filas en total, primero mazos
+    y luego tarjetas, cada tipo recorrido por keyset sobre (updated_at, id).
+
+    Devuelve (server_timestamp, last_seq, filas por tipo, cursor siguiente o
+    None). El cursor conserva el server_timestamp y el seq del registro de
+    cambios de la primera página, que son los que el cliente debe guardar al
+    terminar. Sin `limit` se devuelve todo de una vez.
+
+    Con `device_id` solo se entregan los mazos suscritos por el dispositivo;
+    los suscritos después de `since` van completos y los desuscritos desde
+    entonces se listan en "evicted_deck_ids" (en la primera página).
+    """
+    after: Dict[str, Tuple[datetime, int]] = {}
+    done: set = set()
+    if cursor:
+        server_timestamp, last_seq, since, after, done = _parse_pull_cursor(cursor)
+    else:
+        # Se lee antes que las filas: lo que cambie durante el pull se reenviará después
+        last_seq = current_seq(session)
+
+    deck_ids = device_deck_ids(session, device_id)
+    backfill_deck_ids: List[int] = []
+    evicted_deck_ids: List[int] = []
+    if deck_ids is not None and since is not None:
+        backfill_deck_ids, evicted_deck_ids = _subscription_changes(
+            session, device_id,
+            select(db.DeckSubscription.deck_id, db.DeckSubscription.is_active)
+            .where(db.DeckSubscription.updated_at > since)
+        )
+        if cursor:
+            evicted_deck_ids = []
+
+    def next_cursor() -> Dict[str, Any]:
+        return {
+            "server_timestamp": server_timestamp.isoformat(),
+            "last_seq": last_seq,
+            "since": since.isoformat() if since else None,
+            "after": {name: [updated_at.isoformat(), row_id] for name, (updated_at, row_id) in after.items()},
+            "done": sorted(done),
+        }
+
+    pages: Dict[str, List[Any]] = {name: [] for name, _, _ in PULL_ENTITIES}
+    pages["evicted_deck_ids"] = evicted_deck_ids
+    remaining = limit
+    for name, model, columns in PULL_ENTITIES:
+        if name in done:
+            continue
+        if remaining == 0:
+            return server_timestamp, last_seq, pages, next_cursor()
+
+        query = changed_rows_query(model, columns, since, after.get(name), deck_ids, backfill_deck_ids)
+        if remaining is not None:
+            query = query.limit(remaining + 1)
+        rows = [row_to_dict(columns, row) for row in session.exec(query)]
+
+        if remaining is not None and len(rows) > remaining:
+            pages[name] = rows[:remaining]
+            last = pages[name][-1]
+            after[name] = (as_utc(last["updated_at"]), last["id"])
+            return server_timestamp, last_seq, pages, next_cursor()
+
+        pages[name] = rows
+        done.add(name)
+        after.pop(name, None)
+        if remaining is not None:
+            remaining -= len(rows)
+    return server_timestamp, last_seq, pages, None
+
+
+def _chunks(values: Sequence[Any]) -> Iterator[Sequence[Any]]:
+    for start in range(0, len(values), ID_LOOKUP_CHUNK_SIZE):
+        yield values[start:start + ID_LOOKUP_CHUNK_SIZE]
+
+
+def _rows_by_ids(
+    session: Session, model: Any, columns: Sequence[Any], ids: List[int], deck_ids: Optional[Sequence[int]] = None
+) -> List[Dict[str, Any]]:
+    rows = []
+    for chunk in _chunks(ids):
+        query = select(*columns).where(model.id.in_(chunk)).order_by(asc(model.id))
+        if deck_ids is not None:
+            query = query.where(DECK_SCOPE_COLUMNS[model].in_(deck_ids))
+        rows.extend(row_to_dict(columns, row) for row in session.exec(query))
+    return rows
+
+
+def _card_patches(
+    session: Session, masks: Dict[int, int], deck_ids: Optional[Sequence[int]] = None
+) -> List[Dict[str, Any]]:
+    """Lee solo id, updated_at y las columnas de la máscara, una consulta por máscara distinta."""
+    ids_by_mask: Dict[int, List[int]] = {}
+    for card_id, mask in masks.items():
+        ids_by_mask.setdefault(mask, []).append(card_id)
+    patches = []
+    for mask, ids in ids_by_mask.items():
+        columns = (db.Card.id, db.Card.updated_at, *(getattr(db.Card, name) for name in mask_columns(mask)))
+        patches.extend(_rows_by_ids(session, db.Card, columns, ids, deck_ids))
+    return sorted(patches, key=lambda patch: patch["id"])
+
+
+def _card_ids_in_decks(session: Session, deck_ids: List[int]) -> List[int]:
+    card_ids = []
+    for chunk in _chunks(deck_ids):
+        card_ids.extend(session.exec(select(db.Card.id).where(db.Card.deck_id.in_(chunk))))
+    return card_ids
+
+
+def fetch_changes_page(
+    session: Session,
+    since_seq: int,
+    server_timestamp: datetime,
+    limit: Optional[int] = None,
+    delta: bool = False,
+    device_id: Optional[str] = None,
+) -> Tuple[datetime, int, Dict[str, List[Any]], Optional[Dict[str, Any]]]:
+    """
+    Obtiene los mazos y tarjetas con entradas en el registro de cambios
+    posteriores a `since_seq`, leyendo el registro como un rango sobre seq.
+    `limit` acota las entradas consumidas por página; varias entradas de la
+    misma entidad se entregan una sola vez con su estado actual.
+
+    Con `delta`, las tarjetas cuyas entradas llevan máscara de columnas se
+    devuelven en "card_patches" solo con esas columnas; las altas, borrados y
+    entradas sin máscara siguen yendo completas en "cards".
+
+    Con `device_id` solo se entregan los mazos suscritos por el dispositivo.
+    Las entradas de suscripción de ese dispositivo traen completo el mazo
+    recién suscrito (con todas sus tarjetas) o lo listan en
+    "evicted_deck_ids" si se desuscribió.
+
+    Devuelve lo mismo que fetch_pull_page; last_seq es la última entrada
+    consumida y el cursor siguiente continúa desde ella.
+    """
+    query = select(
+        db.ChangeLog.seq, db.ChangeLog.entity_type, db.ChangeLog.entity_id, db.ChangeLog.changed_columns
+    ).where(
+        db.ChangeLog.seq > since_seq
+    ).order_by(asc(db.ChangeLog.seq))
+    if limit is not None:
+        query = query.limit(limit + 1)
+    entries = session.exec(query).all()
+    has_more = limit is not None and len(entries) > limit
+    if has_more:
+        entries = entries[:limit]
+    last_seq = entries[-1][0] if entries else since_seq
+
+    changed_ids: Dict[str, Dict[int, None]] = {"deck": {}, "card": {}, "subscription": {}}
+    # Máscara acumulada por tarjeta; None = registro completo
+    card_masks: Dict[int, Optional[int]] = {}
+    for _, entity_type, entity_id, changed_columns in entries:
+        changed_ids[entity_type][entity_id] = None
+        if entity_type == "card":
+            previous = card_masks.get(entity_id, 0)
+            card_masks[entity_id] = None if previous is None or changed_columns is None else previous | changed_columns
+
+    deck_ids = device_deck_ids(session, device_id)
+    evicted_deck_ids: List[int] = []
+    if deck_ids is not None and changed_ids["subscription"]:
+        backfill_deck_ids, evicted_deck_ids = _subscription_changes(
+            session, device_id,
+            select(db.DeckSubscription.deck_id, db.DeckSubscription.is_active)
+            .where(db.DeckSubscription.id.in_(list(changed_ids["subscription"])))
+        )
+        # Un mazo recién suscrito se envía entero: el dispositivo no tiene ninguna de sus filas
+        for deck_id in backfill_deck_ids:
+            changed_ids["deck"][deck_id] = None
+        for card_id in _card_ids_in_decks(session, backfill_deck_ids):
+            changed_ids["card"][card_id] = None
+            card_masks[card_id] = None
+
+    if delta:
+        changed_ids["card"] = {card_id: None for card_id, mask in card_masks.items() if mask is None}
+        patch_masks = {card_id: mask for card_id, mask in card_masks.items() if mask is not None}
+    else:
+        patch_masks = {}
+
+    # Las entidades borradas físicamente no tienen fila que enviar
+    pages: Dict[str, List[Any]] = {
+        name: _rows_by_ids(session, model, columns, sorted(changed_ids[name[:-1]]), deck_ids)
+        for name, model, columns in PULL_ENTITIES
+    }
+    pages["card_patches"] = _card_patches(session, patch_masks, deck_ids) if patch_masks else []
+    pages["evicted_deck_ids"] = evicted_deck_ids
+    next_cursor = None
+    if has_more:
+        next_cursor = {"server_timestamp": server_timestamp.isoformat(), "since_seq": last_seq}
+    return server_timestamp, last_seq, pages, next_cursor
+
+
+def stream_pull_ndjson(bind: Engine, since: Optional[datetime], server_timestamp: datetime) -> Iterator[str]:
+    """
+    Genera el pull de sincronización como NDJSON: una línea "meta", una línea
+    por mazo y por tarjeta, y una línea "end" con los totales para que el
+    cliente detecte respuestas truncadas.
+
+    Usa su propia sesión sobre el mismo engine porque el cuerpo se emite cuando
+    la sesión de la request ya se cerró.
+    """
+    totals = {name: 0 for name, _, _ in PULL_ENTITIES}
+    with Session(bind) as session:
+        meta = {"type": "meta", "server_timestamp": server_timestamp, "last_seq": current_seq(session)}
+        yield dumps(meta) + "\n"
+        for name, model, columns in PULL_ENTITIES:
+            kind = name[:-1]
+            query = changed_rows_query(model, columns, since).execution_options(yield_per=SYNC_STREAM_CHUNK_SIZE)
+            for rows in session.exec(query).partitions():
+                yield "".join(
+                    dumps({"type": kind, "data": row_to_dict(columns, row)}) + "\n" for row in rows
+                )
+                totals[name] += len(rows)
+    yield dumps({"type": "end", **totals}) + "\n"
+
+
+def fetch_sync_page(
+    session: Session,
+    since: Optional[datetime],
+    since_seq: Optional[int],
+    server_timestamp: datetime,
+    limit: Optional[int] = None,
+    cursor: Optional[Dict[str, Any]] = None,
+    delta: bool = False,
+    device_id: Optional[str] = None,
+) -> Tuple[datetime, int, Dict[str, List[Any]], Optional[Dict[str, Any]]]:
+    """
+    Página del pull según el modo pedido: por registro de cambios si hay
+    `since_seq` (o el cursor viene de ese modo) y por updated_at si no.
+    `delta` solo aplica al modo por registro de cambios, el único que conoce
+    qué columnas cambiaron. `device_id` limita el pull a los mazos suscritos
+    por ese dispositivo.
+    """
+    if cursor and "since_seq" in cursor:
+        try:
+            since_seq = int(cursor["since_seq"])
+            server_timestamp = as_utc(datetime.fromisoformat(cursor["server_timestamp"]))
+        except (KeyError, TypeError, ValueError):
+            raise ValidationError("Token de continuación inválido", field="cursor")
+        return fetch_changes_page(session, since_seq, server_timestamp, limit, delta, device_id)
+    if since_seq is not None and not cursor:
+        return fetch_changes_page(session, since_seq, server_timestamp, limit, delta, device_id)
+    server_timestamp, last_seq, pages, next_cursor = fetch_pull_page(
+        session, since, server_timestamp, limit, cursor, device_id
+    )
+    return server_timestamp, last_seq, {**pages, "card_patches": []}, next_cursor
+
+
+# Columnas que un parche de tarjeta puede escribir (el mazo no se cambia por sync)
+PATCHABLE_CARD_COLUMNS = frozenset(CARD_TRACKED_COLUMNS) - {"deck_id"}
+
+# (card_id, deck_id, next_review_at, is_deleted, stability, last_review) para la cola de repaso
+QueueUpdate = Tuple[int, int, Optional[datetime], bool, Optional[float], Optional[datetime], Optional[datetime]]
+
+
+def _lookup(session: Session, columns: Sequence[Any], key: Any, values: Sequence[Any]) -> Dict[Any, Any]:
+    """Resuelve `values` con consultas IN por bloques; devuelve {clave: fila}."""
+    found = {}
+    for chunk in _chunks(list(dict.fromkeys(values))):
+        # execute y no exec: con una sola columna exec devolvería escalares
+        for row in session.execute(select(*columns).where(key.in_(chunk))):
+            found[row[0]] = row
+    return found
+
+
+def _insert_returning(session: Session, model: Any, columns: Sequence[Any], rows: List[Dict[str, Any]]) -> List[Any]:
+    """
+    INSERT masivo (multi-VALUES por lotes) que devuelve las columnas de
+    sincronización de las filas creadas, en el orden de `rows`.
+
+    No se usa sort_by_parameter_order porque en SQLite obliga a insertar fila
+    a fila; los ids autoincrementales se asignan en el orden de VALUES, así
+    que ordenar por id recupera el orden de los parámetros.
+    """
+    created = session.execute(insert(model).returning(*columns), rows).all()
+    return sorted(created, key=lambda row: row[0])
+
+
+def _unique_by_uuid(items: Sequence[Any]) -> Iterator[Tuple[Any, Optional[str]]]:
+    """(elemento, uuid en texto) sin repetir uuids dentro del mismo push."""
+    seen = set()
+    for item in items:
+        item_uuid = str(item.uuid) if item.uuid else None
+        if item_uuid is not None:
+            if item_uuid in seen:
+                continue
+            seen.add(item_uuid)
+        yield item, item_uuid
+
+
+def apply_push(
+    session: Session, payload: m.PushRequest
+) -> Tuple[List[m.DeckSyncRead], List[m.CardSyncRead], List[m.ConflictInfo], List[QueueUpdate]]:
+    """
+    Aplica un push de sincronización con operaciones por conjuntos: una
+    consulta IN por tipo de entidad para resolver filas existentes, INSERT
+    masivos con RETURNING para las altas y UPDATE executemany para las
+    modificaciones. No hace commit.
+
+    Devuelve (mazos creados, tarjetas creadas, conflictos, cambios para la
+    cola de repaso). Las escrituras masivas no pasan por los eventos ORM, así
+    que el registro de cambios se escribe explícitamente.
+    """
+    now = datetime.now(timezone.utc)
+    connection = session.connection()
+    conflicts: List[m.ConflictInfo] = []
+    created_decks: List[m.DeckSyncRead] = []
+    created_cards: List[m.CardSyncRead] = []
+    queue_updates: List[QueueUpdate] = []
+
+    # Nuevos mazos: un uuid ya conocido es un reintento y devuelve el mazo
+    # creado la primera vez; el nombre es único, también dentro del mismo push
+    if payload.new_decks:
+        replayed_decks = _lookup(
+            session, (db.Deck.uuid, *DECK_SYNC_COLUMNS), db.Deck.uuid,
+            [str(d.uuid) for d in payload.new_decks if d.uuid]
+        )
+        fresh_decks = []
+        for new_deck, deck_uuid in _unique_by_uuid(payload.new_decks):
+            if deck_uuid in replayed_decks:
+                created_decks.append(m.DeckSyncRead(**row_to_dict(DECK_SYNC_COLUMNS, replayed_decks[deck_uuid][1:])))
+            else:
+                fresh_decks.append((new_deck, deck_uuid))
+
+        existing_names = _lookup(session, (db.Deck.name, db.Deck.id), db.Deck.name, [d.name for d, _ in fresh_decks])
+        pending: Dict[str, Dict[str, Any]] = {}
+        for new_deck, deck_uuid in fresh_decks:
+            if new_deck.name not in existing_names and new_deck.name not in pending:
+                pending[new_deck.name] = {
+                    "uuid": deck_uuid or db.new_uuid(),
+                    "name": new_deck.name, "description": new_deck.description,
+                    "created_at": now, "updated_at": now,
+                }
+        created_ids: Dict[str, int] = {}
+        if pending:
+            rows = _insert_returning(session, db.Deck, DECK_SYNC_COLUMNS, list(pending.values()))
+            for row in rows:
+                deck = row_to_dict(DECK_SYNC_COLUMNS, row)
+                created_ids[deck["name"]] = deck["id"]
+                created_decks.append(m.DeckSyncRead(**deck))
+            record_changes(connection, "deck", created_ids.values(), "insert")
+
+        first_occurrence = set(pending)
+        for new_deck, _ in fresh_decks:
+            if new_deck.name in first_occurrence:
+                first_occurrence.discard(new_deck.name)
+                continue
+            # Ya existía, o se repite dentro del mismo push
+            deck_id = existing_names[new_deck.name][1] if new_deck.name in existing_names else created_ids[new_deck.name]
+            conflicts.append(m.ConflictInfo(
+                type="deck",
+                id=deck_id,
+                message=f"Ya existe un mazo con el nombre '{new_deck.name}' (ID: {deck_id})"
+            ))
+
+    # Nuevas tarjetas: el mazo puede indicarse por id o por uuid (p. ej. uno
+    # creado offline en este mismo push), sin ida y vuelta para remapear ids
+    if payload.new_cards:
+        replayed_cards = _lookup(
+            session, (db.Card.uuid, *CARD_SYNC_COLUMNS), db.Card.uuid,
+            [str(c.uuid) for c in payload.new_cards if c.uuid]
+        )
+        deck_ids_by_uuid = {deck.uuid: deck.id for deck in created_decks}
+        unresolved = [str(c.deck_uuid) for c in payload.new_cards if c.deck_uuid and str(c.deck_uuid) not in deck_ids_by_uuid]
+        deck_ids_by_uuid.update(
+            (deck_uuid, row[1]) for deck_uuid, row in _lookup(session, (db.Deck.uuid, db.Deck.id), db.Deck.uuid, unresolved).items()
+        )
+        known_decks = set(_lookup(session, (db.Deck.id,), db.Deck.id, [c.deck_id for c in payload.new_cards if c.deck_id]))
+        known_decks.update(deck_ids_by_uuid.values())
+
+        new_rows = []
+        for new_card, card_uuid in _unique_by_uuid(payload.new_cards):
+            if card_uuid in replayed_cards:
+                created_cards.append(m.CardSyncRead(**row_to_dict(CARD_SYNC_COLUMNS, replayed_cards[card_uuid][1:])))
+                continue
+            deck_id = new_card.deck_id if new_card.deck_id is not None else deck_ids_by_uuid.get(str(new_card.deck_uuid))
+            if deck_id is None or deck_id not in known_decks:
+                if new_card.deck_id is not None:
+                    conflicts.append(m.ConflictInfo(
+                        type="card",
+                        id=0,
+                        message=f"Mazo con ID {new_card.deck_id} no encontrado al intentar crear tarjeta"
+                    ))
+                else:
+                    conflicts.append(m.ConflictInfo(
+                        type="card",
+                        uuid=str(new_card.deck_uuid),
+                        message=f"Mazo con UUID {new_card.deck_uuid} no encontrado al intentar crear tarjeta"
+                    ))
+                continue
+            new_rows.append({
+                "uuid": card_uuid or db.new_uuid(),
+                "deck_id": deck_id,
+                "front_content": new_card.front_content,
+                "back_content": new_card.back_content,
+                "cloze_data": new_card.cloze_data,
+                "tags": new_card.tags,
+                "created_at": now,
+                "updated_at": now,
+            })
+        if new_rows:
+            rows = _insert_returning(session, db.Card, CARD_SYNC_COLUMNS, new_rows)
+            inserted_ids = []
+            for row in rows:
+                card = row_to_dict(CARD_SYNC_COLUMNS, row)
+                inserted_ids.append(card["id"])
+                created_cards.append(m.CardSyncRead(**card))
+                queue_updates.append((
+                    card["id"], card["deck_id"], card["next_review_at"], False,
+                    card["fsrs_stability"], card["fsrs_last_review"], card["updated_at"]
+                ))
+            record_changes(connection, "card", inserted_ids, "insert")
+
+    # Mazos actualizados (incluyendo eliminaciones)
+    if payload.updated_decks:
+        existing_decks = _lookup(
+            session, (db.Deck.id, db.Deck.is_deleted), db.Deck.id, [d.id for d in payload.updated_decks]
+        )
+        deck_params = {}
+        for updated_deck in payload.updated_decks:
+            if updated_deck.id not in existing_decks:
+                conflicts.append(m.ConflictInfo(
+                    type="deck",
+                    id=updated_deck.id,
+                    message=f"Mazo con ID {updated_deck.id} no encontrado para actualizar"
+                ))
+                continue
+            deck_params[updated_deck.id] = {
+                "id": updated_deck.id,
+                "name": updated_deck.name,
+                "description": updated_deck.description,
+                "is_deleted": updated_deck.is_deleted,
+                "deleted_at": updated_deck.deleted_at,
+                "updated_at": now,
+            }
+        if deck_params:
+            session.execute(update(db.Deck), list(deck_params.values()))
+            _record_updates(connection, "deck", deck_params, existing_decks)
+
+    # Tarjetas actualizadas (incluyendo eliminaciones)
+    if payload.updated_cards:
+        existing_cards = _lookup(
+            session,
+            (db.Card.id, db.Card.is_deleted, db.Card.deck_id, db.Card.next_review_at,
+             db.Card.fsrs_stability, db.Card.fsrs_last_review),
+            db.Card.id,
+            [c.id for c in payload.updated_cards]
+        )
+        card_params = {}
+        for updated_card in payload.updated_cards:
+            if updated_card.id not in existing_cards:
+                conflicts.append(m.ConflictInfo(
+                    type="card",
+                    id=updated_card.id,
+                    message=f"Tarjeta con ID {updated_card.id} no encontrada para actualizar"
+                ))
+                continue
+            card_params[updated_card.id] = {
+                "id": updated_card.id,
+                "front_content": updated_card.front_content,
+                "back_content": updated_card.back_content,
+                "cloze_data": updated_card.cloze_data,
+                "tags": updated_card.tags,
+                "is_deleted": updated_card.is_deleted,
+                "deleted_at": updated_card.deleted_at,
+                "updated_at": now,
+            }
+        if card_params:
+            session.execute(update(db.Card), list(card_params.values()))
+            _record_updates(connection, "card", card_params, existing_cards, column_mask(next(iter(card_params.values()))))
+            for card_id, params in card_params.items():
+                _, _, deck_id, due, stability, last_review = existing_cards[card_id]
+                queue_updates.append((card_id, deck_id, due, params["is_deleted"], stability, last_review, now))
+
+    # Actualizaciones parciales de tarjetas: solo las columnas presentes
+    if payload.card_patches:
+        queue_updates.extend(_apply_card_patches(session, payload.card_patches, now, conflicts))
+
+    return created_decks, created_cards, conflicts, queue_updates
+
+
+REVIEW_LOG_SYNC_FIELDS = (
+    "rating_given", "previous_stability", "previous_difficulty", "previous_lapses", "previous_state",
+    "new_stability", "new_difficulty", "new_lapses", "new_state", "time_taken_ms",
+)
+
+# INSERT ... ON CONFLICT DO NOTHING según el dialecto de la conexión
+_INSERT_IGNORING_CONFLICTS = {"sqlite": sqlite.insert, "postgresql": postgresql.insert}
+
+
+def ingest_review_logs(
+    session: Session, entries: List[m.ReviewLogSyncCreate], conflicts: List[m.ConflictInfo]
+) -> Tuple[int, int]:
+    """
+    Ingiere repasos hechos offline con un INSERT masivo que ignora los que ya
+    existen según la clave única (card_id, review_timestamp), así que
+    reenviar el mismo lote no duplica historial. Las tarjetas se resuelven por
+    id o por uuid (también las creadas en este mismo push). No hace commit.
+
+    Devuelve (repasos insertados, repasos que ya estaban registrados).
+    """
+    card_ids = _lookup(session, (db.Card.id,), db.Card.id, [e.card_id for e in entries if e.card_id is not None])
+    ids_by_uuid = {
+        card_uuid: card_id
+        for card_uuid, card_id in _lookup(
+            session, (db.Card.uuid, db.Card.id), db.Card.uuid,
+            [str(e.card_uuid) for e in entries if e.card_id is None]
+        ).values()
+    }
+
+    rows: Dict[Tuple[int, datetime], Dict[str, Any]] = {}
+    unresolved = 0
+    for entry in entries:
+        card_id = entry.card_id if entry.card_id is not None else ids_by_uuid.get(str(entry.card_uuid))
+        if card_id is None or (entry.card_id is not None and card_id not in card_ids):
+            conflicts.append(m.ConflictInfo(
+                type="card",
+                id=entry.card_id,
+                uuid=str(entry.card_uuid) if entry.card_id is None else None,
+                message=f"Tarjeta {entry.card_id or entry.card_uuid} no encontrada para registrar el repaso"
+            ))
+            unresolved += 1
+            continue
+        # SQLite guarda las fechas sin zona: se normaliza a UTC para que la clave única compare bien
+        review_timestamp = as_utc(entry.review_timestamp)
+        row = {field: getattr(entry, field) for field in REVIEW_LOG_SYNC_FIELDS}
+        row.update(
+            card_id=card_id,
+            review_timestamp=review_timestamp,
+            previous_due_date=as_utc(entry.previous_due_date),
+            new_due_date=as_utc(entry.new_due_date),
+        )
+        rows.setdefault((card_id, review_timestamp), row)
+
+    if not rows:
+        return 0, 0
+    inserted = insert_review_logs(session, list(rows.values()))
+    return inserted, len(entries) - unresolved - inserted
+
+
+def insert_review_logs(session: Session, rows: List[Dict[str, Any]]) -> int:
+    """
+    INSERT masivo de ReviewLog que ignora las filas cuya clave única
+    (card_id, review_timestamp) ya existe. No hace commit. Devuelve cuántas
+    filas se insertaron.
+    """
+    if not rows:
+        return 0
+    dialect_insert = _INSERT_IGNORING_CONFLICTS.get(session.connection().dialect.name)
+    if dialect_insert is None:
+        raise ValidationError("Ingesta de repasos no soportada en esta base de datos")
+    statement = dialect_insert(db.ReviewLog).on_conflict_do_nothing(
+        index_elements=["card_id", "review_timestamp"]
+    ).returning(db.ReviewLog.id)
+    return len(session.execute(statement, rows).all())
+
+
+def registered_review_keys(
+    session: Session, card_ids: Sequence[int], timestamps: Sequence[datetime]
+) -> Set[Tuple[int, datetime]]:
+    """
+    Claves (card_id, review_timestamp en UTC) de los repasos ya registrados
+    para esas tarjetas dentro del rango de `timestamps`.
+    """
+    if not card_ids or not timestamps:
+        return set()
+    keys: Set[Tuple[int, datetime]] = set()
+    for chunk in _chunks(list(card_ids)):
+        rows = session.execute(
+            select(db.ReviewLog.card_id, db.ReviewLog.review_timestamp).where(
+                db.ReviewLog.card_id.in_(chunk),
+                db.ReviewLog.review_timestamp >= min(timestamps),
+                db.ReviewLog.review_timestamp <= max(timestamps),
+            )
+        ).all()
+        keys.update((card_id, as_utc(review_timestamp)) for card_id, review_timestamp in rows)
+    return keys
+
+
+def _apply_card_patches(
+    session: Session, patches: List[m.CardSyncPatch], now: datetime, conflicts: List[m.ConflictInfo]
+) -> List[QueueUpdate]:
+    """
+    Aplica parches de tarjeta agrupados por conjunto de columnas: un UPDATE
+    executemany por grupo (todas las filas de un executemany deben tener las
+    mismas claves) y entradas en el registro de cambios con su máscara.
+    """
+    connection = session.connection()
+    existing_cards = _lookup(
+        session,
+        (db.Card.id, db.Card.is_deleted, db.Card.deck_id, db.Card.next_review_at,
+         db.Card.fsrs_stability, db.Card.fsrs_last_review),
+        db.Card.id,
+        [patch.id for patch in patches]
+    )
+    groups: Dict[Tuple[str, ...], Dict[int, Dict[str, Any]]] = {}
+    for patch in patches:
+        if patch.id not in existing_cards:
+            conflicts.append(m.ConflictInfo(
+                type="card",
+                id=patch.id,
+                message=f"Tarjeta con ID {patch.id} no encontrada para actualizar"
+            ))
+            continue
+        values = {
+            name: getattr(patch, name) for name in sorted(patch.model_fields_set)
+            if name in PATCHABLE_CARD_COLUMNS
+        }
+        if values:
+            groups.setdefault(tuple(values), {})[patch.id] = values
+
+    queue_updates: List[QueueUpdate] = []
+    for columns, by_id in groups.items():
+        params = [{"id": card_id, **values, "updated_at": now} for card_id, values in by_id.items()]
+        session.execute(update(db.Card), params)
+        _record_updates(connection, "card", by_id, existing_cards, column_mask(columns))
+        for card_id, values in by_id.items():
+            _, is_deleted, deck_id, due, stability, last_review = existing_cards[card_id]
+            queue_updates.append((
+                card_id, deck_id, values.get("next_review_at", due), values.get("is_deleted", is_deleted),
+                values.get("fsrs_stability", stability), values.get("fsrs_last_review", last_review), now
+            ))
+    return queue_updates
+
+
+def _record_updates(
+    connection: Any,
+    entity_type: str,
+    params: Dict[int, Dict[str, Any]],
+    existing: Dict[int, Any],
+    changed_columns: Optional[int] = None,
+) -> None:
+    """Registra como "delete" los borrados lógicos nuevos y como "update" el resto."""
+    deleted = [
+        entity_id for entity_id, values in params.items()
+        if values.get("is_deleted") and not existing[entity_id][1]
+    ]
+    deleted_set = set(deleted)
+    record_changes(connection, entity_type, deleted, "delete")
+    record_changes(
+        connection, entity_type, [entity_id for entity_id in params if entity_id not in deleted_set], "update",
+        changed_columns
+    )
+
+
+def set_device_subscriptions(session: Session, device_id: str, deck_ids: Sequence[int]) -> Tuple[List[int], List[int]]:
+    """
+    Reemplaza los mazos suscritos por un dispositivo. Las suscripciones
+    nuevas se insertan, las reactivadas y las retiradas se actualizan, y cada
+    una deja una entrada "subscription" en el registro de cambios para que el
+    siguiente pull del dispositivo traiga el mazo completo o la orden de
+    desalojarlo. No hace commit.
+
+    Devuelve (mazos suscritos, mazos desuscritos con este cambio).
+    """
+    wanted = list(dict.fromkeys(deck_ids))
+    existing_decks = _lookup(session, (db.Deck.id, db.Deck.is_deleted), db.Deck.id, wanted)
+    for deck_id in wanted:
+        if deck_id not in existing_decks or existing_decks[deck_id][1]:
+            raise NotFoundError("Mazo", deck_id)
+
+    now = datetime.now(timezone.utc)
+    connection = session.connection()
+    current = {
+        deck_id: (subscription_id, is_active)
+        for subscription_id, deck_id, is_active in session.execute(
+            select(db.DeckSubscription.id, db.DeckSubscription.deck_id, db.DeckSubscription.is_active)
+            .where(db.DeckSubscription.device_id == device_id)
+        )
+    }
+    wanted_set = set(wanted)
+    new_rows = [
+        {"device_id": device_id, "deck_id": deck_id, "is_active": True, "updated_at": now}
+        for deck_id in wanted if deck_id not in current
+    ]
+    toggled = [
+        {"id": subscription_id, "is_active": deck_id in wanted_set, "updated_at": now}
+        for deck_id, (subscription_id, is_active) in current.items()
+        if is_active != (deck_id in wanted_set)
+    ]
+    if new_rows:
+        created = _insert_returning(session, db.DeckSubscription, (db.DeckSubscription.id,), new_rows)
+        record_changes(connection, "subscription", [row[0] for row in created], "insert")
+    if toggled:
+        session.execute(update(db.DeckSubscription), toggled)
+        record_changes(connection, "subscription", [row["id"] for row in toggled], "update")
+
+    evicted = sorted(deck_id for deck_id, (_, is_active) in current.items() if is_active and deck_id not in wanted_set)
+    return sorted(wanted_set), evicted
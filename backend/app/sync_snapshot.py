@@ -0,0 +1,136 @@
+"""
+Snapshot de arranque para la primera sincronización en JuanPA.
+Se guarda en disco, ya comprimido con gzip, el pull completo de la cuenta
+(el mismo NDJSON que /api/v1/sync/pull/stream) junto con su high-water mark.
+Un dispositivo nuevo descarga el fichero tal cual y luego solo pide el delta
+con `sinceSeq`, sin que el servidor serialice toda la cuenta en cada alta.
+
+El snapshot se genera siempre fuera de las requests: en la tarea periódica o,
+si aún no existe, en segundo plano tras responder al primer cliente que lo pide.
+"""
+
+import asyncio
+import gzip
+import json
+import os
+import tempfile
+import threading
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Dict, Iterator, Optional, Tuple
+
+from sqlalchemy.engine import Engine
+from sqlmodel import Session
+
+from .change_log import current_seq
+from .fsrs_service import DEFAULT_USER_ID
+from .logging_config import get_logger
+from .sync_service import stream_pull_ndjson
+
+logger = get_logger("juanpa.sync_snapshot")
+
+SNAPSHOT_GZIP_LEVEL = 9
+SNAPSHOT_READ_CHUNK_SIZE = 64 * 1024
+
+# Una sola generación a la vez, venga de la tarea periódica o de un fallo de caché
+_build_lock = threading.Lock()
+
+
+def snapshot_paths(directory: Path, user_id: str = DEFAULT_USER_ID) -> Tuple[Path, Path]:
+    """Rutas del fichero de datos (NDJSON gzip) y de sus metadatos."""
+    return directory / f"{user_id}.ndjson.gz", directory / f"{user_id}.json"
+
+
+def load_snapshot_meta(directory: Path, user_id: str = DEFAULT_USER_ID) -> Optional[Dict[str, Any]]:
+    """Metadatos del snapshot vigente, o None si no hay snapshot completo."""
+    data_path, meta_path = snapshot_paths(directory, user_id)
+    if not data_path.exists():
+        return None
+    try:
+        return json.loads(meta_path.read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return None
+
+
+def _replace_atomically(directory: Path, target: Path, write) -> None:
+    fd, tmp_name = tempfile.mkstemp(dir=directory, prefix=f".{target.name}.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as handle:
+            write(handle)
+        os.replace(tmp_name, target)
+    except BaseException:
+        if os.path.exists(tmp_name):
+            os.unlink(tmp_name)
+        raise
+
+
+def build_snapshot(bind: Engine, directory: Path, user_id: str = DEFAULT_USER_ID) -> Dict[str, Any]:
+    """
+    Escribe un snapshot nuevo en streaming (memoria constante) y lo publica
+    con os.replace: los lectores ven el fichero anterior o el nuevo completo.
+    Los datos se reemplazan antes que los metadatos, así que el seq publicado
+    nunca es mayor que el del fichero (la primera línea del NDJSON lleva el
+    seq exacto).
+    """
+    directory.mkdir(parents=True, exist_ok=True)
+    data_path, meta_path = snapshot_paths(directory, user_id)
+    server_timestamp = datetime.now(timezone.utc)
+    header: Dict[str, Any] = {}
+
+    def write_data(handle) -> None:
+        with gzip.GzipFile(fileobj=handle, mode="wb", compresslevel=SNAPSHOT_GZIP_LEVEL, mtime=0) as out:
+            for chunk in stream_pull_ndjson(bind, None, server_timestamp):
+                if not header:
+                    header.update(json.loads(chunk.split("\n", 1)[0]))
+                out.write(chunk.encode("utf-8"))
+
+    _replace_atomically(directory, data_path, write_data)
+    meta = {
+        "user_id": user_id,
+        "last_seq": header["last_seq"],
+        "server_timestamp": server_timestamp.isoformat(),
+        "size": data_path.stat().st_size,
+    }
+    _replace_atomically(directory, meta_path, lambda handle: handle.write(json.dumps(meta).encode("utf-8")))
+    logger.info(f"Snapshot de sincronización generado: seq {meta['last_seq']}, {meta['size']} bytes")
+    return meta
+
+
+def refresh_snapshot(bind: Engine, directory: Path, user_id: str = DEFAULT_USER_ID) -> Dict[str, Any]:
+    """Regenera el snapshot solo si el registro de cambios avanzó desde el último."""
+    meta = load_snapshot_meta(directory, user_id)
+    with Session(bind) as session:
+        seq = current_seq(session)
+    if meta is not None and meta.get("last_seq") == seq:
+        return meta
+    return build_snapshot(bind, directory, user_id)
+
+
+def refresh_snapshot_once(bind: Engine, directory: Path, user_id: str = DEFAULT_USER_ID) -> bool:
+    """
+    `refresh_snapshot` salvo que ya haya una generación en curso (p. ej. varios
+    dispositivos nuevos a la vez). Devuelve False si no se hizo nada.
+    """
+    if not _build_lock.acquire(blocking=False):
+        return False
+    try:
+        refresh_snapshot(bind, directory, user_id)
+    except Exception as e:
+        logger.error(f"Error generando el snapshot de sincronización: {e}")
+    finally:
+        _build_lock.release()
+    return True
+
+
+def iter_decompressed(path: Path) -> Iterator[bytes]:
+    """Contenido descomprimido por bloques, para clientes que no aceptan gzip."""
+    with gzip.open(path, "rb") as handle:
+        while chunk := handle.read(SNAPSHOT_READ_CHUNK_SIZE):
+            yield chunk
+
+
+async def run_periodic_snapshots(bind: Engine, directory: Path, interval_seconds: int) -> None:
+    """Tarea de fondo que mantiene el snapshot al día cada `interval_seconds`."""
+    while True:
+        await asyncio.sleep(interval_seconds)
+        await asyncio.to_thread(refresh_snapshot_once, bind, directory)
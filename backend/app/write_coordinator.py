@@ -0,0 +1,206 @@
+"""
+Coordinación de escrituras para despliegues SQLite de JuanPA.
+
+SQLite admite un único escritor a la vez: con varios hilos escribiendo, los
+commits compiten por el bloqueo de la base y acaban en "database is locked".
+Aquí se resuelve en dos piezas:
+
+  - Una compuerta de escritura por proceso: cada transacción que escribe
+    espera su turno antes de su primera sentencia de escritura y lo libera
+    al confirmar o deshacer. Los escritores hacen cola en memoria en lugar de
+    reintentar contra el bloqueo de SQLite; las lecturas (WAL) no esperan.
+  - Un coordinador con un hilo y una conexión dedicados por el que pasan
+    todas las escrituras de los endpoints (`run_write`). Agrupa las que
+    llegan juntas (p. ej. repasos sueltos) en una sola transacción (group
+    commit), cada una en su propio SAVEPOINT para que el fallo de una no
+    arrastre a las demás. Las lecturas usan un pool aparte de conexiones
+    query_only (`database.read_only_engine`).
+
+La compuerta sigue protegiendo a los escritores fuera de las requests (p. ej.
+la compactación periódica del registro de cambios).
+"""
+
+import contextvars
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, List, Optional, Tuple, TypeVar
+
+from sqlalchemy import event
+from sqlalchemy.engine import Connection, Engine
+from sqlmodel import Session
+
+from .logging_config import get_logger
+
+logger = get_logger("juanpa.write_coordinator")
+
+T = TypeVar("T")
+
+# Trabajo encolado: la función, su Future y el contexto de quien lo envió
+_Job = Tuple[Callable[[Session], Any], Future, contextvars.Context]
+
+_WRITE_KEYWORDS = ("INSERT", "UPDATE", "DELETE", "REPLACE", "CREATE", "DROP", "ALTER")
+_GATE_HELD_KEY = "juanpa_write_gate_held"
+
+
+def _is_write(statement: str) -> bool:
+    return statement.lstrip()[:7].upper().startswith(_WRITE_KEYWORDS)
+
+
+class WriteGate:
+    """Turno de escritura único por proceso para un engine SQLite."""
+
+    def __init__(self, timeout: float = 5.0):
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self.waits = 0
+        self.acquired = 0
+
+    def install(self, bind: Engine) -> None:
+        event.listen(bind, "before_cursor_execute", self._before_execute)
+        event.listen(bind, "commit", self._release)
+        event.listen(bind, "rollback", self._release)
+
+    def _before_execute(self, conn: Connection, cursor, statement, parameters, context, executemany) -> None:
+        if conn.info.get(_GATE_HELD_KEY) or not _is_write(statement):
+            return
+        if not self._lock.acquire(blocking=False):
+            self.waits += 1
+            if not self._lock.acquire(timeout=self.timeout):
+                raise TimeoutError(f"Sin turno de escritura tras {self.timeout} s")
+        self.acquired += 1
+        conn.info[_GATE_HELD_KEY] = True
+
+    def _release(self, conn: Connection) -> None:
+        if conn.info.pop(_GATE_HELD_KEY, False):
+            self._lock.release()
+
+    def stats(self) -> Dict[str, int]:
+        return {"acquired": self.acquired, "waits": self.waits}
+
+
+class WriteCoordinator:
+    """
+    Ejecuta trabajos de escritura `job(session)` en un hilo propio sobre una
+    conexión dedicada, agrupando los que llegan juntos (hasta `max_batch`,
+    esperando como mucho `max_wait` segundos a que se sumen más) en un único
+    commit. El resultado de cada trabajo se entrega tras el commit.
+
+    Cada trabajo corre en una copia del contexto (ContextVars) de quien lo
+    envió, así que lo que se apoye en él, como el recuento de sentencias SQL
+    por request de query_stats, sigue viendo la request de origen.
+
+    Las sesiones del coordinador no expiran los objetos al confirmar y se
+    cierran tras cada lote, así que los objetos devueltos llegan desligados
+    pero con sus atributos cargados.
+    """
+
+    def __init__(self, bind: Engine, max_batch: int = 64, max_wait: float = 0.002):
+        self.bind = bind
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self._queue: "queue.Queue[Optional[_Job]]" = queue.Queue()
+        self._thread: Optional[threading.Thread] = None
+        self._start_lock = threading.Lock()
+        self._counters = {"jobs": 0, "batches": 0, "failed_jobs": 0, "failed_batches": 0}
+
+    def _ensure_started(self) -> None:
+        if self._thread is not None:
+            return
+        with self._start_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="juanpa-db-writer", daemon=True)
+                self._thread.start()
+
+    def submit(self, job: Callable[[Session], T]) -> "Future[T]":
+        """Encola un trabajo de escritura; el Future se resuelve tras su commit."""
+        future: "Future[T]" = Future()
+        self._ensure_started()
+        self._queue.put((job, future, contextvars.copy_context()))
+        return future
+
+    def run(self, job: Callable[[Session], T]) -> T:
+        """Encola un trabajo y espera a que su lote se confirme."""
+        return self.submit(job).result()
+
+    def close(self) -> None:
+        """Procesa lo pendiente y detiene el hilo escritor."""
+        thread = self._thread
+        if thread is None:
+            return
+        self._queue.put(None)
+        thread.join()
+        self._thread = None
+
+    def _next_batch(self) -> Tuple[List[_Job], bool]:
+        first = self._queue.get()
+        if first is None:
+            return [], True
+        batch = [first]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            try:
+                item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is None:
+                return batch, True
+            batch.append(item)
+        return batch, False
+
+    def _run(self) -> None:
+        with self.bind.connect() as connection:
+            stopping = False
+            while not stopping:
+                batch, stopping = self._next_batch()
+                if batch:
+                    self._commit_batch(connection, batch)
+
+    @staticmethod
+    def _run_job(session: Session, job: Callable[[Session], T]) -> T:
+        with session.begin_nested():
+            return job(session)
+
+    def _commit_batch(self, connection: Connection, batch: List[_Job]) -> None:
+        outcomes: List[Tuple[Future, bool, Any]] = []
+        try:
+            with Session(bind=connection, expire_on_commit=False) as session:
+                for job, future, context in batch:
+                    if not future.set_running_or_notify_cancel():
+                        continue
+                    try:
+                        outcomes.append((future, True, context.run(self._run_job, session, job)))
+                    except Exception as exc:
+                        outcomes.append((future, False, exc))
+                session.commit()
+        except Exception as exc:
+            # El commit del lote falló: ningún trabajo quedó persistido
+            logger.error(f"Error confirmando un lote de {len(batch)} escrituras: {exc}")
+            self._counters["failed_batches"] += 1
+            outcomes = [(future, False, exc) for future, _, _ in outcomes]
+
+        self._counters["batches"] += 1
+        for future, ok, value in outcomes:
+            self._counters["jobs"] += 1
+            if ok:
+                future.set_result(value)
+            else:
+                self._counters["failed_jobs"] += 1
+                future.set_exception(value)
+
+    def stats(self) -> Dict[str, Any]:
+        counters = dict(self._counters)
+        counters["avg_batch_size"] = round(counters["jobs"] / counters["batches"], 2) if counters["batches"] else 0.0
+        counters["pending"] = self._queue.qsize()
+        return counters
+
+
+def run_write(coordinator: Optional[WriteCoordinator], session: Session, job: Callable[[Session], T]) -> T:
+    """Ejecuta `job` en el coordinador si lo hay; si no, en la sesión de la request con su propio commit."""
+    if coordinator is not None:
+        return coordinator.run(job)
+    result = job(session)
+    session.commit()
+    return result
@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+"""
+Benchmark del engine de base de datos de JuanPA.
+Compara el engine anterior (SQLite sin PRAGMAs: journal DELETE y
+synchronous FULL) con el que construye build_engine (WAL, synchronous=NORMAL,
+mmap, caché y busy_timeout) bajo una carga mixta concurrente: hilos que
+registran repasos (UPDATE de tarjeta + INSERT en reviewlog, un commit cada
+uno) y hilos que leen la cola de repaso.
+
+Con --url se mide además otra base (p. ej. PostgreSQL con el QueuePool
+configurado) y se muestran las estadísticas del pool al terminar.
+
+Uso: python scripts/benchmark_db_engine.py [--cards 2000] [--seconds 5] [--writers 4] [--readers 4]
+"""
+
+import argparse
+import random
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import Dict
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from sqlalchemy import insert, select, update  # noqa: E402
+from sqlalchemy.exc import OperationalError  # noqa: E402
+from sqlalchemy.engine import Engine  # noqa: E402
+from sqlmodel import Session, SQLModel, create_engine  # noqa: E402
+
+from app import db_models as db  # noqa: E402
+from app.config import settings  # noqa: E402
+from app.database import build_engine, pool_status  # noqa: E402
+
+
+def seed(engine: Engine, n_cards: int) -> None:
+    SQLModel.metadata.create_all(engine)
+    now = datetime.now(timezone.utc)
+    with Session(engine) as session:
+        deck = db.Deck(name="Benchmark")
+        session.add(deck)
+        session.commit()
+        session.execute(insert(db.Card), [
+            {
+                "deck_id": deck.id, "front_content": [{"type": "text", "content": f"P{i}"}],
+                "back_content": [{"type": "text", "content": f"R{i}"}], "tags": [],
+                "next_review_at": now + timedelta(minutes=i), "fsrs_state": "review",
+                "created_at": now, "updated_at": now, "is_deleted": False, "uuid": db.new_uuid(),
+            }
+            for i in range(n_cards)
+        ])
+        session.commit()
+
+
+def run_workload(engine: Engine, n_cards: int, seconds: float, writers: int, readers: int) -> Dict[str, float]:
+    counts = {"writes": 0, "reads": 0, "busy": 0}
+    lock = threading.Lock()
+    deadline = time.perf_counter() + seconds
+
+    def writer(seed_value: int) -> None:
+        rng = random.Random(seed_value)
+        done = busy = 0
+        while time.perf_counter() < deadline:
+            card_id = rng.randint(1, n_cards)
+            now = datetime.now(timezone.utc)
+            try:
+                with Session(engine) as session:
+                    session.execute(
+                        update(db.Card).where(db.Card.id == card_id)
+                        .values(next_review_at=now + timedelta(days=rng.randint(1, 30)), updated_at=now)
+                    )
+                    session.execute(insert(db.ReviewLog).values(
+                        card_id=card_id, rating_given=3, review_timestamp=now + timedelta(microseconds=seed_value),
+                        new_stability=1.0, new_difficulty=5.0, new_lapses=0, new_state="review",
+                        new_due_date=now, time_taken_ms=1000,
+                    ))
+                    session.commit()
+                done += 1
+            except OperationalError:
+                busy += 1
+        with lock:
+            counts["writes"] += done
+            counts["busy"] += busy
+
+    def reader() -> None:
+        done = 0
+        while time.perf_counter() < deadline:
+            with Session(engine) as session:
+                session.execute(
+                    select(db.Card.id, db.Card.next_review_at)
+                    .where(db.Card.is_deleted == False)  # noqa: E712
+                    .order_by(db.Card.next_review_at).limit(50)
+                ).all()
+            done += 1
+        with lock:
+            counts["reads"] += done
+
+    threads = [threading.Thread(target=writer, args=(i,)) for i in range(writers)]
+    threads += [threading.Thread(target=reader) for _ in range(readers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return {key: value / seconds if key != "busy" else value for key, value in counts.items()}
+
+
+def benchmark(label: str, engine: Engine, args: argparse.Namespace) -> Dict[str, float]:
+    SQLModel.metadata.drop_all(engine)
+    seed(engine, args.cards)
+    result = run_workload(engine, args.cards, args.seconds, args.writers, args.readers)
+    print(f"{label:<28}{result['writes']:>14.1f}{result['reads']:>14.1f}{int(result['busy']):>10}")
+    return result
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark del engine de base de datos")
+    parser.add_argument("--cards", type=int, default=2000, help="Tarjetas sembradas")
+    parser.add_argument("--seconds", type=float, default=5.0, help="Duración de cada medición")
+    parser.add_argument("--writers", type=int, default=4, help="Hilos que registran repasos")
+    parser.add_argument("--readers", type=int, default=4, help="Hilos que leen la cola")
+    parser.add_argument("--url", type=str, default=None, help="URL de otra base a medir (se vacían sus tablas)")
+    args = parser.parse_args()
+
+    print(f"{'engine':<28}{'escrituras/s':>14}{'lecturas/s':>14}{'ocupado':>10}")
+    with tempfile.TemporaryDirectory() as directory:
+        baseline_url = f"sqlite:///{Path(directory) / 'baseline.db'}"
+        baseline = create_engine(baseline_url, connect_args={"check_same_thread": False})
+        before = benchmark("sqlite sin PRAGMAs", baseline, args)
+        baseline.dispose()
+
+        tuned = build_engine(settings.model_copy(update={"database_echo": False}), url=f"sqlite:///{Path(directory) / 'tuned.db'}")
+        after = benchmark("sqlite WAL + NORMAL", tuned, args)
+        tuned.dispose()
+
+    if before["writes"]:
+        print(f"\nEscrituras: x{after['writes'] / before['writes']:.1f}; lecturas: x{after['reads'] / max(before['reads'], 1):.1f}")
+
+    if args.url:
+        other = build_engine(settings.model_copy(update={"database_echo": False}), url=args.url)
+        benchmark(other.dialect.name, other, args)
+        print(f"Pool: {pool_status(other)}")
+        other.dispose()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+"""
+Benchmark de codificación de los cuerpos de sincronización de JuanPA.
+Compara tamaño y CPU (codificar + comprimir, descomprimir + decodificar) del
+JSON actual frente al JSON columnar y MessagePack, con y sin gzip/zstd, sobre
+un pull completo sintético y sobre un pull por deltas tras una sesión de repaso.
+
+Uso: python scripts/benchmark_sync_encoding.py [--cards 5000] [--repeat 5]
+"""
+
+import argparse
+import random
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Tuple
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from app.sync_codec import (  # noqa: E402
+    COLUMNAR_MEDIA_TYPE, JSON_MEDIA_TYPE, MSGPACK_MEDIA_TYPE,
+    compress, decode_body, encode_body, sync_encodings, sync_media_types,
+)
+
+WORDS = (
+    "capital país río montaña verbo sustantivo fórmula derivada integral célula "
+    "proteína enzima siglo imperio batalla tratado ecuación vector matriz átomo"
+).split()
+
+
+def _text(rng: random.Random, words: int) -> str:
+    return " ".join(rng.choice(WORDS) for _ in range(words))
+
+
+def synthetic_pull(n_cards: int, seed: int = 7) -> Dict[str, Any]:
+    """Cuerpo de pull con tipos JSON (como tras jsonable_encoder)."""
+    rng = random.Random(seed)
+    now = datetime(2026, 10, 1, tzinfo=timezone.utc)
+    decks = [
+        {
+            "name": f"Mazo {i}", "description": _text(rng, 8), "id": i + 1,
+            "created_at": now.isoformat(), "updated_at": now.isoformat(),
+            "is_deleted": False, "deleted_at": None,
+        }
+        for i in range(max(1, n_cards // 500))
+    ]
+    cards = []
+    for i in range(n_cards):
+        due = now + timedelta(days=rng.randint(0, 60), seconds=rng.randint(0, 86400))
+        cards.append({
+            "front_content": [{"type": "text", "content": _text(rng, rng.randint(4, 14)) + "?"}],
+            "back_content": [{"type": "text", "content": _text(rng, rng.randint(2, 25))}],
+            "cloze_data": None,
+            "tags": rng.sample(WORDS, rng.randint(0, 3)),
+            "next_review_at": due.isoformat(),
+            "fsrs_stability": round(rng.uniform(0.5, 200), 6),
+            "fsrs_difficulty": round(rng.uniform(1, 10), 6),
+            "fsrs_lapses": rng.randint(0, 4),
+            "fsrs_state": rng.choice(("learning", "review", "relearning")),
+            "fsrs_step": None,
+            "fsrs_last_review": (due - timedelta(days=rng.randint(1, 30))).isoformat(),
+            "id": i + 1,
+            "deck_id": rng.randint(1, len(decks)),
+            "created_at": now.isoformat(),
+            "updated_at": now.isoformat(),
+            "is_deleted": False,
+            "deleted_at": None,
+        })
+    return {
+        "server_timestamp": now.isoformat(), "decks": decks, "cards": cards,
+        "card_patches": [], "last_seq": n_cards + len(decks), "next_cursor": None,
+    }
+
+
+def review_delta(full: Dict[str, Any], n_reviewed: int) -> Dict[str, Any]:
+    """Pull por deltas tras repasar `n_reviewed` tarjetas: solo columnas FSRS."""
+    fsrs_columns = (
+        "id", "updated_at", "next_review_at", "fsrs_stability", "fsrs_difficulty",
+        "fsrs_lapses", "fsrs_state", "fsrs_step", "fsrs_last_review",
+    )
+    patches = [{key: card[key] for key in fsrs_columns} for card in full["cards"][:n_reviewed]]
+    return {**full, "decks": [], "cards": [], "card_patches": patches}
+
+
+def _timed(function: Callable[[], Any], repeat: int) -> Tuple[Any, float]:
+    best = float("inf")
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        best = min(best, time.perf_counter() - start)
+    return result, best * 1000
+
+
+def benchmark(payload: Dict[str, Any], repeat: int) -> List[Tuple[str, str, int, float, float]]:
+    rows = []
+    for media_type in sync_media_types():
+        for encoding in [None] + sync_encodings():
+            body, encode_ms = _timed(lambda: compress(encode_body(payload, media_type), encoding), repeat)
+            data, used_encoding = body
+            _, decode_ms = _timed(lambda: decode_body(data, media_type, used_encoding), repeat)
+            rows.append((media_type, used_encoding or "identity", len(data), encode_ms, decode_ms))
+    return rows
+
+
+def print_table(title: str, rows: List[Tuple[str, str, int, float, float]]) -> None:
+    baseline = next(row[2] for row in rows if row[0] == JSON_MEDIA_TYPE and row[1] == "identity")
+    labels = {JSON_MEDIA_TYPE: "json", COLUMNAR_MEDIA_TYPE: "columnar-json", MSGPACK_MEDIA_TYPE: "msgpack"}
+    print(f"\n{title}")
+    print(f"{'formato':<15}{'compresión':<12}{'bytes':>12}{'% json':>9}{'codificar ms':>15}{'decodificar ms':>17}")
+    for media_type, encoding, size, encode_ms, decode_ms in rows:
+        print(
+            f"{labels[media_type]:<15}{encoding:<12}{size:>12,}{100 * size / baseline:>8.1f}%"
+            f"{encode_ms:>15.2f}{decode_ms:>17.2f}"
+        )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark de codificación de sync")
+    parser.add_argument("--cards", type=int, default=5000, help="Tarjetas del pull completo")
+    parser.add_argument("--reviewed", type=int, default=200, help="Tarjetas repasadas en el pull por deltas")
+    parser.add_argument("--repeat", type=int, default=5, help="Repeticiones (se toma el mejor tiempo)")
+    args = parser.parse_args()
+
+    full = synthetic_pull(args.cards)
+    if MSGPACK_MEDIA_TYPE not in sync_media_types():
+        print("Aviso: msgpack no instalado, se omite MessagePack")
+    if "zstd" not in sync_encodings():
+        print("Aviso: zstandard no instalado, se omite zstd")
+    print_table(f"Pull completo: {args.cards} tarjetas", benchmark(full, args.repeat))
+    print_table(f"Pull por deltas: {args.reviewed} tarjetas repasadas", benchmark(review_delta(full, args.reviewed), args.repeat))
+
+
+if __name__ == "__main__":
+    main()
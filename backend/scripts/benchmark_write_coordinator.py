@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+"""
+Benchmark de escrituras concurrentes en SQLite para JuanPA.
+Varios hilos registran repasos sueltos (UPDATE de tarjeta + INSERT en
+reviewlog, un commit por repaso) de tres formas:
+
+  - directo: cada hilo con su sesión y sin compuerta (lo de antes);
+  - compuerta: cada hilo con su sesión, serializados por la compuerta;
+  - coordinador: los repasos se encolan y se confirman por lotes.
+
+Se informa de repasos confirmados por segundo y de errores
+("database is locked") para cada modo.
+
+Uso: python scripts/benchmark_write_coordinator.py [--threads 16] [--reviews 200] [--synchronous FULL]
+"""
+
+import argparse
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import Callable, Dict
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from sqlalchemy import insert, update  # noqa: E402
+from sqlalchemy.engine import Engine  # noqa: E402
+from sqlmodel import Session, SQLModel  # noqa: E402
+
+from app import db_models as db  # noqa: E402
+from app.config import settings  # noqa: E402
+from app.database import build_engine  # noqa: E402
+from app.write_coordinator import WriteCoordinator  # noqa: E402
+
+N_CARDS = 1000
+
+
+def seed(engine: Engine) -> None:
+    SQLModel.metadata.create_all(engine)
+    now = datetime.now(timezone.utc)
+    with Session(engine) as session:
+        deck = db.Deck(name="Benchmark")
+        session.add(deck)
+        session.commit()
+        session.execute(insert(db.Card), [
+            {
+                "deck_id": deck.id, "front_content": [], "back_content": [], "tags": [],
+                "fsrs_state": "review", "created_at": now, "updated_at": now,
+                "is_deleted": False, "uuid": db.new_uuid(),
+            }
+            for _ in range(N_CARDS)
+        ])
+        session.commit()
+
+
+def review_job(thread_index: int, review_index: int) -> Callable[[Session], None]:
+    def job(session: Session) -> None:
+        card_id = (thread_index * 7919 + review_index) % N_CARDS + 1
+        now = datetime.now(timezone.utc)
+        session.execute(
+            update(db.Card).where(db.Card.id == card_id)
+            .values(next_review_at=now + timedelta(days=3), updated_at=now)
+        )
+        session.execute(insert(db.ReviewLog).values(
+            card_id=card_id, rating_given=3,
+            review_timestamp=now + timedelta(microseconds=thread_index * 100000 + review_index),
+            new_stability=1.0, new_difficulty=5.0, new_lapses=0, new_state="review",
+            new_due_date=now, time_taken_ms=1000,
+        ))
+    return job
+
+
+def run(mode: str, directory: Path, args: argparse.Namespace) -> Dict[str, float]:
+    config = settings.model_copy(update={
+        "database_echo": False,
+        "sqlite_synchronous": args.synchronous,
+        "sqlite_single_writer": mode != "directo",
+        # Sin compuerta, el bloqueo de SQLite se reintenta como mucho busy_timeout
+        "sqlite_busy_timeout_ms": args.busy_timeout_ms,
+    })
+    engine = build_engine(config, url=f"sqlite:///{directory / f'{mode}.db'}")
+    seed(engine)
+    coordinator = WriteCoordinator(engine) if mode == "coordinador" else None
+    committed = errors = 0
+    lock = threading.Lock()
+
+    def worker(thread_index: int) -> None:
+        nonlocal committed, errors
+        ok = failed = 0
+        for review_index in range(args.reviews):
+            job = review_job(thread_index, review_index)
+            try:
+                if coordinator is not None:
+                    coordinator.run(job)
+                else:
+                    with Session(engine) as session:
+                        job(session)
+                        session.commit()
+                ok += 1
+            except Exception:
+                failed += 1
+        with lock:
+            committed += ok
+            errors += failed
+
+    start = time.perf_counter()
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(args.threads)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    batches = coordinator.stats()["avg_batch_size"] if coordinator else 1.0
+    if coordinator:
+        coordinator.close()
+    engine.dispose()
+    return {"rate": committed / elapsed, "errors": errors, "batch": batches}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark de escrituras concurrentes en SQLite")
+    parser.add_argument("--threads", type=int, default=16, help="Hilos escritores")
+    parser.add_argument("--reviews", type=int, default=200, help="Repasos por hilo")
+    parser.add_argument("--synchronous", default="NORMAL", help="PRAGMA synchronous (NORMAL o FULL)")
+    parser.add_argument("--busy-timeout-ms", type=int, default=100, help="PRAGMA busy_timeout en milisegundos")
+    args = parser.parse_args()
+
+    print(f"{'modo':<14}{'repasos/s':>12}{'errores':>10}{'lote medio':>12}")
+    with tempfile.TemporaryDirectory() as directory:
+        for mode in ("directo", "compuerta", "coordinador"):
+            result = run(mode, Path(directory), args)
+            print(f"{mode:<14}{result['rate']:>12.1f}{int(result['errors']):>10}{result['batch']:>12.1f}")
+
+
+if __name__ == "__main__":
+    main()
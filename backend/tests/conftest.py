@@ -6,39 +6,98 @@ import pytest
 import tempfile
 import os
 from fastapi.testclient import TestClient
-from sqlmodel import Session, SQLModel, create_engine
-from sqlmodel.pool import StaticPool
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlalchemy.pool import NullPool
+from sqlmodel import Session, SQLModel
+from sqlmodel.ext.asyncio.session import AsyncSession
 
 from app.main import app
-from app.database import get_session
+from app.database import (
+    build_engine, get_async_replica_engine, get_async_session, get_read_only_session, get_replica_engine, get_session,
+    get_write_coordinator
+)
+from app.db_routing import read_your_writes
+from app.write_coordinator import WriteCoordinator
+from app.review_queue import due_queue_cache
+from app.stats_service import forecast_cache
+from app.change_log import sync_watermark
+from app.idempotency import push_idempotency_cache
 from app.config import TestingSettings
+from app.middleware import SecurityMiddleware
+
+
+@pytest.fixture(name="database_path")
+def database_path_fixture(tmp_path):
+    """Base de datos SQLite temporal: en fichero para compartirla entre el engine síncrono y el asíncrono."""
+    return tmp_path / "test_juanpa.db"
 
 
 @pytest.fixture(name="session")
-def session_fixture():
-    """Fixture para crear una sesión de base de datos en memoria para tests."""
-    engine = create_engine(
-        "sqlite:///:memory:",
-        connect_args={"check_same_thread": False},
-        poolclass=StaticPool,
-    )
+def session_fixture(database_path):
+    """Fixture para crear una sesión de base de datos temporal para tests."""
+    # Mismo engine que producción: WAL y compuerta de escritura única
+    engine = build_engine(TestingSettings(), url=f"sqlite:///{database_path}")
     SQLModel.metadata.create_all(engine)
     
     with Session(engine) as session:
         yield session
+    engine.dispose()
+
+
+@pytest.fixture(name="async_engine")
+def async_engine_fixture(database_path):
+    """Engine asíncrono sobre la misma base que `session` para los endpoints async."""
+    # NullPool: las conexiones no sobreviven al event loop del TestClient
+    return create_async_engine(f"sqlite+aiosqlite:///{database_path}", poolclass=NullPool)
 
 
 @pytest.fixture(name="client")
-def client_fixture(session: Session):
+def client_fixture(session: Session, async_engine, database_path):
     """Fixture para crear un cliente de test de FastAPI."""
     def get_session_override():
         return session
 
+    # Como en producción: las lecturas síncronas van por conexiones query_only
+    read_only_engine = build_engine(TestingSettings(), url=f"sqlite:///{database_path}", read_only=True)
+
+    def get_read_only_session_override():
+        session.commit()
+        with Session(read_only_engine) as read_session:
+            yield read_session
+
+    async def get_async_session_override():
+        # Lo que la sesión síncrona del test tenga pendiente debe verse desde la asíncrona
+        session.commit()
+        async with AsyncSession(async_engine, expire_on_commit=False) as async_session:
+            yield async_session
+
+    write_coordinator = WriteCoordinator(session.get_bind())
+
     app.dependency_overrides[get_session] = get_session_override
+    app.dependency_overrides[get_async_session] = get_async_session_override
+    app.dependency_overrides[get_read_only_session] = get_read_only_session_override
+    app.dependency_overrides[get_write_coordinator] = lambda: write_coordinator
+    # Sin réplica: todas las lecturas van a la base del test
+    app.dependency_overrides[get_replica_engine] = lambda: None
+    app.dependency_overrides[get_async_replica_engine] = lambda: None
+    read_your_writes.clear()
+    # La cola de repaso en memoria no debe arrastrar tarjetas de otros tests
+    due_queue_cache.clear()
+    forecast_cache.clear()
+    sync_watermark.clear()
+    push_idempotency_cache.clear()
     
     with TestClient(app) as client:
+        # El rate limiting por IP persiste entre tests: todos llegan como "testclient"
+        middleware = app.middleware_stack
+        while middleware is not None:
+            if isinstance(middleware, SecurityMiddleware):
+                middleware.request_cache.clear()
+            middleware = getattr(middleware, "app", None)
         yield client
     
+    write_coordinator.close()
+    read_only_engine.dispose()
     app.dependency_overrides.clear()
 
 
@@ -4,6 +4,10 @@ Tests para endpoints de tarjetas.
 
 import pytest
 from fastapi.testclient import TestClient
+from sqlmodel import select
+
+from app import db_models as db
+from app.fsrs_service import get_scheduler
 
 
 def test_create_card_normal(client: TestClient, sample_deck_data, sample_card_data):
@@ -222,4 +226,42 @@ def test_get_next_review_card(client: TestClient, sample_deck_data, sample_card_
     next_card = response.json()
     assert next_card is not None
     assert next_card["id"] == created_card["id"]
-    assert next_card["fsrs_state"] == "new" 
\ No newline at end of file
+    assert next_card["fsrs_state"] == "new" 
+
+def test_review_card_writes_review_log(client: TestClient, session, sample_deck_data, sample_card_data):
+    """Test que el repaso guarda un ReviewLog con el snapshot antes/después."""
+    deck = client.post("/api/v1/decks/", json=sample_deck_data).json()
+    card_data = {**sample_card_data, "deck_id": deck["id"]}
+    created_card = client.post("/api/v1/cards/", json=card_data).json()[0]
+
+    response = client.post(
+        f"/api/v1/cards/{created_card['id']}/review",
+        json={"rating": 3, "time_taken_ms": 4200}
+    )
+    assert response.status_code == 200
+    reviewed_card = response.json()
+
+    logs = session.exec(select(db.ReviewLog).where(db.ReviewLog.card_id == created_card["id"])).all()
+    assert len(logs) == 1
+    log = logs[0]
+    assert log.rating_given == 3
+    assert log.previous_state == "new"
+    assert log.new_state == reviewed_card["fsrs_state"]
+    assert log.new_stability == reviewed_card["fsrs_stability"]
+    assert log.time_taken_ms == 4200
+
+
+def test_review_card_reuses_cached_scheduler(client: TestClient, sample_deck_data, sample_card_data):
+    """Test que los repasos reutilizan el Scheduler cacheado."""
+    deck = client.post("/api/v1/decks/", json=sample_deck_data).json()
+    card_data = {**sample_card_data, "deck_id": deck["id"]}
+    created_card = client.post("/api/v1/cards/", json=card_data).json()[0]
+
+    get_scheduler.cache_clear()
+    for rating in (1, 3, 3):
+        response = client.post(f"/api/v1/cards/{created_card['id']}/review", json={"rating": rating})
+        assert response.status_code == 200
+
+    cache_info = get_scheduler.cache_info()
+    assert cache_info.misses == 1
+    assert cache_info.hits == 2
@@ -0,0 +1,60 @@
+"""
+Tests de la configuración del engine de base de datos.
+"""
+
+import asyncio
+
+from sqlalchemy import text
+
+from app.config import TestingSettings
+from app.database import build_async_engine, build_engine
+
+
+def test_build_engine_applies_sqlite_pragmas(tmp_path):
+    """Test que cada conexión SQLite sale con WAL, synchronous=NORMAL y el resto de PRAGMAs."""
+    config = TestingSettings(sqlite_busy_timeout_ms=1234, sqlite_cache_size=-2000)
+    engine = build_engine(config, url=f"sqlite:///{tmp_path / 'juanpa.db'}")
+    try:
+        with engine.connect() as connection:
+            assert connection.execute(text("PRAGMA journal_mode")).scalar() == "wal"
+            assert connection.execute(text("PRAGMA synchronous")).scalar() == 1  # NORMAL
+            assert connection.execute(text("PRAGMA busy_timeout")).scalar() == 1234
+            assert connection.execute(text("PRAGMA cache_size")).scalar() == -2000
+    finally:
+        engine.dispose()
+    assert engine.echo is False
+
+
+def test_build_engine_in_memory_sqlite_skips_wal():
+    """Test que una base en memoria no intenta activar WAL."""
+    engine = build_engine(TestingSettings(), url="sqlite://")
+    with engine.connect() as connection:
+        assert connection.execute(text("PRAGMA journal_mode")).scalar() == "memory"
+        assert connection.execute(text("PRAGMA synchronous")).scalar() == 1
+
+
+def test_build_async_engine_uses_aiosqlite_with_pragmas(tmp_path):
+    """Test que el engine asíncrono apunta a la misma base con aiosqlite y los mismos PRAGMAs."""
+    engine = build_async_engine(TestingSettings(), url=f"sqlite:///{tmp_path / 'juanpa.db'}")
+    assert engine.url.drivername == "sqlite+aiosqlite"
+
+    async def read_pragmas():
+        try:
+            async with engine.connect() as connection:
+                journal_mode = (await connection.execute(text("PRAGMA journal_mode"))).scalar()
+                synchronous = (await connection.execute(text("PRAGMA synchronous"))).scalar()
+                return journal_mode, synchronous
+        finally:
+            await engine.dispose()
+
+    assert asyncio.run(read_pragmas()) == ("wal", 1)
+
+
+def test_pool_stats_endpoint(client):
+    """Test del endpoint de estado del pool de conexiones."""
+    response = client.get("/api/v1/db/pool/stats")
+    assert response.status_code == 200
+    stats = response.json()
+    assert stats["dialect"] == "sqlite"
+    assert stats["pool_class"]
+    assert isinstance(stats["status"], str)
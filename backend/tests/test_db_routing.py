@@ -0,0 +1,105 @@
+"""
+Tests del enrutado de lecturas a la réplica (read-your-writes).
+"""
+
+import time
+from datetime import datetime, timezone
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlalchemy.pool import NullPool
+from sqlmodel import Session, SQLModel
+
+from app import db_models as db
+from app.config import TestingSettings
+from app.database import build_engine, get_async_replica_engine, get_replica_engine
+from app.db_routing import read_your_writes
+from app.main import app
+
+PHONE = {"X-Device-Id": "movil"}
+TABLET = {"X-Device-Id": "tablet"}
+
+
+@pytest.fixture(name="replica")
+def replica_fixture(client: TestClient, tmp_path):
+    """Segunda base SQLite que hace de réplica, con un mazo que el primario no tiene."""
+    url = f"sqlite:///{tmp_path / 'replica.db'}"
+    seed_engine = build_engine(TestingSettings(), url=url)
+    SQLModel.metadata.create_all(seed_engine)
+    with Session(seed_engine) as session:
+        session.add(db.Deck(name="Mazo en la réplica"))
+        session.commit()
+    seed_engine.dispose()
+
+    replica = build_engine(TestingSettings(), url=url, read_only=True)
+    async_replica = create_async_engine(f"sqlite+aiosqlite:///{tmp_path / 'replica.db'}", poolclass=NullPool)
+    app.dependency_overrides[get_replica_engine] = lambda: replica
+    app.dependency_overrides[get_async_replica_engine] = lambda: async_replica
+    yield replica
+    replica.dispose()
+
+
+def _deck_names(client: TestClient, headers) -> list:
+    response = client.get("/api/v1/decks/", headers=headers)
+    assert response.status_code == 200
+    return sorted(deck["name"] for deck in response.json())
+
+
+def test_reads_go_to_replica_until_the_client_writes(client: TestClient, session: Session, replica, sample_card_data):
+    """Test que las lecturas van a la réplica salvo para el cliente que acaba de escribir."""
+    deck = db.Deck(name="Mazo en el primario")
+    session.add(deck)
+    session.commit()
+    card = db.Card(deck_id=deck.id, front_content=sample_card_data["front_content"], back_content=sample_card_data["back_content"])
+    session.add(card)
+    session.commit()
+
+    assert _deck_names(client, PHONE) == ["Mazo en la réplica"]
+    assert client.get(f"/api/v1/cards/{card.id}", headers=PHONE).status_code == 404
+
+    push = client.post("/api/v1/sync/push", headers=PHONE, json={
+        "client_timestamp": datetime.now(timezone.utc).isoformat(),
+        "new_decks": [{"name": "Offline"}]
+    })
+    assert push.status_code == 200
+
+    # El móvil ve lo que acaba de subir; la tablet sigue leyendo de la réplica
+    assert _deck_names(client, PHONE) == ["Mazo en el primario", "Offline"]
+    assert client.get(f"/api/v1/cards/{card.id}", headers=PHONE).status_code == 200
+    assert _deck_names(client, TABLET) == ["Mazo en la réplica"]
+    pull = client.get("/api/v1/sync/pull", params={"deviceId": "movil"})
+    assert sorted(deck["name"] for deck in pull.json()["decks"]) == ["Mazo en el primario", "Offline"]
+
+    stats = client.get("/api/v1/db/pool/stats").json()
+    assert stats["replica"]["dialect"] == "sqlite"
+    assert stats["read_routing"] == {"pinned_clients": 1, "primary_reads": 3, "replica_reads": 3}
+
+
+def test_read_your_writes_window_expires(client: TestClient, replica, sample_deck_data, monkeypatch):
+    """Test que, pasada la ventana, el cliente vuelve a leer de la réplica."""
+    monkeypatch.setattr(read_your_writes, "seconds", 0.05)
+    assert client.post("/api/v1/decks/", json=sample_deck_data, headers=PHONE).status_code == 200
+    assert sample_deck_data["name"] in _deck_names(client, PHONE)
+
+    time.sleep(0.1)
+    assert _deck_names(client, PHONE) == ["Mazo en la réplica"]
+
+
+def test_replica_engine_is_read_only(replica):
+    """Test que el engine de réplica no admite escrituras."""
+    with Session(replica) as session:
+        session.add(db.Deck(name="No debería escribirse"))
+        with pytest.raises(OperationalError):
+            session.commit()
+
+
+def test_device_id_header_allowed_cross_origin(client: TestClient):
+    """Test que el cliente web puede enviar X-Device-Id, la clave de la ventana read-your-writes."""
+    response = client.options("/api/v1/decks/", headers={
+        "Origin": "http://localhost:5173",
+        "Access-Control-Request-Method": "GET",
+        "Access-Control-Request-Headers": "x-device-id",
+    })
+    assert response.status_code == 200
@@ -0,0 +1,148 @@
+"""
+Tests para el optimizador de parámetros FSRS.
+"""
+
+from datetime import datetime, timezone, timedelta
+
+import numpy as np
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import event
+from sqlmodel import Session
+
+from app import db_models as db
+from app.fsrs_optimizer import DEFAULT_PARAMETERS, fit_parameters, load_review_history, optimizer_jobs
+from app.fsrs_service import as_utc, get_user_scheduler
+
+
+def _synthetic_history(n_cards: int = 300, reviews_per_card: int = 8, seed: int = 1):
+    """Historial sintético donde las tarjetas se recuerdan mejor de lo que predicen los pesos por defecto."""
+    rng = np.random.default_rng(seed)
+    card_ids, timestamps, ratings, from_new = [], [], [], []
+    for card_id in range(1, n_cards + 1):
+        elapsed_days = 0.0
+        stability = 5.0
+        for index in range(reviews_per_card):
+            if index == 0:
+                rating = 3
+            else:
+                retrievability = (1 + (19 / 81) * interval / stability) ** -0.5
+                rating = 3 if rng.random() < retrievability else 1
+                stability = stability * 2.5 if rating == 3 else max(1.0, stability / 2)
+            card_ids.append(card_id)
+            timestamps.append(elapsed_days * 86400)
+            ratings.append(rating)
+            from_new.append(index == 0)
+            interval = max(1.0, stability * rng.uniform(0.8, 1.5))
+            elapsed_days += interval
+    return {
+        "card_ids": np.array(card_ids),
+        "timestamps": np.array(timestamps, dtype=float),
+        "ratings": np.array(ratings, dtype=np.int8),
+        "from_new": np.array(from_new),
+    }
+
+
+def test_fit_parameters_improves_loss():
+    """Test que el ajuste reduce la pérdida respecto a los pesos por defecto."""
+    result = fit_parameters(_synthetic_history())
+
+    assert len(result["parameters"]) == len(DEFAULT_PARAMETERS)
+    assert result["loss_optimized"] < result["loss_default"]
+    assert result["cards_used"] == 300
+    assert result["reviews_used"] == 300 * 8
+
+
+def test_optimize_endpoint_and_apply(client: TestClient, session: Session):
+    """Test lanzar la optimización, consultar el resultado y aplicarlo."""
+    deck = db.Deck(name="Historial")
+    session.add(deck)
+    session.commit()
+
+    history = _synthetic_history(n_cards=60)
+    base = datetime(2025, 1, 1, tzinfo=timezone.utc)
+    for card_id in range(1, 61):
+        session.add(db.Card(id=card_id, deck_id=deck.id, front_content="q", back_content="a"))
+    for card_id, offset, rating, first in zip(*history.values()):
+        review_time = base + timedelta(seconds=float(offset))
+        session.add(db.ReviewLog(
+            card_id=int(card_id),
+            rating_given=int(rating),
+            review_timestamp=review_time,
+            previous_state="new" if first else "review",
+            new_stability=1.0,
+            new_difficulty=5.0,
+            new_lapses=0,
+            new_state="review",
+            new_due_date=review_time,
+        ))
+    session.commit()
+
+    # La request no lee el historial: eso ocurre en el proceso del pool
+    statements = []
+
+    def capture(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    engine = session.get_bind()
+    event.listen(engine, "before_cursor_execute", capture)
+    try:
+        response = client.post("/api/v1/fsrs/optimize")
+    finally:
+        event.remove(engine, "before_cursor_execute", capture)
+    assert response.status_code == 202
+    assert not any("review_timestamp" in statement for statement in statements)
+    job = response.json()
+    assert job["status"] == "running"
+    assert job["reviews"] is None
+
+    finished = optimizer_jobs.wait(job["job_id"], timeout=60)
+    assert finished["status"] == "completed"
+    assert finished["reviews"] == 60 * 8
+
+    response = client.get(f"/api/v1/fsrs/optimize/{job['job_id']}")
+    assert response.status_code == 200
+    parameters = response.json()["result"]["parameters"]
+
+    response = client.post(f"/api/v1/fsrs/optimize/{job['job_id']}/apply")
+    assert response.status_code == 200
+    assert get_user_scheduler(session).parameters == tuple(parameters)
+
+
+def test_load_review_history_converts_in_sql(session: Session):
+    """Test que las fechas llegan como epoch exacto (con microsegundos) y el primer repaso como booleano."""
+    times = [
+        datetime(2025, 3, 1, 8, 30, 15, 123456, tzinfo=timezone.utc),
+        datetime(2025, 3, 4, 9, 0, tzinfo=timezone.utc),
+    ]
+    for review_time, previous_state in zip(times, [None, "review"]):
+        session.add(db.ReviewLog(
+            card_id=7,
+            rating_given=3,
+            review_timestamp=review_time,
+            previous_state=previous_state,
+            new_stability=1.0,
+            new_difficulty=5.0,
+            new_lapses=0,
+            new_state="review",
+            new_due_date=review_time,
+        ))
+    session.commit()
+
+    history = load_review_history(session, chunk_size=1)
+    assert history["card_ids"].tolist() == [7, 7]
+    assert history["timestamps"].tolist() == [as_utc(review_time).timestamp() for review_time in times]
+    assert history["from_new"].tolist() == [True, False]
+    assert history["ratings"].dtype == np.int8
+
+
+def test_optimize_requires_history(client: TestClient):
+    """Test que sin historial suficiente no se lanza el ajuste."""
+    response = client.post("/api/v1/fsrs/optimize")
+    assert response.status_code == 422
+
+
+def test_optimize_unknown_job(client: TestClient):
+    """Test consultar un trabajo inexistente."""
+    response = client.get("/api/v1/fsrs/optimize/no-existe")
+    assert response.status_code == 404
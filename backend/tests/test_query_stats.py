@@ -0,0 +1,80 @@
+"""
+Tests de la instrumentación de SQL por request.
+"""
+
+import logging
+
+from fastapi.testclient import TestClient
+from sqlmodel import Session, select
+
+from app import db_models as db
+from app.main import app
+from app.middleware import PerformanceMiddleware
+from app.query_stats import assert_max_queries, track_queries
+
+
+def test_responses_report_db_queries_and_time(client: TestClient, sample_deck_data):
+    """Test que las respuestas llevan X-DB-Queries y X-DB-Time, también en endpoints asíncronos."""
+    client.post("/api/v1/decks/", json=sample_deck_data)
+
+    response = client.get("/api/v1/decks/")
+    assert response.status_code == 200
+    assert int(response.headers["X-DB-Queries"]) >= 1
+    assert response.headers["X-DB-Time"].endswith("s")
+
+    root = client.get("/")
+    assert root.headers["X-DB-Queries"] == "0"
+
+
+def test_read_card_loads_deck_in_the_same_query(client: TestClient, session: Session, sample_deck_data, sample_card_data):
+    """Test que leer una tarjeta con su mazo es una sola consulta."""
+    deck = client.post("/api/v1/decks/", json=sample_deck_data).json()
+    card = client.post("/api/v1/cards/", json={**sample_card_data, "deck_id": deck["id"]}).json()[0]
+    # La sesión del test es compartida: sin objetos cacheados, como en un request real
+    session.expunge_all()
+
+    response = client.get(f"/api/v1/cards/{card['id']}")
+    assert response.status_code == 200
+    assert response.json()["deck"]["id"] == deck["id"]
+    assert_max_queries(response, 1)
+
+
+def test_repeated_statements_are_flagged(client: TestClient, session: Session, caplog, monkeypatch):
+    """Test que una misma sentencia repetida se detecta como posible N+1."""
+    for i in range(3):
+        session.add(db.Deck(name=f"Mazo {i}"))
+    session.commit()
+    ids = session.exec(select(db.Deck.id)).all()
+    session.expunge_all()
+
+    with track_queries() as queries:
+        for deck_id in ids:
+            session.get(db.Deck, deck_id)
+    assert queries.count == 3
+    assert queries.repeated(3)[0][1] == 3
+    assert queries.repeated(4) == []
+
+    # La sesión de repaso lee la configuración del usuario dos veces (tamaño y scheduler)
+    middleware = app.middleware_stack
+    while not isinstance(middleware, PerformanceMiddleware):
+        middleware = middleware.app
+    monkeypatch.setattr(middleware, "n_plus_one_threshold", 2)
+    with caplog.at_level(logging.WARNING, logger="juanpa.middleware.performance"):
+        client.get("/api/v1/review/session")
+    warnings = [record for record in caplog.records if "Posible N+1" in record.getMessage()]
+    assert warnings and "usersettings" in warnings[0].statement
+
+
+def test_coordinated_writes_count_towards_the_request(client: TestClient, sample_deck_data, sample_card_data):
+    """Test que las sentencias que el coordinador de escrituras ejecuta para un request cuentan en sus cabeceras."""
+    deck = client.post("/api/v1/decks/", json=sample_deck_data).json()
+    card = client.post("/api/v1/cards/", json={**sample_card_data, "deck_id": deck["id"]}).json()[0]
+
+    response = client.post(f"/api/v1/cards/{card['id']}/review", json={"rating": 3})
+    assert response.status_code == 200
+    # Tarjeta, configuración del usuario, UPDATE de la tarjeta e INSERT del log, más el SAVEPOINT
+    assert int(response.headers["X-DB-Queries"]) >= 4
+
+    response = client.post("/api/v1/reviews/batch", json={"reviews": [{"card_id": card["id"], "rating": 3}]})
+    assert int(response.headers["X-DB-Queries"]) >= 4
+    assert_max_queries(response, 10)
@@ -0,0 +1,402 @@
+"""
+Tests para endpoints de repaso.
+"""
+
+from datetime import datetime, timezone, timedelta
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import event, update
+from sqlmodel import select
+
+from fsrs import Scheduler
+
+from app import db_models as db
+from app.fsrs_service import _preview_with_scheduler, preview_intervals
+from app.review_queue import DueCardQueue, DueQueueCache, due_queue_cache
+
+
+def _create_card(client: TestClient, deck_id: int, sample_card_data) -> dict:
+    card_data = {**sample_card_data, "deck_id": deck_id}
+    return client.post("/api/v1/cards/", json=card_data).json()[0]
+
+
+def test_review_batch(client: TestClient, session, sample_deck_data, sample_card_data):
+    """Test aplicar un lote de repasos offline."""
+    deck = client.post("/api/v1/decks/", json=sample_deck_data).json()
+    card_a = _create_card(client, deck["id"], sample_card_data)
+    card_b = _create_card(client, deck["id"], sample_card_data)
+
+    base = datetime(2026, 1, 1, 10, 0, tzinfo=timezone.utc)
+    payload = {
+        "reviews": [
+            # Desordenados a propósito: el servidor los aplica por timestamp
+            {"card_id": card_a["id"], "rating": 3, "reviewed_at": (base + timedelta(minutes=15)).isoformat()},
+            {"card_id": card_a["id"], "rating": 1, "reviewed_at": base.isoformat(), "time_taken_ms": 1500},
+            {"card_id": card_b["id"], "rating": 4, "reviewed_at": (base + timedelta(minutes=5)).isoformat()},
+        ]
+    }
+    response = client.post("/api/v1/reviews/batch", json=payload)
+    assert response.status_code == 200
+
+    body = response.json()
+    assert body["processed"] == 3
+    assert body["failed"] == 0
+    assert [result["card_id"] for result in body["results"]] == [card_a["id"], card_a["id"], card_b["id"]]
+    assert all(result["success"] for result in body["results"])
+    assert body["results"][2]["card"]["fsrs_state"] == "review"
+
+    logs = session.exec(
+        select(db.ReviewLog).where(db.ReviewLog.card_id == card_a["id"]).order_by(db.ReviewLog.review_timestamp)
+    ).all()
+    assert [log.rating_given for log in logs] == [1, 3]
+    # El segundo repaso parte del estado que dejó el primero
+    assert logs[1].previous_stability == logs[0].new_stability
+
+
+def test_review_batch_reports_missing_cards(client: TestClient, sample_deck_data, sample_card_data):
+    """Test que las tarjetas inexistentes se reportan por ítem sin abortar el lote."""
+    deck = client.post("/api/v1/decks/", json=sample_deck_data).json()
+    card = _create_card(client, deck["id"], sample_card_data)
+
+    payload = {"reviews": [{"card_id": 999, "rating": 3}, {"card_id": card["id"], "rating": 3}]}
+    response = client.post("/api/v1/reviews/batch", json=payload)
+    assert response.status_code == 200
+
+    body = response.json()
+    assert body["processed"] == 1
+    assert body["failed"] == 1
+    assert body["results"][0]["success"] is False
+    assert body["results"][0]["error"] == "Card not found"
+    assert body["results"][1]["success"] is True
+
+
+def test_review_batch_replay_is_idempotent(client: TestClient, session, sample_deck_data, sample_card_data):
+    """Test que reenviar un lote no duplica repasos ni falla, y que repasos sin fecha de la misma tarjeta no chocan."""
+    deck = client.post("/api/v1/decks/", json=sample_deck_data).json()
+    card = _create_card(client, deck["id"], sample_card_data)
+
+    base = datetime(2026, 1, 1, 10, 0, tzinfo=timezone.utc)
+    payload = {"reviews": [
+        {"card_id": card["id"], "rating": 1, "reviewed_at": base.isoformat()},
+        {"card_id": card["id"], "rating": 3, "reviewed_at": (base + timedelta(minutes=10)).isoformat()},
+    ]}
+    first = client.post("/api/v1/reviews/batch", json=payload).json()
+    assert first["processed"] == 2
+
+    replay = client.post("/api/v1/reviews/batch", json=payload)
+    assert replay.status_code == 200
+    body = replay.json()
+    assert body["processed"] == 0
+    assert body["duplicated"] == 2
+    assert body["failed"] == 0
+    assert all(result["success"] and result["duplicate"] for result in body["results"])
+    # El estado de la tarjeta no avanza con el reenvío
+    replayed_due = body["results"][1]["card"]["next_review_at"]
+    assert replayed_due.rstrip("Z") == first["results"][1]["card"]["next_review_at"].rstrip("Z")
+
+    undated = client.post("/api/v1/reviews/batch", json={"reviews": [
+        {"card_id": card["id"], "rating": 3}, {"card_id": card["id"], "rating": 4}
+    ]})
+    assert undated.status_code == 200
+    assert undated.json()["processed"] == 2
+
+    logs = session.exec(select(db.ReviewLog).where(db.ReviewLog.card_id == card["id"])).all()
+    assert len(logs) == 4
+
+
+def test_review_session_pages_with_cursor(client: TestClient, sample_deck_data, sample_card_data):
+    """Test obtener una sesión de repaso paginada por keyset."""
+    deck = client.post("/api/v1/decks/", json=sample_deck_data).json()
+    cards = [_create_card(client, deck["id"], sample_card_data) for _ in range(3)]
+    client.delete(f"/api/v1/cards/{cards[1]['id']}")
+
+    response = client.get(f"/api/v1/review/session?deck_id={deck['id']}&limit=1")
+    assert response.status_code == 200
+    first_page = response.json()
+    assert [card["id"] for card in first_page["cards"]] == [cards[0]["id"]]
+    assert first_page["cards"][0]["deck"]["id"] == deck["id"]
+    assert first_page["next_cursor"]
+
+    response = client.get(f"/api/v1/review/session?deck_id={deck['id']}&limit=1&cursor={first_page['next_cursor']}")
+    second_page = response.json()
+    # La tarjeta eliminada no aparece
+    assert [card["id"] for card in second_page["cards"]] == [cards[2]["id"]]
+    assert second_page["next_cursor"] is None
+
+
+def test_review_session_mixes_due_and_new(client: TestClient, sample_deck_data, sample_card_data):
+    """Test que el modo mixto intercala repasos vencidos y tarjetas nuevas."""
+    deck = client.post("/api/v1/decks/", json=sample_deck_data).json()
+    new_cards = [_create_card(client, deck["id"], sample_card_data) for _ in range(2)]
+    due_card = _create_card(client, deck["id"], sample_card_data)
+    past = (datetime.now(timezone.utc) - timedelta(days=2)).isoformat()
+    client.put(f"/api/v1/cards/{due_card['id']}", json={"next_review_at": past, "fsrs_state": "review"})
+
+    response = client.get("/api/v1/review/session")
+    assert [card["id"] for card in response.json()["cards"]] == [due_card["id"], new_cards[0]["id"], new_cards[1]["id"]]
+
+    response = client.get("/api/v1/review/session?mode=new")
+    assert [card["id"] for card in response.json()["cards"]] == [new_cards[0]["id"], new_cards[1]["id"]]
+
+
+def test_review_session_invalid_cursor(client: TestClient):
+    """Test que un cursor inválido se rechaza."""
+    response = client.get("/api/v1/review/session?cursor=no-es-un-cursor")
+    assert response.status_code == 400
+
+
+def test_next_card_uses_in_memory_queue(client: TestClient, sample_deck_data, sample_card_data):
+    """Test que next-card se sirve desde la cola en memoria y se actualiza al escribir."""
+    deck = client.post("/api/v1/decks/", json=sample_deck_data).json()
+    card_a = _create_card(client, deck["id"], sample_card_data)
+    card_b = _create_card(client, deck["id"], sample_card_data)
+
+    response = client.get(f"/api/v1/review/next-card?deck_id={deck['id']}")
+    assert response.json()["id"] == card_a["id"]
+
+    # Repasar la tarjeta la saca de la cola sin recargar el mazo
+    client.post(f"/api/v1/cards/{card_a['id']}/review", json={"rating": 4})
+    response = client.get(f"/api/v1/review/next-card?deck_id={deck['id']}")
+    assert response.json()["id"] == card_b["id"]
+
+    client.delete(f"/api/v1/cards/{card_b['id']}")
+    response = client.get(f"/api/v1/review/next-card?deck_id={deck['id']}")
+    assert response.json() is None
+
+    stats = client.get("/api/v1/review/queue/stats").json()
+    assert stats["misses"] == 1
+    assert stats["hits"] == 2
+    assert stats["stale"] == 0
+
+
+def test_next_card_follows_card_moved_to_another_deck(client: TestClient, session, sample_card_data):
+    """Test que una tarjeta movida de mazo deja de servirse en la cola del mazo anterior."""
+    deck_a = client.post("/api/v1/decks/", json={"name": "A"}).json()
+    deck_b = client.post("/api/v1/decks/", json={"name": "B"}).json()
+    moved = _create_card(client, deck_a["id"], sample_card_data)
+    other = _create_card(client, deck_a["id"], sample_card_data)
+    now = datetime.now(timezone.utc)
+
+    # Carga las colas de ambos mazos y la global
+    assert due_queue_cache.next_card(session, now, deck_id=deck_a["id"]).id == moved["id"]
+    assert due_queue_cache.next_card(session, now, deck_id=deck_b["id"]) is None
+    assert due_queue_cache.next_card(session, now) is not None
+
+    # Movida con aviso write-through (como hacen los endpoints tras el commit)
+    card = session.get(db.Card, moved["id"])
+    card.deck_id = deck_b["id"]
+    session.add(card)
+    session.commit()
+    due_queue_cache.cards_changed([card])
+    assert due_queue_cache.next_card(session, now, deck_id=deck_a["id"]).id == other["id"]
+    assert due_queue_cache.next_card(session, now, deck_id=deck_b["id"]).id == moved["id"]
+
+    # Movida por otro worker (sin aviso): la comprobación de mazo la descarta
+    card = session.get(db.Card, other["id"])
+    card.deck_id = deck_b["id"]
+    session.add(card)
+    session.commit()
+    assert due_queue_cache.next_card(session, now, deck_id=deck_a["id"]) is None
+    assert due_queue_cache.stats()["stale"] == 1
+
+
+def test_queue_load_runs_outside_lock_and_keeps_concurrent_changes(session, sample_card_data, monkeypatch):
+    """Test que la carga en frío no retiene el lock y no pierde los cambios que llegan mientras tanto."""
+    deck = db.Deck(name="Grande")
+    session.add(deck)
+    session.commit()
+    cards = [db.Card(deck_id=deck.id, front_content=[], back_content=[]) for _ in range(2)]
+    session.add_all(cards)
+    session.commit()
+    first_id, second_id = cards[0].id, cards[1].id
+
+    cache = DueQueueCache()
+    original_load = cache._load
+
+    def slow_load(session_, deck_id):
+        assert not cache._lock.locked()
+        queue = original_load(session_, deck_id)
+        # Otro request repasa la primera tarjeta mientras la cola se está cargando
+        cache.card_changed(first_id, deck.id, datetime.now(timezone.utc) + timedelta(days=5))
+        return queue
+
+    monkeypatch.setattr(cache, "_load", slow_load)
+    now = datetime.now(timezone.utc)
+    assert cache.next_card(session, now, deck_id=deck.id).id == second_id
+    assert cache.stats()["loaded_decks"] == 1
+
+
+def test_queue_load_builds_arrays_in_bulk(session, sample_card_data):
+    """Test que la carga masiva de la cola equivale a insertar las tarjetas una a una."""
+    deck = db.Deck(name="Masiva")
+    session.add(deck)
+    session.commit()
+    now = datetime.now(timezone.utc)
+    cards = [
+        db.Card(deck_id=deck.id, front_content=[], back_content=[]),
+        db.Card(deck_id=deck.id, front_content=[], back_content=[], fsrs_state="review", fsrs_stability=1.0,
+                fsrs_last_review=now - timedelta(days=3), next_review_at=now - timedelta(hours=1)),
+        db.Card(deck_id=deck.id, front_content=[], back_content=[], fsrs_state="review", fsrs_stability=80.0,
+                fsrs_last_review=now - timedelta(days=30), next_review_at=now - timedelta(days=2)),
+        db.Card(deck_id=deck.id, front_content=[], back_content=[], next_review_at=now + timedelta(days=1)),
+    ]
+    session.add_all(cards)
+    session.commit()
+
+    loaded = DueQueueCache()._load(session, deck.id)
+    expected = DueCardQueue()
+    for card in cards:
+        expected.upsert(card.id, card.next_review_at, card.fsrs_stability, card.fsrs_last_review, card.updated_at)
+
+    assert len(loaded) == len(cards)
+    assert all(loaded.expected_state(card.id) == expected.expected_state(card.id) for card in cards)
+    assert loaded.peek_due(now) == expected.peek_due(now) == cards[2].id
+    assert loaded.peek_at_risk(now) == expected.peek_at_risk(now) == cards[1].id
+    loaded.remove(cards[2].id)
+    loaded.remove(cards[1].id)
+    assert loaded.peek_due(now) == cards[0].id
+    assert loaded.peek_due(now + timedelta(days=2)) == cards[3].id
+
+
+def test_due_card_queue_ordering():
+    """Test del orden de la cola: repasos vencidos primero, luego nuevas."""
+
+    now = datetime.now(timezone.utc)
+    queue = DueCardQueue()
+    queue.upsert(1, None)
+    queue.upsert(2, now - timedelta(days=1))
+    queue.upsert(3, now - timedelta(days=3))
+    queue.upsert(4, now + timedelta(days=1))
+
+    assert queue.peek_due(now) == 3
+    queue.upsert(3, now + timedelta(days=5))
+    assert queue.peek_due(now) == 2
+    queue.remove(2)
+    assert queue.peek_due(now) == 1
+    queue.remove(1)
+    assert queue.peek_due(now) is None
+    assert queue.peek_due(now + timedelta(days=2)) == 4
+
+
+def test_due_card_queue_risk_ordering():
+    """Test del orden por riesgo: menor retrievability primero, sin estado FSRS al final."""
+    now = datetime.now(timezone.utc)
+    queue = DueCardQueue()
+    # Vencida hace poco pero con estabilidad baja: la de mayor riesgo
+    queue.upsert(1, now - timedelta(hours=1), stability=1.0, last_review=now - timedelta(days=3))
+    # Muy atrasada pero estable
+    queue.upsert(2, now - timedelta(days=10), stability=100.0, last_review=now - timedelta(days=40))
+    queue.upsert(3, now - timedelta(days=20))
+    queue.upsert(4, now + timedelta(days=1), stability=0.5, last_review=now - timedelta(days=30))
+
+    assert queue.peek_due(now) == 3
+    assert queue.peek_at_risk(now) == 1
+    queue.remove(1)
+    assert queue.peek_at_risk(now) == 2
+    queue.upsert(2, now + timedelta(days=30), stability=150.0, last_review=now)
+    assert queue.peek_at_risk(now) == 3
+
+
+def test_next_card_risk_order(client: TestClient, session, sample_deck_data, sample_card_data):
+    """Test de next-card con order=risk tras repasar tarjetas."""
+    deck = client.post("/api/v1/decks/", json=sample_deck_data).json()
+    card_a = _create_card(client, deck["id"], sample_card_data)
+    card_b = _create_card(client, deck["id"], sample_card_data)
+
+    now = datetime.now(timezone.utc)
+    for card_id, stability in ((card_a["id"], 50.0), (card_b["id"], 2.0)):
+        card = session.get(db.Card, card_id)
+        card.fsrs_state = "review"
+        card.fsrs_stability = stability
+        card.fsrs_last_review = now - timedelta(days=10)
+        card.next_review_at = now - timedelta(days=1)
+        session.add(card)
+    session.commit()
+
+    response = client.get(f"/api/v1/review/next-card?deck_id={deck['id']}&order=risk")
+    assert response.json()["id"] == card_b["id"]
+    response = client.get(f"/api/v1/review/next-card?deck_id={deck['id']}&order=due")
+    assert response.json()["id"] == card_a["id"]
+    assert client.get("/api/v1/review/next-card?order=oldest").status_code == 422
+
+
+
+def test_next_card_validates_against_queue_version(session, sample_card_data):
+    """Test que next-card valida con la versión guardada en la cola: una sola carga por tarjeta y detecta cambios con el mismo vencimiento."""
+    deck = db.Deck(name="Versiones")
+    session.add(deck)
+    session.commit()
+    now = datetime.now(timezone.utc)
+    cards = [
+        db.Card(deck_id=deck.id, front_content=[], back_content=[], fsrs_state="review", fsrs_stability=stability,
+                fsrs_last_review=now - timedelta(days=10), next_review_at=now - timedelta(days=1))
+        for stability in (2.0, 50.0)
+    ]
+    session.add_all(cards)
+    session.commit()
+    fragile_id, stable_id = cards[0].id, cards[1].id
+
+    cache = DueQueueCache()
+    assert cache.next_card(session, now, deck_id=deck.id, order="risk").id == fragile_id
+
+    statements = []
+
+    def capture(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    engine = session.get_bind()
+    event.listen(engine, "before_cursor_execute", capture)
+    try:
+        assert cache.next_card(session, now, deck_id=deck.id, order="risk").id == fragile_id
+    finally:
+        event.remove(engine, "before_cursor_execute", capture)
+    # Solo la fila que se devuelve (y su mazo): la validación no consulta nada más
+    assert len(statements) == 2
+    assert cache.stats()["stale"] == 0
+
+    # Otro worker cambia la estabilidad sin mover el vencimiento: la versión delata la entrada obsoleta
+    session.execute(
+        update(db.Card).where(db.Card.id == fragile_id)
+        .values(fsrs_stability=500.0, updated_at=datetime.now(timezone.utc))
+    )
+    session.commit()
+    session.expire_all()
+    assert cache.next_card(session, now, deck_id=deck.id, order="risk").id == stable_id
+    stats = cache.stats()
+    assert stats["stale"] == 1
+    assert stats["fallbacks"] == 0
+
+
+def test_preview_intervals_match_scheduler():
+    """Test que la vista previa vectorizada coincide con simular cada calificación."""
+    now = datetime.now(timezone.utc)
+    scheduler = Scheduler(enable_fuzzing=False)
+    cards = [
+        db.Card(id=1, deck_id=1, front_content=[], back_content=[], fsrs_state="new"),
+        db.Card(id=2, deck_id=1, front_content=[], back_content=[], fsrs_state="learning", fsrs_step=1,
+                fsrs_stability=3.0, fsrs_difficulty=5.0, fsrs_last_review=now - timedelta(minutes=10)),
+        db.Card(id=3, deck_id=1, front_content=[], back_content=[], fsrs_state="review",
+                fsrs_stability=12.0, fsrs_difficulty=6.5, fsrs_last_review=now - timedelta(days=14)),
+        db.Card(id=4, deck_id=1, front_content=[], back_content=[], fsrs_state="relearning", fsrs_step=0,
+                fsrs_stability=2.0, fsrs_difficulty=8.0, fsrs_last_review=now - timedelta(days=2)),
+    ]
+
+    previews = preview_intervals(cards, scheduler, now)
+
+    assert previews == [_preview_with_scheduler(card, scheduler, now) for card in cards]
+    assert previews[0] == {"again": 60, "hard": 330, "good": 600, "easy": previews[0]["easy"]}
+    assert previews[2]["again"] < previews[2]["hard"] <= previews[2]["good"] <= previews[2]["easy"]
+
+
+def test_next_card_and_session_include_intervals(client: TestClient, sample_deck_data, sample_card_data):
+    """Test que next-card y la sesión devuelven los intervalos de cada calificación."""
+    deck = client.post("/api/v1/decks/", json=sample_deck_data).json()
+    _create_card(client, deck["id"], sample_card_data)
+
+    card = client.get(f"/api/v1/review/next-card?deck_id={deck['id']}").json()
+    assert card["intervals"]["again"] == 60
+    assert card["intervals"]["easy"] >= 86400
+
+    session_cards = client.get(f"/api/v1/review/session?deck_id={deck['id']}").json()["cards"]
+    assert session_cards[0]["intervals"] == card["intervals"]
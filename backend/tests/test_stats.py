@@ -0,0 +1,106 @@
+"""
+Tests para los endpoints de estadísticas.
+"""
+
+from datetime import datetime, timezone, timedelta
+
+import numpy as np
+from fastapi.testclient import TestClient
+from sqlmodel import Session
+
+from app import db_models as db
+from app.fsrs_service import as_utc
+from app.stats_service import load_card_arrays, simulate_forecast
+
+
+def _review_card(deck_id: int, due: datetime, stability: float = 5.0) -> db.Card:
+    return db.Card(
+        deck_id=deck_id,
+        front_content=[{"type": "text", "content": "Pregunta"}],
+        back_content=[{"type": "text", "content": "Respuesta"}],
+        fsrs_state="review",
+        fsrs_stability=stability,
+        fsrs_difficulty=5.0,
+        next_review_at=due,
+        fsrs_last_review=due - timedelta(days=5),
+    )
+
+
+def test_simulate_forecast_overdue_cards_due_today():
+    """Test que las tarjetas atrasadas cuentan el primer día y luego se reprograman."""
+    now = datetime(2024, 6, 1, 12, tzinfo=timezone.utc)
+    due = now.timestamp() - 3 * 86400
+    cards = {
+        "stability": np.full(100, 10.0),
+        "difficulty": np.full(100, 5.0),
+        "due": np.full(100, due),
+        "last_review": np.full(100, due - 10 * 86400),
+    }
+
+    counts = simulate_forecast(cards, 30, now, 0.9, 36500)
+
+    assert len(counts) == 30
+    assert counts[0] == 100
+    # Las recordadas se espacian más de un día; solo las olvidadas vuelven mañana
+    assert counts[1] < 100
+    assert counts == simulate_forecast(cards, 30, now, 0.9, 36500)
+
+
+def test_load_card_arrays_converts_in_sql(session: Session):
+    """Test que las fechas llegan como epoch exacto (con microsegundos) y los nulos como NaN."""
+    deck = db.Deck(name="Arrays")
+    session.add(deck)
+    session.commit()
+    due = datetime(2025, 3, 1, 8, 30, 15, 123456, tzinfo=timezone.utc)
+    cards = [_review_card(deck.id, due), _review_card(deck.id, due + timedelta(days=2), stability=9.0)]
+    cards[1].fsrs_difficulty = None
+    cards[1].fsrs_last_review = None
+    session.add_all(cards)
+    session.commit()
+
+    arrays = load_card_arrays(session)
+    assert arrays["due"].tolist() == [as_utc(card.next_review_at).timestamp() for card in cards]
+    assert arrays["last_review"][0] == as_utc(cards[0].fsrs_last_review).timestamp()
+    assert np.isnan(arrays["last_review"][1]) and np.isnan(arrays["difficulty"][1])
+    assert arrays["stability"].tolist() == [5.0, 9.0]
+    assert all(array.dtype == np.float64 for array in arrays.values())
+
+
+def test_forecast_endpoint(client: TestClient, session: Session):
+    """Test del pronóstico: ignora tarjetas nuevas y se invalida al cambiar tarjetas."""
+    deck = db.Deck(name="Pronóstico")
+    session.add(deck)
+    session.commit()
+    now = datetime.now(timezone.utc)
+    session.add(_review_card(deck.id, now - timedelta(hours=1)))
+    session.add(_review_card(deck.id, now + timedelta(days=2)))
+    session.add(db.Card(
+        deck_id=deck.id,
+        front_content=[{"type": "text", "content": "Nueva"}],
+        back_content=[{"type": "text", "content": "Nueva"}],
+        next_review_at=now,
+    ))
+    session.commit()
+
+    response = client.get("/api/v1/stats/forecast?days=7")
+    assert response.status_code == 200
+    data = response.json()
+    assert data["days"] == 7
+    assert len(data["forecast"]) == 7
+    assert data["forecast"][0]["reviews"] == 1
+    assert data["forecast"][2]["reviews"] >= 1
+    assert data["cached"] is False
+
+    assert client.get("/api/v1/stats/forecast?days=7").json()["cached"] is True
+
+    session.add(_review_card(deck.id, now - timedelta(hours=2)))
+    session.commit()
+    data = client.get("/api/v1/stats/forecast?days=7").json()
+    assert data["cached"] is False
+    assert data["forecast"][0]["reviews"] == 2
+
+
+def test_forecast_invalid_days(client: TestClient):
+    """Test que el horizonte del pronóstico está acotado."""
+    assert client.get("/api/v1/stats/forecast?days=0").status_code == 422
+    assert client.get("/api/v1/stats/forecast?days=1000").status_code == 422
@@ -0,0 +1,944 @@
+"""
+Tests para los endpoints de sincronización.
+"""
+
+import asyncio
+import gzip
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from datetime import datetime, timezone, timedelta
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import event
+from sqlmodel import Session, select
+
+from app import db_models as db
+from app import main
+from app import models as m
+from app.exceptions import ConflictError
+from app.idempotency import IdempotencyCache, payload_fingerprint, push_idempotency_cache
+from app.change_log import current_seq, sync_watermark
+from app.sync_notifications import change_broadcaster
+from app.sync_snapshot import refresh_snapshot
+from app.sync_codec import COLUMNAR_MEDIA_TYPE, MSGPACK_MEDIA_TYPE, from_columnar, to_columnar
+
+
+def _create_card(client: TestClient, deck_id: int, sample_card_data) -> dict:
+    card_data = {**sample_card_data, "deck_id": deck_id}
+    return client.post("/api/v1/cards/", json=card_data).json()[0]
+
+
+def _read_ndjson(response) -> list:
+    return [json.loads(line) for line in response.text.splitlines() if line]
+
+
+def test_sync_pull_stream(client: TestClient, sample_deck_data, sample_card_data):
+    """Test del pull en streaming: meta, una línea por entidad y totales al final."""
+    deck = client.post("/api/v1/decks/", json=sample_deck_data).json()
+    cards = [_create_card(client, deck["id"], sample_card_data) for _ in range(3)]
+
+    response = client.get("/api/v1/sync/pull/stream")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+
+    lines = _read_ndjson(response)
+    assert lines[0]["type"] == "meta"
+    assert lines[0]["last_seq"] == client.get("/api/v1/sync/pull").json()["last_seq"]
+    assert lines[-1] == {"type": "end", "decks": 1, "cards": 3}
+    assert [line["data"]["id"] for line in lines if line["type"] == "card"] == [card["id"] for card in cards]
+    card_line = next(line for line in lines if line["type"] == "card")
+    assert card_line["data"]["front_content"] == sample_card_data["front_content"]
+    assert card_line["data"]["is_deleted"] is False
+    assert card_line["data"]["fsrs_state"] == "new"
+
+
+def test_sync_pull_stream_since_timestamp(client: TestClient, sample_deck_data, sample_card_data):
+    """Test que el pull en streaming solo incluye cambios posteriores al timestamp."""
+    deck = client.post("/api/v1/decks/", json=sample_deck_data).json()
+    _create_card(client, deck["id"], sample_card_data)
+
+    future = (datetime.now(timezone.utc) + timedelta(minutes=1)).isoformat()
+    response = client.get("/api/v1/sync/pull/stream", params={"lastSyncTimestamp": future})
+    assert _read_ndjson(response)[1:] == [{"type": "end", "decks": 0, "cards": 0}]
+
+
+def test_sync_pull_returns_all_without_limit(client: TestClient, sample_deck_data, sample_card_data):
+    """Test que el pull sin límite mantiene la respuesta completa de siempre."""
+    deck = client.post("/api/v1/decks/", json=sample_deck_data).json()
+    _create_card(client, deck["id"], sample_card_data)
+
+    data = client.get("/api/v1/sync/pull").json()
+    assert [d["id"] for d in data["decks"]] == [deck["id"]]
+    assert len(data["cards"]) == 1
+    assert data["next_cursor"] is None
+
+
+def test_sync_pull_keyset_pages(client: TestClient, session, sample_deck_data, sample_card_data):
+    """Test del pull paginado: sin huecos ni duplicados aunque compartan updated_at."""
+    deck = client.post("/api/v1/decks/", json=sample_deck_data).json()
+    card_ids = [_create_card(client, deck["id"], sample_card_data)["id"] for _ in range(7)]
+
+    # Todas las tarjetas con el mismo updated_at: el desempate es el id
+    same_instant = datetime.now(timezone.utc)
+    for card in session.exec(select(db.Card)).all():
+        card.updated_at = same_instant
+        session.add(card)
+    session.commit()
+
+    seen_decks, seen_cards, server_timestamps = [], [], set()
+    cursor = None
+    for _ in range(10):
+        params = {"limit": 3}
+        if cursor:
+            params["cursor"] = cursor
+        data = client.get("/api/v1/sync/pull", params=params).json()
+        assert len(data["decks"]) + len(data["cards"]) <= 3
+        seen_decks += [d["id"] for d in data["decks"]]
+        seen_cards += [c["id"] for c in data["cards"]]
+        server_timestamps.add(data["server_timestamp"])
+        cursor = data["next_cursor"]
+        if not cursor:
+            break
+
+    assert seen_decks == [deck["id"]]
+    assert seen_cards == card_ids
+    assert len(server_timestamps) == 1
+
+
+def test_sync_pull_invalid_cursor(client: TestClient):
+    """Test que un token de continuación inválido se rechaza."""
+    assert client.get("/api/v1/sync/pull", params={"cursor": "no-es-un-cursor"}).status_code == 400
+
+
+def test_sync_pull_since_seq(client: TestClient, session, sample_deck_data, sample_card_data):
+    """Test del pull por registro de cambios: solo lo posterior al seq, una vez por entidad."""
+    deck = client.post("/api/v1/decks/", json=sample_deck_data).json()
+    card_a = _create_card(client, deck["id"], sample_card_data)
+    card_b = _create_card(client, deck["id"], sample_card_data)
+
+    first = client.get("/api/v1/sync/pull", params={"sinceSeq": 0}).json()
+    assert [d["id"] for d in first["decks"]] == [deck["id"]]
+    assert [c["id"] for c in first["cards"]] == [card_a["id"], card_b["id"]]
+    assert first["last_seq"] > 0
+
+    # Dos cambios sobre la misma tarjeta y un borrado lógico de otra
+    client.post(f"/api/v1/cards/{card_a['id']}/review", json={"rating": 3})
+    client.post(f"/api/v1/cards/{card_a['id']}/review", json={"rating": 4})
+    client.delete(f"/api/v1/cards/{card_b['id']}")
+
+    second = client.get("/api/v1/sync/pull", params={"sinceSeq": first["last_seq"]}).json()
+    assert second["decks"] == []
+    assert [c["id"] for c in second["cards"]] == [card_a["id"], card_b["id"]]
+    assert next(c for c in second["cards"] if c["id"] == card_b["id"])["is_deleted"] is True
+    assert second["last_seq"] > first["last_seq"]
+
+    operations = session.exec(
+        select(db.ChangeLog.operation).where(db.ChangeLog.entity_id == card_b["id"], db.ChangeLog.entity_type == "card")
+    ).all()
+    assert operations == ["insert", "delete"]
+
+    third = client.get("/api/v1/sync/pull", params={"sinceSeq": second["last_seq"]}).json()
+    assert third["cards"] == [] and third["last_seq"] == second["last_seq"]
+
+
+def test_sync_pull_since_seq_pages(client: TestClient, sample_deck_data, sample_card_data):
+    """Test que el pull por seq se pagina siguiendo next_cursor."""
+    deck = client.post("/api/v1/decks/", json=sample_deck_data).json()
+    card_ids = [_create_card(client, deck["id"], sample_card_data)["id"] for _ in range(5)]
+
+    seen_cards = []
+    data = client.get("/api/v1/sync/pull", params={"sinceSeq": 0, "limit": 2}).json()
+    while True:
+        seen_cards += [c["id"] for c in data["cards"]]
+        if not data["next_cursor"]:
+            break
+        data = client.get("/api/v1/sync/pull", params={"cursor": data["next_cursor"], "limit": 2}).json()
+    assert seen_cards == card_ids
+
+
+def test_compact_change_log(client: TestClient, session, sample_deck_data, sample_card_data):
+    """Test que la compactación deja una entrada por entidad sin perder cambios."""
+    deck = client.post("/api/v1/decks/", json=sample_deck_data).json()
+    card = _create_card(client, deck["id"], sample_card_data)
+    for rating in (3, 3, 4):
+        client.post(f"/api/v1/cards/{card['id']}/review", json={"rating": rating})
+
+    before = client.get("/api/v1/sync/pull", params={"sinceSeq": 0}).json()
+    response = client.post("/api/v1/sync/changes/compact")
+    assert response.status_code == 200
+    assert response.json()["removed"] == 3
+    assert response.json()["last_seq"] == before["last_seq"]
+
+    assert len(session.exec(select(db.ChangeLog)).all()) == 2
+    after = client.get("/api/v1/sync/pull", params={"sinceSeq": 0}).json()
+    assert [c["id"] for c in after["cards"]] == [card["id"]]
+    assert after["last_seq"] == before["last_seq"]
+
+
+def _push(client: TestClient, **changes) -> dict:
+    payload = {"client_timestamp": datetime.now(timezone.utc).isoformat(), **changes}
+    response = client.post("/api/v1/sync/push", json=payload)
+    assert response.status_code == 200, response.text
+    return response.json()
+
+
+def test_sync_push_creates_and_reports_conflicts(client: TestClient, sample_deck_data, sample_card_data):
+    """Test del push: altas masivas y conflictos por nombre repetido o mazo inexistente."""
+    existing = client.post("/api/v1/decks/", json=sample_deck_data).json()
+
+    data = _push(
+        client,
+        new_decks=[{"name": "Nuevo"}, {"name": sample_deck_data["name"]}, {"name": "Nuevo"}],
+        new_cards=[
+            {**sample_card_data, "deck_id": existing["id"]},
+            {**sample_card_data, "deck_id": 9999},
+            {**sample_card_data, "deck_id": existing["id"]},
+        ],
+    )
+
+    assert [d["name"] for d in data["created_decks"]] == ["Nuevo"]
+    new_deck_id = data["created_decks"][0]["id"]
+    assert [c["deck_id"] for c in data["created_cards"]] == [existing["id"], existing["id"]]
+    assert data["created_cards"][0]["fsrs_state"] == "new"
+    assert [(c["type"], c["id"]) for c in data["conflicts"]] == [
+        ("deck", existing["id"]), ("deck", new_deck_id), ("card", 0)
+    ]
+    assert "con 3 conflictos" in data["message"]
+
+    pulled = client.get("/api/v1/sync/pull").json()
+    assert len(pulled["cards"]) == 2
+
+
+def test_sync_push_updates(client: TestClient, session, sample_deck_data, sample_card_data):
+    """Test del push: actualizaciones y borrados lógicos con registro de cambios."""
+    deck = client.post("/api/v1/decks/", json=sample_deck_data).json()
+    card_a = _create_card(client, deck["id"], sample_card_data)
+    card_b = _create_card(client, deck["id"], sample_card_data)
+    before = client.get("/api/v1/sync/pull").json()
+    cards = {c["id"]: c for c in before["cards"]}
+
+    data = _push(
+        client,
+        updated_decks=[{**before["decks"][0], "description": "Nueva descripción"}, {**before["decks"][0], "id": 777}],
+        updated_cards=[
+            {**cards[card_a["id"]], "tags": ["editada"]},
+            {**cards[card_b["id"]], "is_deleted": True, "deleted_at": datetime.now(timezone.utc).isoformat()},
+        ],
+    )
+    assert [(c["type"], c["id"]) for c in data["conflicts"]] == [("deck", 777)]
+
+    changes = client.get("/api/v1/sync/pull", params={"sinceSeq": before["last_seq"]}).json()
+    assert changes["decks"][0]["description"] == "Nueva descripción"
+    pulled = {c["id"]: c for c in changes["cards"]}
+    assert pulled[card_a["id"]]["tags"] == ["editada"]
+    assert pulled[card_b["id"]]["is_deleted"] is True
+
+    operations = session.exec(
+        select(db.ChangeLog.entity_id, db.ChangeLog.operation).where(db.ChangeLog.seq > before["last_seq"])
+    ).all()
+    assert sorted(operations) == sorted([(deck["id"], "update"), (card_a["id"], "update"), (card_b["id"], "delete")])
+
+    # La tarjeta borrada sale de la cola de repaso
+    next_card = client.get(f"/api/v1/review/next-card?deck_id={deck['id']}").json()
+    assert next_card["id"] == card_a["id"]
+
+
+def test_sync_push_query_count_is_constant(client: TestClient, session, sample_deck_data, sample_card_data):
+    """Test que el push no hace consultas por fila."""
+    deck = client.post("/api/v1/decks/", json=sample_deck_data).json()
+    statements = []
+
+    def count(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    engine = session.get_bind()
+    event.listen(engine, "before_cursor_execute", count)
+    try:
+        _push(client, new_cards=[{**sample_card_data, "deck_id": deck["id"]} for _ in range(3)])
+        small = len(statements)
+        statements.clear()
+        _push(client, new_cards=[{**sample_card_data, "deck_id": deck["id"]} for _ in range(60)])
+        large = len(statements)
+    finally:
+        event.remove(engine, "before_cursor_execute", count)
+
+    assert large == small
+
+
+def test_sync_pull_delta_after_review(client: TestClient, sample_deck_data, sample_card_data):
+    """Test del pull por deltas: tras un repaso solo viajan las columnas FSRS."""
+    deck = client.post("/api/v1/decks/", json=sample_deck_data).json()
+    reviewed = _create_card(client, deck["id"], sample_card_data)
+    baseline = client.get("/api/v1/sync/pull", params={"sinceSeq": 0}).json()["last_seq"]
+
+    client.post(f"/api/v1/cards/{reviewed['id']}/review", json={"rating": 3})
+    added = _create_card(client, deck["id"], sample_card_data)
+
+    data = client.get("/api/v1/sync/pull", params={"sinceSeq": baseline, "delta": True}).json()
+    assert [c["id"] for c in data["cards"]] == [added["id"]]
+    assert len(data["card_patches"]) == 1
+    patch = data["card_patches"][0]
+    assert patch["id"] == reviewed["id"]
+    assert patch["fsrs_state"] != "new"
+    assert {"next_review_at", "fsrs_stability", "updated_at"} <= set(patch)
+    assert not {"front_content", "back_content", "tags", "deck_id"} & set(patch)
+
+    # Sin delta todo llega completo
+    full = client.get("/api/v1/sync/pull", params={"sinceSeq": baseline}).json()
+    assert sorted(c["id"] for c in full["cards"]) == sorted([reviewed["id"], added["id"]])
+    assert full["card_patches"] == []
+
+
+def test_sync_push_card_patches(client: TestClient, session, sample_deck_data, sample_card_data):
+    """Test del push de parches: solo se escriben las columnas enviadas y se registra su máscara."""
+    deck = client.post("/api/v1/decks/", json=sample_deck_data).json()
+    card_a = _create_card(client, deck["id"], sample_card_data)
+    card_b = _create_card(client, deck["id"], sample_card_data)
+    baseline = client.get("/api/v1/sync/pull", params={"sinceSeq": 0}).json()["last_seq"]
+
+    data = _push(client, card_patches=[
+        {"id": card_a["id"], "tags": ["parche"]},
+        {"id": card_b["id"], "is_deleted": True, "deleted_at": datetime.now(timezone.utc).isoformat()},
+        {"id": 4242, "tags": []},
+    ])
+    assert [(c["type"], c["id"]) for c in data["conflicts"]] == [("card", 4242)]
+
+    stored = session.get(db.Card, card_a["id"])
+    session.refresh(stored)
+    assert stored.tags == ["parche"]
+    assert stored.front_content == sample_card_data["front_content"]
+
+    changes = client.get("/api/v1/sync/pull", params={"sinceSeq": baseline, "delta": True}).json()
+    assert changes["card_patches"] == [{"id": card_a["id"], "tags": ["parche"], "updated_at": changes["card_patches"][0]["updated_at"]}]
+    assert [(c["id"], c["is_deleted"]) for c in changes["cards"]] == [(card_b["id"], True)]
+
+    next_card = client.get(f"/api/v1/review/next-card?deck_id={deck['id']}").json()
+    assert next_card["id"] == card_a["id"]
+
+
+def test_compaction_drops_column_mask(client: TestClient, sample_deck_data, sample_card_data):
+    """Test que una entrada que absorbe otras al compactar se entrega completa."""
+    deck = client.post("/api/v1/decks/", json=sample_deck_data).json()
+    card = _create_card(client, deck["id"], sample_card_data)
+    baseline = client.get("/api/v1/sync/pull", params={"sinceSeq": 0}).json()["last_seq"]
+    _push(client, card_patches=[{"id": card["id"], "tags": ["uno"]}])
+    _push(client, card_patches=[{"id": card["id"], "front_content": [{"type": "text", "content": "Otra"}]}])
+
+    client.post("/api/v1/sync/changes/compact")
+    data = client.get("/api/v1/sync/pull", params={"sinceSeq": baseline, "delta": True}).json()
+    assert data["card_patches"] == []
+    assert data["cards"][0]["tags"] == ["uno"]
+
+
+def test_sync_pull_columnar_gzip(client: TestClient, sample_deck_data, sample_card_data):
+    """Test del pull negociado: layout columnar y gzip según Accept / Accept-Encoding."""
+    deck = client.post("/api/v1/decks/", json=sample_deck_data).json()
+    cards = [_create_card(client, deck["id"], sample_card_data) for _ in range(5)]
+
+    response = client.get(
+        "/api/v1/sync/pull",
+        headers={"Accept": COLUMNAR_MEDIA_TYPE, "Accept-Encoding": "gzip"}
+    )
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith(COLUMNAR_MEDIA_TYPE)
+    assert response.headers["content-encoding"] == "gzip"
+    assert "Accept" in response.headers["vary"]
+
+    data = response.json()
+    columns = data["cards"]["columns"]
+    assert [row[columns.index("id")] for row in data["cards"]["rows"]] == [c["id"] for c in cards]
+    assert data["decks"]["rows"][0][data["decks"]["columns"].index("name")] == sample_deck_data["name"]
+
+    plain = client.get("/api/v1/sync/pull", headers={"Accept-Encoding": "identity"})
+    assert plain.headers["content-type"].startswith("application/json")
+    assert "content-encoding" not in plain.headers
+    assert [c["id"] for c in plain.json()["cards"]] == [c["id"] for c in cards]
+
+
+def test_columnar_round_trip_keeps_sparse_patches():
+    """Test que los parches conservan la diferencia entre clave ausente y null."""
+    body = {
+        "cards": [{"id": 1, "tags": None}, {"id": 2, "tags": ["a"]}],
+        "card_patches": [{"id": 1, "tags": None}, {"id": 2, "fsrs_state": "review"}, {"id": 3, "tags": ["b"]}],
+    }
+    encoded = to_columnar(body)
+    assert encoded["cards"] == {"columns": ["id", "tags"], "rows": [[1, None], [2, ["a"]]]}
+    assert len(encoded["card_patches"]) == 2
+    decoded = from_columnar(encoded)
+    assert decoded["cards"] == body["cards"]
+    assert sorted(decoded["card_patches"], key=lambda p: p["id"]) == body["card_patches"]
+
+
+def test_sync_push_columnar_gzip(client: TestClient, sample_deck_data, sample_card_data):
+    """Test del push con cuerpo columnar comprimido con gzip."""
+    deck = client.post("/api/v1/decks/", json=sample_deck_data).json()
+    columns = ["deck_id", "front_content", "back_content", "tags"]
+    body = {
+        "client_timestamp": datetime.now(timezone.utc).isoformat(),
+        "new_cards": {
+            "columns": columns,
+            "rows": [[deck["id"], sample_card_data["front_content"], sample_card_data["back_content"], [f"t{i}"]] for i in range(3)]
+        },
+    }
+    response = client.post(
+        "/api/v1/sync/push",
+        content=gzip.compress(json.dumps(body).encode()),
+        headers={"Content-Type": COLUMNAR_MEDIA_TYPE, "Content-Encoding": "gzip"}
+    )
+    assert response.status_code == 200, response.text
+    assert [c["tags"] for c in response.json()["created_cards"]] == [["t0"], ["t1"], ["t2"]]
+
+
+def test_sync_push_rejects_unreadable_body(client: TestClient):
+    """Test que un cuerpo mal comprimido o inválido devuelve error de validación."""
+    response = client.post(
+        "/api/v1/sync/push",
+        content=b"no es gzip",
+        headers={"Content-Type": "application/json", "Content-Encoding": "gzip"}
+    )
+    assert response.status_code == 400
+
+    response = client.post("/api/v1/sync/push", json={"new_decks": []})
+    assert response.status_code == 422
+
+
+def test_sync_msgpack_round_trip(client: TestClient, sample_deck_data):
+    """Test de push y pull en MessagePack (si el paquete está instalado)."""
+    msgpack = pytest.importorskip("msgpack")
+    body = msgpack.packb({
+        "client_timestamp": datetime.now(timezone.utc).isoformat(),
+        "new_decks": {"columns": ["name", "description"], "rows": [[sample_deck_data["name"], None]]},
+    })
+    response = client.post(
+        "/api/v1/sync/push", content=body,
+        headers={"Content-Type": MSGPACK_MEDIA_TYPE, "Accept": MSGPACK_MEDIA_TYPE}
+    )
+    assert response.status_code == 200, response.text
+    assert response.headers["content-type"].startswith(MSGPACK_MEDIA_TYPE)
+
+    pulled = msgpack.unpackb(client.get("/api/v1/sync/pull", headers={"Accept": MSGPACK_MEDIA_TYPE}).content)
+    assert pulled["decks"]["rows"][0][pulled["decks"]["columns"].index("name")] == sample_deck_data["name"]
+
+
+def test_sync_pull_etag_not_modified(client: TestClient, session, async_engine, sample_deck_data, sample_card_data):
+    """Test del sondeo ETag/304: sin escrituras no se leen mazos ni tarjetas."""
+    deck = client.post("/api/v1/decks/", json=sample_deck_data).json()
+    _create_card(client, deck["id"], sample_card_data)
+
+    first = client.get("/api/v1/sync/pull")
+    etag = first.headers["etag"]
+    assert etag.startswith(f'W/"sync-{first.json()["last_seq"]}-')
+
+    statements = []
+
+    def capture(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement.lower())
+
+    # El pull es asíncrono: sus consultas pasan por el engine async
+    engines = (session.get_bind(), async_engine.sync_engine)
+    for engine in engines:
+        event.listen(engine, "before_cursor_execute", capture)
+    try:
+        probe = client.head("/api/v1/sync/pull", headers={"If-None-Match": etag})
+        repeated = client.get("/api/v1/sync/pull", headers={"If-None-Match": etag})
+    finally:
+        for engine in engines:
+            event.remove(engine, "before_cursor_execute", capture)
+    assert probe.status_code == 304
+    assert repeated.status_code == 304
+    assert repeated.headers["etag"] == etag
+    assert not any(" deck" in sql or " card" in sql for sql in statements)
+
+    # Una escritura invalida el high-water mark cacheado
+    _create_card(client, deck["id"], sample_card_data)
+    changed = client.head("/api/v1/sync/pull", headers={"If-None-Match": etag})
+    assert changed.status_code == 200
+    assert changed.headers["etag"] != etag
+    assert client.get("/api/v1/sync/pull", headers={"If-None-Match": etag}).status_code == 200
+
+
+def test_sync_pull_etag_depends_on_variant(client: TestClient, sample_deck_data, sample_card_data):
+    """Test que un ETag cacheado de una variante del pull no produce 304 en otra."""
+    deck = client.post("/api/v1/decks/", json=sample_deck_data).json()
+    _create_card(client, deck["id"], sample_card_data)
+    full = client.get("/api/v1/sync/pull")
+    etag = full.headers["etag"]
+    since_seq = full.json()["last_seq"]
+
+    for params in ({"deviceId": "phone-1"}, {"sinceSeq": 0, "delta": "true"}, {"sinceSeq": since_seq}):
+        other = client.get("/api/v1/sync/pull", params=params, headers={"If-None-Match": etag})
+        assert other.status_code == 200, params
+        assert other.headers["etag"] != etag
+        assert client.head("/api/v1/sync/pull", params=params, headers={"If-None-Match": etag}).status_code == 200
+        # Con su propio ETag, la misma variante sí responde 304
+        assert client.get("/api/v1/sync/pull", params=params, headers={"If-None-Match": other.headers["etag"]}).status_code == 304
+
+    # El orden de los parámetros no cambia la variante
+    a = client.get("/api/v1/sync/pull?sinceSeq=0&delta=true").headers["etag"]
+    b = client.get("/api/v1/sync/pull?delta=true&sinceSeq=0").headers["etag"]
+    assert a == b
+
+
+def test_sync_watermark_invalidated_after_commit_lands(session, monkeypatch):
+    """Test que un sondeo durante el COMMIT no deja cacheado el seq anterior."""
+    engine = session.get_bind()
+    monkeypatch.setattr(sync_watermark, "ttl", 60.0)
+    sync_watermark.clear()
+
+    def poll_during_commit(connection):
+        with Session(engine) as other:
+            sync_watermark.get(other)
+
+    event.listen(engine, "commit", poll_during_commit)
+    try:
+        session.add(db.Deck(name="Durante el commit"))
+        session.commit()
+    finally:
+        event.remove(engine, "commit", poll_during_commit)
+
+    with Session(engine) as other:
+        assert sync_watermark.get(other) == current_seq(other) > 0
+
+
+def test_sync_change_notified_after_commit_lands(session, monkeypatch):
+    """Test que el aviso a los suscriptores llega cuando el cambio ya es visible."""
+    engine = session.get_bind()
+    visible_at_notify = []
+
+    def notify(seq):
+        with Session(engine) as other:
+            visible_at_notify.append((seq, current_seq(other)))
+
+    monkeypatch.setattr(change_broadcaster, "_loop", asyncio.new_event_loop())
+    monkeypatch.setattr(change_broadcaster, "subscribers", 1)
+    monkeypatch.setattr(change_broadcaster, "notify", notify)
+    session.add(db.Deck(name="Aviso"))
+    session.commit()
+    change_broadcaster._loop.close()
+
+    assert len(visible_at_notify) == 1
+    seq, visible = visible_at_notify[0]
+    assert seq > 0 and visible == seq
+
+
+def test_sync_pull_paged_has_no_etag(client: TestClient, sample_deck_data, sample_card_data):
+    """Test que solo las respuestas completas llevan ETag."""
+    deck = client.post("/api/v1/decks/", json=sample_deck_data).json()
+    for _ in range(3):
+        _create_card(client, deck["id"], sample_card_data)
+
+    page = client.get("/api/v1/sync/pull", params={"limit": 2})
+    assert page.json()["next_cursor"]
+    assert "etag" not in page.headers
+    last = client.get("/api/v1/sync/pull", params={"cursor": page.json()["next_cursor"], "limit": 10})
+    # La última página cierra la misma variante que el pull sin paginar
+    assert last.headers["etag"] == client.get("/api/v1/sync/pull").headers["etag"]
+
+
+def test_sync_push_uuid_replay_does_not_duplicate(client: TestClient, sample_card_data):
+    """Test que reenviar un push con uuids de cliente no duplica ni genera conflictos."""
+    deck_uuid, card_uuid = "3f0c6d52-2c3e-4a8e-9a51-6f1c0e6b9a10", "8d2b1e7a-5c44-4f0e-b3a2-0c9d7e6f5a41"
+    changes = {
+        "new_decks": [{"name": "Offline", "uuid": deck_uuid}],
+        "new_cards": [
+            {**sample_card_data, "deck_uuid": deck_uuid, "uuid": card_uuid},
+            {**sample_card_data, "deck_uuid": "00000000-0000-4000-8000-000000000000"},
+        ],
+    }
+
+    first = _push(client, **changes)
+    assert [d["uuid"] for d in first["created_decks"]] == [deck_uuid]
+    assert [c["uuid"] for c in first["created_cards"]] == [card_uuid]
+    assert first["created_cards"][0]["deck_id"] == first["created_decks"][0]["id"]
+    assert [(c["type"], c["id"], c["uuid"]) for c in first["conflicts"]] == [
+        ("card", None, "00000000-0000-4000-8000-000000000000")
+    ]
+
+    retry = _push(client, **changes)
+    assert retry["created_decks"] == first["created_decks"]
+    assert retry["created_cards"] == first["created_cards"]
+    assert len(retry["conflicts"]) == 1
+
+    pulled = client.get("/api/v1/sync/pull").json()
+    assert len(pulled["decks"]) == 1
+    assert [c["uuid"] for c in pulled["cards"]] == [card_uuid]
+
+
+def _review_log(card_ref: dict, minutes: int, rating: int = 3) -> dict:
+    return {
+        **card_ref,
+        "rating_given": rating,
+        "review_timestamp": (datetime(2026, 10, 1, 8, tzinfo=timezone.utc) + timedelta(minutes=minutes)).isoformat(),
+        "new_stability": 3.2,
+        "new_difficulty": 5.1,
+        "new_lapses": 0,
+        "new_state": "review",
+        "new_due_date": datetime(2026, 10, 4, tzinfo=timezone.utc).isoformat(),
+        "time_taken_ms": 4200,
+    }
+
+
+def test_sync_push_review_logs_are_deduplicated(client: TestClient, session, sample_deck_data, sample_card_data):
+    """Test que los repasos offline se ingieren una sola vez por (tarjeta, review_timestamp)."""
+    deck = client.post("/api/v1/decks/", json=sample_deck_data).json()
+    card = _create_card(client, deck["id"], sample_card_data)
+    card_uuid = "5b7e2f0a-1c3d-4e5f-8a9b-0c1d2e3f4a5b"
+    logs = [
+        _review_log({"card_id": card["id"]}, 0),
+        _review_log({"card_id": card["id"]}, 0),
+        _review_log({"card_id": card["id"]}, 10, rating=1),
+        _review_log({"card_uuid": card_uuid}, 5),
+        _review_log({"card_id": 999999}, 0),
+    ]
+    changes = {"new_cards": [{**sample_card_data, "deck_id": deck["id"], "uuid": card_uuid}], "review_logs": logs}
+
+    first = _push(client, **changes)
+    assert first["review_logs_ingested"] == 3
+    assert first["review_logs_duplicated"] == 1
+    assert [(c["type"], c["id"]) for c in first["conflicts"]] == [("card", 999999)]
+
+    retry = _push(client, **changes)
+    assert retry["review_logs_ingested"] == 0
+    assert retry["review_logs_duplicated"] == 4
+
+    stored = session.exec(select(db.ReviewLog).order_by(db.ReviewLog.review_timestamp)).all()
+    assert [(log.card_id, log.rating_given) for log in stored] == [
+        (card["id"], 3), (first["created_cards"][0]["id"], 3), (card["id"], 1)
+    ]
+
+
+def test_sync_push_review_logs_query_count_is_constant(client: TestClient, session, sample_deck_data, sample_card_data):
+    """Test que la ingesta de repasos no hace consultas por fila."""
+    deck = client.post("/api/v1/decks/", json=sample_deck_data).json()
+    card = _create_card(client, deck["id"], sample_card_data)
+    statements = []
+
+    def count(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    engine = session.get_bind()
+    event.listen(engine, "before_cursor_execute", count)
+    try:
+        _push(client, review_logs=[_review_log({"card_id": card["id"]}, i) for i in range(3)])
+        small = len(statements)
+        statements.clear()
+        _push(client, review_logs=[_review_log({"card_id": card["id"]}, 100 + i) for i in range(60)])
+        large = len(statements)
+    finally:
+        event.remove(engine, "before_cursor_execute", count)
+
+    assert large == small
+    assert len(session.exec(select(db.ReviewLog)).all()) == 63
+
+
+def test_sync_pull_by_device_subscription(client: TestClient, sample_card_data):
+    """Test del pull parcial: solo los mazos suscritos, backfill al suscribir y desalojo al desuscribir."""
+    deck_a = client.post("/api/v1/decks/", json={"name": "A"}).json()
+    deck_b = client.post("/api/v1/decks/", json={"name": "B"}).json()
+    card_a = _create_card(client, deck_a["id"], sample_card_data)
+    card_b = _create_card(client, deck_b["id"], sample_card_data)
+    url = "/api/v1/sync/devices/phone-1/subscriptions"
+
+    assert client.get(url).json()["deck_ids"] == []
+    assert client.get(url).json()["all_decks"] is True
+    assert client.put(url, json={"deck_ids": [deck_a["id"]]}).json()["deck_ids"] == [deck_a["id"]]
+    assert client.get(url).json()["deck_ids"] == [deck_a["id"]]
+    assert client.get(url).json()["all_decks"] is False
+
+    for params in ({"sinceSeq": 0}, {}):
+        data = client.get("/api/v1/sync/pull", params={**params, "deviceId": "phone-1"}).json()
+        assert [d["id"] for d in data["decks"]] == [deck_a["id"]]
+        assert [c["id"] for c in data["cards"]] == [card_a["id"]]
+    # Sin deviceId (u otro dispositivo sin suscripciones) se sincroniza todo
+    full = client.get("/api/v1/sync/pull", params={"sinceSeq": 0, "deviceId": "tablet"}).json()
+    assert len(full["decks"]) == 2
+    since_seq, since = full["last_seq"], full["server_timestamp"]
+
+    changed = client.put(url, json={"deck_ids": [deck_b["id"]]}).json()
+    assert changed["evicted_deck_ids"] == [deck_a["id"]]
+
+    by_seq = client.get("/api/v1/sync/pull", params={"sinceSeq": since_seq, "deviceId": "phone-1"}).json()
+    by_time = client.get("/api/v1/sync/pull", params={"lastSyncTimestamp": since, "deviceId": "phone-1"}).json()
+    for data in (by_seq, by_time):
+        assert data["evicted_deck_ids"] == [deck_a["id"]]
+        assert [d["id"] for d in data["decks"]] == [deck_b["id"]]
+        assert [c["id"] for c in data["cards"]] == [card_b["id"]]
+
+    # Otros dispositivos no ven las suscripciones ajenas
+    other = client.get("/api/v1/sync/pull", params={"sinceSeq": since_seq}).json()
+    assert other["decks"] == [] and other["cards"] == [] and other["evicted_deck_ids"] == []
+
+    assert client.put(url, json={"deck_ids": [999999]}).status_code == 404
+    assert client.put("/api/v1/sync/devices/bad device/subscriptions", json={"deck_ids": []}).status_code == 422
+
+
+def test_sync_pull_after_unsubscribing_every_deck(client: TestClient, sample_card_data):
+    """Test que desuscribirse de todos los mazos desaloja los mazos y el pull deja de traer nada."""
+    deck_a = client.post("/api/v1/decks/", json={"name": "A"}).json()
+    deck_b = client.post("/api/v1/decks/", json={"name": "B"}).json()
+    _create_card(client, deck_a["id"], sample_card_data)
+    url = "/api/v1/sync/devices/phone-1/subscriptions"
+
+    client.put(url, json={"deck_ids": [deck_a["id"], deck_b["id"]]})
+    since_seq = client.get("/api/v1/sync/pull", params={"sinceSeq": 0, "deviceId": "phone-1"}).json()["last_seq"]
+
+    changed = client.put(url, json={"deck_ids": []}).json()
+    assert changed["deck_ids"] == [] and changed["all_decks"] is False
+    assert changed["evicted_deck_ids"] == [deck_a["id"], deck_b["id"]]
+    current = client.get(url).json()
+    assert current["deck_ids"] == [] and current["all_decks"] is False
+
+    # Los cambios posteriores en los mazos tampoco llegan al dispositivo
+    _create_card(client, deck_b["id"], sample_card_data)
+    data = client.get("/api/v1/sync/pull", params={"sinceSeq": since_seq, "deviceId": "phone-1"}).json()
+    assert data["evicted_deck_ids"] == [deck_a["id"], deck_b["id"]]
+    assert data["decks"] == [] and data["cards"] == []
+    full = client.get("/api/v1/sync/pull", params={"sinceSeq": 0, "deviceId": "phone-1"}).json()
+    assert full["decks"] == [] and full["cards"] == []
+
+
+def test_sync_push_idempotency_key(client: TestClient, session, sample_deck_data):
+    """Test que un push reintentado con Idempotency-Key devuelve la respuesta guardada sin tocar la base de datos."""
+    payload = {"client_timestamp": datetime.now(timezone.utc).isoformat(), "new_decks": [sample_deck_data]}
+    headers = {"Idempotency-Key": "push-1"}
+    first = client.post("/api/v1/sync/push", json=payload, headers=headers)
+    assert first.status_code == 200
+    assert "idempotent-replayed" not in first.headers
+
+    statements = []
+
+    def capture(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    engine = session.get_bind()
+    event.listen(engine, "before_cursor_execute", capture)
+    try:
+        retry = client.post("/api/v1/sync/push", json=payload, headers=headers)
+    finally:
+        event.remove(engine, "before_cursor_execute", capture)
+    assert retry.status_code == 200
+    assert retry.headers["idempotent-replayed"] == "true"
+    assert retry.json() == first.json()
+    assert statements == []
+
+    reused = client.post("/api/v1/sync/push", json={**payload, "new_decks": [{"name": "Otro"}]}, headers=headers)
+    assert reused.status_code == 409
+
+    # Sin la clave, el mismo cuerpo vuelve a procesarse (y choca por nombre)
+    again = _push(client, new_decks=[sample_deck_data])
+    assert len(again["conflicts"]) == 1
+
+
+def test_sync_push_idempotency_key_reserved_while_in_flight(client: TestClient, sample_deck_data):
+    """Test que un push con una Idempotency-Key en curso espera a la respuesta original en lugar de repetir la escritura."""
+    payload = {"client_timestamp": datetime.now(timezone.utc).isoformat(), "new_decks": [sample_deck_data]}
+    headers = {"Idempotency-Key": "push-concurrent"}
+    fingerprint = payload_fingerprint(m.PushRequest.model_validate(payload))
+    # Simula el push original en curso: la clave ya está reservada
+    assert push_idempotency_cache.reserve("push-concurrent", fingerprint) is None
+
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        retry = pool.submit(client.post, "/api/v1/sync/push", json=payload, headers=headers)
+        time.sleep(0.2)
+        assert not retry.done()
+        original = m.PushResponse(message="original", conflicts=[])
+        push_idempotency_cache.put("push-concurrent", fingerprint, original)
+        response = retry.result(timeout=5)
+    assert response.status_code == 200
+    assert response.headers["idempotent-replayed"] == "true"
+    assert response.json()["message"] == "original"
+    # El reintento no aplicó el push
+    assert client.get("/api/v1/decks/").json() == []
+
+    # Si el original falla, la reserva se libera y el reintento sí se procesa
+    assert push_idempotency_cache.reserve("push-failed", fingerprint) is None
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        retry = pool.submit(client.post, "/api/v1/sync/push", json=payload, headers={"Idempotency-Key": "push-failed"})
+        time.sleep(0.2)
+        push_idempotency_cache.release("push-failed")
+        response = retry.result(timeout=5)
+    assert response.status_code == 200
+    assert "idempotent-replayed" not in response.headers
+    assert [deck["name"] for deck in client.get("/api/v1/decks/").json()] == [sample_deck_data["name"]]
+
+
+def test_idempotency_cache_reserve_is_atomic():
+    """Test que de varios hilos con la misma clave solo uno ejecuta el trabajo y el resto recibe su respuesta."""
+    cache = IdempotencyCache(ttl=60, wait_timeout=5)
+    runs = []
+    barrier = threading.Barrier(8)
+
+    def attempt(i: int):
+        barrier.wait()
+        cached = cache.reserve("key", "fp")
+        if cached is not None:
+            return cached
+        runs.append(i)
+        time.sleep(0.05)
+        cache.put("key", "fp", f"respuesta-{i}")
+        return f"respuesta-{i}"
+
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        results = list(pool.map(attempt, range(8)))
+    assert len(runs) == 1
+    assert set(results) == {f"respuesta-{runs[0]}"}
+
+    # Otra clave en curso con distinto cuerpo es un conflicto inmediato; sin respuesta a tiempo, también
+    assert cache.reserve("other", "fp") is None
+    with pytest.raises(ConflictError):
+        cache.reserve("other", "otro-fp")
+    cache.wait_timeout = 0.05
+    with pytest.raises(ConflictError):
+        cache.reserve("other", "fp")
+
+
+WEB_ORIGIN = "http://localhost:5173"
+
+
+def _preflight(client: TestClient, method: str, path: str, headers: str):
+    return client.options(path, headers={
+        "Origin": WEB_ORIGIN, "Access-Control-Request-Method": method, "Access-Control-Request-Headers": headers
+    })
+
+
+def test_sync_push_idempotency_key_allowed_cross_origin(client: TestClient, sample_deck_data):
+    """Test que el cliente web puede enviar Idempotency-Key y leer la marca de respuesta repetida."""
+    assert _preflight(client, "POST", "/api/v1/sync/push", "content-type,idempotency-key").status_code == 200
+
+    payload = {"client_timestamp": datetime.now(timezone.utc).isoformat(), "new_decks": [sample_deck_data]}
+    headers = {"Origin": WEB_ORIGIN, "Idempotency-Key": "web-1"}
+    client.post("/api/v1/sync/push", json=payload, headers=headers)
+    replayed = client.post("/api/v1/sync/push", json=payload, headers=headers)
+    assert replayed.headers["Idempotent-Replayed"] == "true"
+    assert "idempotent-replayed" in replayed.headers["Access-Control-Expose-Headers"].lower()
+
+
+def test_sync_pull_etag_usable_cross_origin(client: TestClient):
+    """Test que el cliente web puede leer el ETag y reenviarlo en If-None-Match."""
+    assert _preflight(client, "GET", "/api/v1/sync/pull", "if-none-match").status_code == 200
+
+    first = client.get("/api/v1/sync/pull", headers={"Origin": WEB_ORIGIN})
+    assert "etag" in first.headers["Access-Control-Expose-Headers"].lower()
+    again = client.get("/api/v1/sync/pull", headers={"Origin": WEB_ORIGIN, "If-None-Match": first.headers["ETag"]})
+    assert again.status_code == 304
+
+
+def test_sync_subscribe_websocket_notifies_commits(client: TestClient, sample_deck_data, sample_card_data):
+    """Test del canal de avisos: el seq actual al conectar y un aviso tras cada commit con cambios."""
+    deck = client.post("/api/v1/decks/", json=sample_deck_data).json()
+    start_seq = client.get("/api/v1/sync/pull").json()["last_seq"]
+
+    with client.websocket_connect("/api/v1/sync/subscribe") as websocket:
+        hello = websocket.receive_json()
+        assert hello["type"] == "changed"
+        assert hello["last_seq"] == start_seq
+
+        card = _create_card(client, deck["id"], sample_card_data)
+        created = websocket.receive_json()
+        assert created["last_seq"] > start_seq
+
+        client.post(f"/api/v1/cards/{card['id']}/review", json={"rating": 3})
+        reviewed = websocket.receive_json()
+        assert reviewed["last_seq"] > created["last_seq"]
+        assert reviewed["last_seq"] == client.get("/api/v1/sync/pull").json()["last_seq"]
+
+
+def test_sync_change_events_stream():
+    """Test del generador SSE: evento inicial, heartbeat y aviso coalescido."""
+    class FakeRequest:
+        async def is_disconnected(self):
+            return False
+
+    async def scenario():
+        change_broadcaster.attach(asyncio.get_running_loop())
+        original = main.app_settings.sync_notify_heartbeat
+        main.app_settings.sync_notify_heartbeat = 0.05
+        events = main.sync_change_events(FakeRequest(), 4)
+        try:
+            first = await events.__anext__()
+            assert first.startswith("id: 4\nevent: changed\n")
+            assert await events.__anext__() == ": ping\n\n"
+            change_broadcaster.notify(6)
+            change_broadcaster.notify(7)
+            await asyncio.sleep(0)
+            update = await events.__anext__()
+            assert update.startswith("id: 7\n")
+            assert json.loads(update.split("data: ")[1])["last_seq"] == 7
+        finally:
+            main.app_settings.sync_notify_heartbeat = original
+            await events.aclose()
+            change_broadcaster.detach()
+        assert change_broadcaster.subscribers == 0
+
+    asyncio.run(scenario())
+
+
+def test_sync_subscribe_releases_session(client: TestClient, session, monkeypatch):
+    """Test que la suscripción SSE no retiene la sesión (ni su conexión) mientras dura."""
+    closed = []
+    monkeypatch.setattr(session, "close", lambda: closed.append(True))
+    monkeypatch.setattr(main, "sync_change_events", lambda request, last_seq: iter([f"id: {last_seq}\n\n"]))
+
+    response = client.get("/api/v1/sync/subscribe")
+    assert response.status_code == 200
+    assert closed
+
+
+@pytest.fixture
+def snapshots_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(main, "SNAPSHOTS_DIR", tmp_path)
+    return tmp_path
+
+
+def test_sync_snapshot_served_compressed(client: TestClient, session, snapshots_dir, sample_deck_data, sample_card_data):
+    """Test del snapshot de primera sincronización: fichero gzip en disco con su seq."""
+    deck = client.post("/api/v1/decks/", json=sample_deck_data).json()
+    cards = [_create_card(client, deck["id"], sample_card_data) for _ in range(3)]
+    last_seq = client.get("/api/v1/sync/pull").json()["last_seq"]
+
+    # Sin snapshot todavía: no se genera dentro de la request, sino en segundo plano tras responder
+    pending = client.get("/api/v1/sync/snapshot", headers={"Accept-Encoding": "gzip"})
+    assert pending.status_code == 202
+    assert pending.headers["retry-after"]
+
+    response = client.get("/api/v1/sync/snapshot", headers={"Accept-Encoding": "gzip"})
+    assert response.status_code == 200
+    assert response.headers["content-encoding"] == "gzip"
+    assert response.headers["x-snapshot-seq"] == str(last_seq)
+    assert (snapshots_dir / "default.ndjson.gz").exists()
+
+    lines = _read_ndjson(response)
+    assert lines[0]["type"] == "meta" and lines[0]["last_seq"] == last_seq
+    assert [line["data"]["id"] for line in lines if line["type"] == "card"] == [c["id"] for c in cards]
+    assert lines[-1] == {"type": "end", "decks": 1, "cards": 3}
+
+    plain = client.get("/api/v1/sync/snapshot", headers={"Accept-Encoding": "identity"})
+    assert "content-encoding" not in plain.headers
+    assert _read_ndjson(plain) == lines
+
+    etag = response.headers["etag"]
+    assert client.get("/api/v1/sync/snapshot", headers={"If-None-Match": etag}).status_code == 304
+
+
+def test_sync_snapshot_not_publicly_served():
+    """Test que los snapshots no quedan bajo el directorio montado en /static."""
+    assert not main.SNAPSHOTS_DIR.resolve().is_relative_to(Path(main.STATIC_DIR).resolve())
+
+
+def test_refresh_snapshot_only_when_changed(client: TestClient, session, snapshots_dir, sample_deck_data, sample_card_data):
+    """Test que el refresco periódico solo reescribe el snapshot si avanzó el seq."""
+    deck = client.post("/api/v1/decks/", json=sample_deck_data).json()
+    engine = session.get_bind()
+    first = refresh_snapshot(engine, snapshots_dir)
+    mtime = (snapshots_dir / "default.ndjson.gz").stat().st_mtime_ns
+    assert refresh_snapshot(engine, snapshots_dir) == first
+    assert (snapshots_dir / "default.ndjson.gz").stat().st_mtime_ns == mtime
+
+    _create_card(client, deck["id"], sample_card_data)
+    second = refresh_snapshot(engine, snapshots_dir)
+    assert second["last_seq"] > first["last_seq"]
+    assert client.get("/api/v1/sync/snapshot").headers["x-snapshot-seq"] == str(second["last_seq"])
@@ -0,0 +1,182 @@
+"""
+Tests del coordinador de escrituras para SQLite.
+"""
+
+import threading
+import time
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlmodel import Session, SQLModel, select
+
+from app import db_models as db
+from app.config import TestingSettings
+from app.database import build_engine, get_session
+from app.main import app
+from app.write_coordinator import WriteCoordinator
+
+
+@pytest.fixture(name="engine")
+def engine_fixture(tmp_path):
+    engine = build_engine(TestingSettings(), url=f"sqlite:///{tmp_path / 'writes.db'}")
+    SQLModel.metadata.create_all(engine)
+    yield engine
+    engine.dispose()
+
+
+def _add_deck(name: str):
+    def job(session: Session) -> int:
+        deck = db.Deck(name=name)
+        session.add(deck)
+        session.flush()
+        return deck.id
+    return job
+
+
+def test_write_coordinator_groups_commits(engine):
+    """Test que las escrituras encoladas juntas se confirman en un mismo lote."""
+    coordinator = WriteCoordinator(engine, max_batch=64, max_wait=0.05)
+    release = threading.Event()
+
+    def blocker(session: Session) -> None:
+        release.wait(5)
+
+    try:
+        first = coordinator.submit(blocker)
+        futures = [coordinator.submit(_add_deck(f"Mazo {i}")) for i in range(20)]
+        release.set()
+        first.result(5)
+        ids = [future.result(5) for future in futures]
+    finally:
+        coordinator.close()
+
+    assert len(set(ids)) == 20
+    stats = coordinator.stats()
+    assert stats["jobs"] == 21
+    assert stats["batches"] < stats["jobs"]
+    with Session(engine) as session:
+        assert len(session.exec(select(db.Deck)).all()) == 20
+
+
+def test_write_coordinator_isolates_failed_jobs(engine):
+    """Test que un trabajo que falla no deshace los demás del mismo lote."""
+    coordinator = WriteCoordinator(engine, max_wait=0.05)
+
+    def failing(session: Session) -> None:
+        session.add(db.Deck(name="Fallido"))
+        session.flush()
+        raise ValueError("boom")
+
+    try:
+        futures = [coordinator.submit(_add_deck("A")), coordinator.submit(failing), coordinator.submit(_add_deck("B"))]
+        assert futures[0].result(5) and futures[2].result(5)
+        with pytest.raises(ValueError):
+            futures[1].result(5)
+    finally:
+        coordinator.close()
+
+    with Session(engine) as session:
+        assert sorted(deck.name for deck in session.exec(select(db.Deck))) == ["A", "B"]
+
+
+def test_write_gate_queues_concurrent_writers(engine):
+    """Test que un segundo escritor espera turno en vez de fallar con "database is locked"."""
+    errors = []
+
+    with Session(engine) as holder:
+        holder.add(db.Deck(name="Primero"))
+        holder.flush()  # transacción de escritura abierta
+
+        def second_writer():
+            try:
+                with Session(engine) as session:
+                    session.add(db.Deck(name="Segundo"))
+                    session.commit()
+            except Exception as exc:
+                errors.append(exc)
+
+        thread = threading.Thread(target=second_writer)
+        thread.start()
+        time.sleep(0.1)
+        assert thread.is_alive()
+        holder.commit()
+        thread.join(5)
+
+    assert errors == []
+    with Session(engine) as session:
+        assert len(session.exec(select(db.Deck)).all()) == 2
+
+
+def test_review_goes_through_write_coordinator(client: TestClient, sample_deck_data, sample_card_data):
+    """Test que el repaso de una tarjeta se escribe a través del coordinador."""
+    deck = client.post("/api/v1/decks/", json=sample_deck_data).json()
+    card = client.post("/api/v1/cards/", json={**sample_card_data, "deck_id": deck["id"]}).json()[0]
+    before = client.get("/api/v1/db/pool/stats").json()["write_coordinator"]
+
+    response = client.post(f"/api/v1/cards/{card['id']}/review", json={"rating": 3})
+    assert response.status_code == 200
+    assert response.json()["fsrs_state"] != "new"
+    assert client.post("/api/v1/cards/999999/review", json={"rating": 3}).status_code == 404
+
+    stats = client.get("/api/v1/db/pool/stats").json()["write_coordinator"]
+    assert stats["jobs"] - before["jobs"] == 2
+    assert stats["failed_jobs"] - before["failed_jobs"] == 1
+
+
+def test_batch_review_and_sync_push_go_through_write_coordinator(client: TestClient, sample_deck_data, sample_card_data):
+    """Test que el lote de repasos y el push de sincronización se escriben a través del coordinador."""
+    deck = client.post("/api/v1/decks/", json=sample_deck_data).json()
+    card = client.post("/api/v1/cards/", json={**sample_card_data, "deck_id": deck["id"]}).json()[0]
+    before = client.get("/api/v1/db/pool/stats").json()["write_coordinator"]
+
+    response = client.post("/api/v1/reviews/batch", json={"reviews": [{"card_id": card["id"], "rating": 3}]})
+    assert response.status_code == 200
+    assert response.json()["processed"] == 1
+
+    response = client.post("/api/v1/sync/push", json={
+        "client_timestamp": "2026-01-01T10:00:00+00:00",
+        "new_cards": [{**sample_card_data, "deck_id": deck["id"]}],
+    })
+    assert response.status_code == 200
+    assert len(response.json()["created_cards"]) == 1
+
+    stats = client.get("/api/v1/db/pool/stats").json()["write_coordinator"]
+    assert stats["jobs"] - before["jobs"] == 2
+    assert stats["failed_jobs"] == 0
+
+
+def test_crud_goes_through_write_coordinator(client: TestClient, sample_deck_data, sample_card_data):
+    """Test que las altas, cambios y bajas de mazos y tarjetas se escriben a través del coordinador."""
+    deck = client.post("/api/v1/decks/", json=sample_deck_data).json()
+    assert client.post("/api/v1/decks/", json=sample_deck_data).status_code == 400
+    card = client.post("/api/v1/cards/", json={**sample_card_data, "deck_id": deck["id"]}).json()[0]
+    assert client.put(f"/api/v1/decks/{deck['id']}", json={"description": "Otra"}).json()["description"] == "Otra"
+    assert client.put(f"/api/v1/cards/{card['id']}", json={"tags": ["nueva"]}).json()["tags"] == ["nueva"]
+    assert client.delete(f"/api/v1/cards/{card['id']}").status_code == 200
+    assert client.delete(f"/api/v1/decks/{deck['id']}").status_code == 200
+
+    stats = client.get("/api/v1/db/pool/stats").json()["write_coordinator"]
+    assert stats["jobs"] == 7
+    assert stats["failed_jobs"] == 1
+
+
+def test_read_routes_use_read_only_connections(client: TestClient, sample_deck_data, sample_card_data):
+    """Test que las lecturas síncronas van por conexiones query_only que ven lo confirmado por el coordinador."""
+    deck = client.post("/api/v1/decks/", json=sample_deck_data).json()
+    card = client.post("/api/v1/cards/", json={**sample_card_data, "deck_id": deck["id"]}).json()[0]
+
+    # Sin la sesión de escritura las rutas de lectura siguen respondiendo
+    def no_write_session():
+        raise AssertionError("Ruta de lectura usando la sesión de escritura")
+
+    app.dependency_overrides[get_session] = no_write_session
+    for path in (
+        f"/api/v1/cards/{card['id']}",
+        f"/api/v1/decks/{deck['id']}",
+        "/api/v1/review/next-card",
+        "/api/v1/review/session",
+        "/api/v1/stats/forecast?days=7",
+        "/api/v1/sync/devices/phone-1/subscriptions",
+    ):
+        response = client.get(path)
+        assert response.status_code in (200, 503), path
@@ -189,7 +189,7 @@ export interface PushRequest {
 
 export interface ConflictInfo {
   type: string; // 'deck' o 'card' o 'new_deck_creation'
-  id: number; // ID del objeto en conflicto, o -1 para errores de creación sin ID específico
+  id?: number | null; // ID del objeto en conflicto, o 0 para altas que aún no tienen ID en el servidor
   identifier?: string; // Nombre u otro identificador textual del objeto en conflicto
   // client_version: DeckUpdatePayload | CardUpdatePayload; // O los tipos Create si aplica
   // server_version: Deck | Card; // O los tipos Read/Base del servidor